@@ -0,0 +1,245 @@
+"""Адаптивное управление параллельными запросами к OpenAI-совместимому серверу.
+
+Фиксированное число одновременных запросов либо недогружает сервер
+инференса (vLLM собирает запросы в батчи), либо перегружает его.
+``AdaptiveLimiter`` подбирает число запросов в работе по схеме AIMD:
+
+* пока запросы завершаются успешно и задержка не растёт, лимит
+  увеличивается на единицу за каждое «окно» из ``limit`` успешных запросов;
+* при перегрузке (429, 5xx, таймаут, обрыв соединения) лимит
+  уменьшается вдвое, но не чаще одного раза на окно;
+* лимит всегда остаётся в пределах ``[min_limit, max_limit]``.
+
+``RequestPool`` выполняет запросы под контролем лимитера, с таймаутом на
+запрос и повторами с экспоненциальной задержкой и случайным разбросом.
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI
+
+T = TypeVar("T")
+
+# Коэффициент сглаживания скользящего среднего задержки
+_LATENCY_EWMA_ALPHA = 0.2
+
+
+def create_client(
+    base_url: Optional[str], max_connections: int, api_key: str = "token-test"
+) -> AsyncOpenAI:
+    """Создаёт клиент с пулом соединений под заданное число параллельных запросов.
+
+    Встроенные повторы клиента отключены — ими управляет ``RequestPool``.
+
+    Args:
+        base_url (Optional[str]): Адрес OpenAI-совместимого сервера.
+        max_connections (int): Размер пула HTTP-соединений.
+        api_key (str): Токен доступа.
+
+    Returns:
+        AsyncOpenAI: Клиент с общим пулом keep-alive соединений.
+    """
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+        timeout=None,
+    )
+    return AsyncOpenAI(
+        base_url=base_url, api_key=api_key, max_retries=0, http_client=http_client
+    )
+
+
+def is_overload_error(err: BaseException) -> bool:
+    """Проверяет, сигнализирует ли ошибка о перегрузке сервера.
+
+    Такие ошибки имеет смысл повторять и на них нужно снижать нагрузку.
+    """
+    if isinstance(err, (asyncio.TimeoutError, APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(err, APIStatusError):
+        return err.status_code == 429 or err.status_code >= 500
+    return False
+
+
+class AdaptiveLimiter:
+    """Лимит одновременных запросов, подстраиваемый по схеме AIMD.
+
+    Args:
+        initial_limit (int): Начальный лимит.
+        min_limit (int): Нижняя граница лимита.
+        max_limit (int): Жёсткий потолок лимита.
+        latency_tolerance (float): Во сколько раз сглаженная задержка может
+            превысить лучшую наблюдавшуюся, чтобы лимит ещё рос.
+        decrease_factor (float): Множитель лимита при перегрузке.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 3,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self.best_latency_ewma: Optional[float] = None
+        self.peak_limit = int(self.limit)
+        self._successes_in_window = 0
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    @property
+    def _cond(self) -> asyncio.Condition:
+        # Создаём лениво, чтобы привязаться к работающему циклу событий
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self) -> float:
+        """Ждёт свободный слот и занимает его.
+
+        Returns:
+            float: Момент занятия слота (``time.monotonic()``).
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self) -> None:
+        """Освобождает слот."""
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _latency_healthy(self) -> bool:
+        if self.latency_ewma is None or self.best_latency_ewma is None:
+            return True
+        return self.latency_ewma <= self.best_latency_ewma * self.latency_tolerance
+
+    async def on_success(self, latency: float) -> None:
+        """Учитывает успешный запрос и при здоровой задержке повышает лимит.
+
+        Args:
+            latency (float): Длительность запроса в секундах.
+        """
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += _LATENCY_EWMA_ALPHA * (latency - self.latency_ewma)
+        if self.best_latency_ewma is None or self.latency_ewma < self.best_latency_ewma:
+            self.best_latency_ewma = self.latency_ewma
+
+        self._successes_in_window += 1
+        if self._successes_in_window >= int(self.limit) and self._latency_healthy():
+            self._successes_in_window = 0
+            async with self._cond:
+                self.limit = min(self.limit + 1, float(self.max_limit))
+                self.peak_limit = max(self.peak_limit, int(self.limit))
+                self._cond.notify_all()
+
+    def on_overload(self, started_at: float) -> None:
+        """Снижает лимит после ошибки перегрузки.
+
+        Ошибки запросов, начатых до предыдущего снижения, повторно лимит не
+        снижают: они относятся к той же перегрузке.
+
+        Args:
+            started_at (float): Момент начала упавшего запроса.
+        """
+        self._successes_in_window = 0
+        if started_at < self._last_decrease:
+            return
+        self.limit = max(self.limit * self.decrease_factor, float(self.min_limit))
+        self._last_decrease = time.monotonic()
+
+
+class RequestPool:
+    """Выполняет запросы под управлением ``AdaptiveLimiter`` с повторами.
+
+    Args:
+        limiter (AdaptiveLimiter): Лимитер параллельных запросов.
+        timeout (float): Таймаут одного запроса в секундах.
+        max_retries (int): Число повторов при перегрузке сервера.
+        backoff_base (float): Базовая задержка перед повтором, секунды.
+        backoff_max (float): Максимальная задержка перед повтором, секунды.
+    """
+
+    def __init__(
+        self,
+        limiter: AdaptiveLimiter,
+        timeout: float = 120.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+    ) -> None:
+        self.limiter = limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _backoff(self, attempt: int) -> float:
+        # «Полный» разброс: повторы разных запросов не приходят на сервер разом
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    async def run(self, request_fn: Callable[[], Awaitable[T]]) -> T:
+        """Выполняет запрос, повторяя его при перегрузке сервера.
+
+        Args:
+            request_fn (Callable[[], Awaitable[T]]): Функция, создающая корутину
+                запроса (вызывается заново на каждую попытку).
+
+        Returns:
+            T: Результат запроса.
+
+        Raises:
+            Exception: Ошибка последней попытки или ошибка, которую не имеет
+                смысла повторять (например, 400).
+        """
+        attempt = 0
+        while True:
+            started_at = await self.limiter.acquire()
+            self.requests += 1
+            try:
+                result = await asyncio.wait_for(request_fn(), self.timeout)
+            except Exception as err:
+                if not is_overload_error(err):
+                    self.failures += 1
+                    raise
+                self.limiter.on_overload(started_at)
+                if attempt >= self.max_retries:
+                    self.failures += 1
+                    raise
+            else:
+                await self.limiter.on_success(time.monotonic() - started_at)
+                return result
+            finally:
+                await self.limiter.release()
+
+            self.retries += 1
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def stats(self) -> str:
+        """Возвращает строку со статистикой запросов."""
+        return (
+            f"Запросов: {self.requests}, повторов: {self.retries}, ошибок: {self.failures}, "
+            f"лимит параллельности: {int(self.limiter.limit)} "
+            f"(максимум {self.limiter.peak_limit}, потолок {self.limiter.max_limit})"
+        )
@@ -0,0 +1,415 @@
+"""Подбор размера запросов к модели с учётом нехватки памяти ускорителя.
+
+Сколько изображений помещается в один вызов модели, зависит от модели и
+разрешения изображений, и заранее это неизвестно: фиксированный размер
+либо недогружает GPU, либо падает с ``OutOfMemoryError``. ``BatchController``
+подбирает предел по той же схеме, что ``adaptive_client.AdaptiveLimiter``:
+
+* пока предела нет, запрос отправляется целиком (но не больше ``max_limit``);
+* при нехватке памяти память освобождается, предел становится вдвое меньше
+  упавшего размера (или равным наибольшему успешному размеру, если тот
+  больше: так неудачная проверка роста возвращает предел назад, а не
+  делит его), и тот же запрос повторяется частями;
+* после ``grow_after`` успешных вызовов подряд размером в предел он
+  увеличивается на единицу, но не до размера, уже упавшего в этом запуске.
+
+Пределы ведутся отдельно для каждого вида запросов (``scope``: батч
+классификации, страницы документа, изображения для генерации промпта) и для
+каждой «корзины» разрешения — максимального числа пикселей изображения,
+округлённого вверх до степени двойки. Если задан ``path``, выученные пределы
+сохраняются в JSON по хешу конфигурации модели, и следующий запуск сразу
+начинает с безопасного размера. Размер, упавший в прошлых запусках, не
+сохраняется: нехватка памяти бывает и случайной (фрагментация), поэтому
+каждый запуск один раз проверяет, не поместится ли больше.
+
+Файл пределов могут одновременно сохранять несколько процессов (шарды
+``sharded_eval`` с общим конфигом), поэтому запись идёт под блокировкой
+файла, а пределы объединяются с сохранёнными: из файла берутся корзины,
+которые этот процесс не менял, а если корзину изменили оба — меньший предел.
+
+Секция ``task.batch_limits``::
+
+    "batch_limits": {"path": "./cache/batch_limits.json", "grow_after": 8}
+"""
+
+import gc
+import json
+import math
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, TypeVar, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки файла нет, шарды пишут по очереди без гарантий
+    fcntl = None  # type: ignore[assignment]
+
+from PIL import Image
+
+from prediction_cache import model_fingerprint
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Виды запросов
+SCOPE_BATCH = "batch"
+SCOPE_PAGES = "pages"
+SCOPE_PROMPT_IMAGES = "prompt_images"
+
+DEFAULT_GROW_AFTER = 8
+
+
+class OutOfMemoryError(RuntimeError):
+    """Нехватка памяти ускорителя (бросает синтетическая модель с ``oom_above``)."""
+
+
+def is_oom_error(err: BaseException) -> bool:
+    """Проверяет, вызвана ли ошибка нехваткой памяти ускорителя.
+
+    Распознаётся ``torch.cuda.OutOfMemoryError`` (без импорта torch) и
+    ``RuntimeError`` с сообщением «out of memory» (старые версии torch, MPS).
+    """
+    if isinstance(err, OutOfMemoryError) or type(err).__name__ == "OutOfMemoryError":
+        return True
+    return isinstance(err, RuntimeError) and "out of memory" in str(err).lower()
+
+
+def free_accelerator_memory() -> None:
+    """Освобождает память, удерживаемую после упавшего вызова.
+
+    torch не импортируется, если модель его не загрузила (офлайн-бэкенды).
+    """
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def _pixels(image: Any) -> Optional[int]:
+    if isinstance(image, Image.Image):
+        return image.width * image.height
+    if isinstance(image, (str, Path)):
+        try:
+            # Читается только заголовок файла
+            with Image.open(image) as opened:
+                return opened.width * opened.height
+        except (OSError, ValueError):
+            return None
+    return None
+
+
+def resolution_bucket(images: Sequence[Any]) -> str:
+    """Корзина разрешения для группы изображений.
+
+    Args:
+        images (Sequence[Any]): Пути к изображениям или загруженные изображения.
+
+    Returns:
+        str: Максимальное число пикселей, округлённое вверх до степени двойки
+        (например, ``"4194304px"``); ``"0px"`` — изображений нет, ``"any"`` —
+        размер не удалось определить.
+    """
+    if not images:
+        return "0px"
+    pixels = [_pixels(image) for image in images]
+    known = [p for p in pixels if p]
+    if not known:
+        return "any"
+    return f"{2 ** math.ceil(math.log2(max(known)))}px"
+
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    """Исключительная блокировка файла ``path`` между процессами."""
+    if fcntl is None:
+        yield
+        return
+    with path.open("a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class BatchController:
+    """Предел размера вызова модели, выученный по ошибкам нехватки памяти.
+
+    Args:
+        model_key (str): Хеш конфигурации модели (см. ``model_fingerprint``).
+        scope (str): Вид запросов, для которых ведутся пределы.
+        max_limit (Optional[int]): Потолок размера вызова; None — без потолка.
+        min_limit (int): Размер, ниже которого предел не опускается; нехватка
+            памяти на нём уже не обрабатывается, а пробрасывается.
+        grow_after (int): Сколько успешных вызовов размером в предел нужно
+            для его увеличения.
+        path (Optional[Union[str, Path]]): JSON-файл с выученными пределами.
+    """
+
+    def __init__(
+        self,
+        model_key: str,
+        scope: str,
+        max_limit: Optional[int] = None,
+        min_limit: int = 1,
+        grow_after: int = DEFAULT_GROW_AFTER,
+        path: Optional[Union[str, Path]] = None,
+    ) -> None:
+        self.model_key = model_key
+        self.scope = scope
+        self.min_limit = max(0, min_limit)
+        self.max_limit = max_limit
+        self.grow_after = max(1, grow_after)
+        self.path = Path(path) if path else None
+        self.ooms = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._limits: Dict[str, int] = {}
+        # Наименьший упавший размер в этом запуске
+        self._fail_at: Dict[str, int] = {}
+        # Наибольший успешный размер (выученные пределы тоже считаются успешными)
+        self._succeeded: Dict[str, int] = {}
+        self._successes: Dict[str, int] = {}
+        # Пределы на момент загрузки или последнего сохранения — для слияния в ``save``
+        self._saved: Dict[str, int] = {}
+        if self.path is not None and self.path.exists():
+            stored = json.loads(self.path.read_text(encoding="utf-8"))
+            self._limits = dict(stored.get(model_key, {}).get(scope, {}))
+            self._succeeded = dict(self._limits)
+            self._saved = dict(self._limits)
+
+    @classmethod
+    def from_config(
+        cls,
+        config: Optional[Dict[str, Any]],
+        model_config: Dict[str, Any],
+        scope: str,
+        max_limit: Optional[int] = None,
+        min_limit: int = 1,
+    ) -> "BatchController":
+        """Создаёт контроллер по секции ``task.batch_limits`` конфига.
+
+        Без секции пределы подбираются в памяти и не сохраняются.
+
+        Args:
+            config (Optional[Dict[str, Any]]): Секция с полями ``path`` и
+                ``grow_after`` или None.
+            model_config (Dict[str, Any]): Секция ``model`` конфига.
+            scope (str): Вид запросов.
+            max_limit (Optional[int]): Потолок размера вызова.
+            min_limit (int): Наименьший размер вызова.
+        """
+        config = config or {}
+        return cls(
+            model_fingerprint(model_config),
+            scope,
+            max_limit=max_limit,
+            min_limit=min_limit,
+            grow_after=int(config.get("grow_after", DEFAULT_GROW_AFTER)),
+            path=config.get("path"),
+        )
+
+    def limit(self, bucket: str) -> Optional[int]:
+        """Текущий предел для корзины разрешения (None — ещё не ограничен)."""
+        with self._lock:
+            limit = self._limits.get(bucket)
+        if self.max_limit is not None:
+            limit = self.max_limit if limit is None else min(limit, self.max_limit)
+        return limit
+
+    def on_success(self, bucket: str, size: int) -> None:
+        """Учитывает успешный вызов размером ``size``.
+
+        Рост предела засчитывают только вызовы размером не меньше предела.
+        """
+        with self._lock:
+            self.calls += 1
+            self._succeeded[bucket] = max(size, self._succeeded.get(bucket, 0))
+            limit = self._limits.get(bucket)
+            if limit is None or size < limit:
+                return
+            self._successes[bucket] = self._successes.get(bucket, 0) + 1
+            if self._successes[bucket] < self.grow_after:
+                return
+            self._successes[bucket] = 0
+            grown = limit + 1
+            if grown >= self._fail_at.get(bucket, grown + 1):
+                return
+            if self.max_limit is not None and grown > self.max_limit:
+                return
+            self._limits[bucket] = grown
+
+    def on_oom(self, bucket: str, size: int) -> bool:
+        """Учитывает нехватку памяти на вызове размером ``size``.
+
+        Returns:
+            bool: True, если вызов стоит повторить меньшим размером; False —
+            размер уже минимальный.
+        """
+        free_accelerator_memory()
+        with self._lock:
+            self.calls += 1
+            self.ooms += 1
+            self._successes[bucket] = 0
+            self._fail_at[bucket] = min(size, self._fail_at.get(bucket, size))
+            if size <= self.min_limit:
+                return False
+            succeeded = self._succeeded.get(bucket, 0)
+            if succeeded >= size:
+                # Раньше этот размер проходил: память занята сильнее — сбрасываем успехи
+                succeeded = 0
+                self._succeeded.pop(bucket)
+            limit = self._limits[bucket] = max(self.min_limit, size // 2, succeeded)
+        print(f"Нехватка памяти на {size} ({self.scope}, {bucket}), предел снижен до {limit}")
+        return True
+
+    def run_chunks(
+        self, items: Sequence[T], call: Callable[[List[T]], List[R]], bucket: str
+    ) -> List[R]:
+        """Обрабатывает все элементы частями не больше предела.
+
+        Часть, упавшая из-за нехватки памяти, повторяется частями меньшего
+        размера.
+
+        Args:
+            items (Sequence[T]): Элементы (например, пары изображение–промпт).
+            call (Callable[[List[T]], List[R]]): Вызов модели на части,
+                возвращающий по результату на элемент.
+            bucket (str): Корзина разрешения (см. ``resolution_bucket``).
+
+        Returns:
+            List[R]: Результаты в порядке ``items``.
+
+        Raises:
+            Exception: Ошибка вызова, не связанная с памятью, или нехватка
+                памяти на минимальном размере.
+        """
+        results: List[R] = []
+        start = 0
+        while start < len(items):
+            size = len(items) - start
+            limit = self.limit(bucket)
+            if limit is not None:
+                size = min(size, max(limit, 1))
+            try:
+                chunk_results = call(list(items[start : start + size]))
+            except Exception as e:
+                if is_oom_error(e) and self.on_oom(bucket, size):
+                    continue
+                raise
+            self.on_success(bucket, size)
+            results.extend(chunk_results)
+            start += size
+        return results
+
+    def run_prefix(
+        self, items: Sequence[T], call: Callable[[List[T]], R], bucket: str
+    ) -> R:
+        """Делает один вызов на первых элементах — столько, сколько помещается.
+
+        Подходит, когда часть элементов можно отбросить (изображения-примеры
+        при генерации промпта). При нехватке памяти вызов повторяется с
+        меньшим числом элементов, вплоть до ``min_limit`` (в том числе 0).
+
+        Args:
+            items (Sequence[T]): Элементы в порядке важности.
+            call (Callable[[List[T]], R]): Вызов модели.
+            bucket (str): Корзина разрешения.
+
+        Returns:
+            R: Результат вызова.
+        """
+        while True:
+            limit = self.limit(bucket)
+            size = len(items) if limit is None else min(len(items), limit)
+            try:
+                result = call(list(items[:size]))
+            except Exception as e:
+                if is_oom_error(e) and self.on_oom(bucket, size):
+                    continue
+                raise
+            self.on_success(bucket, size)
+            return result
+
+    def run_whole(self, items: Sequence[T], call: Callable[[List[T]], R], bucket: str) -> R:
+        """Делает вызов на всех элементах (страницы документа нельзя разделить).
+
+        После нехватки памяти предел корзины снижается, память освобождается
+        и вызов повторяется один раз: нехватка бывает вызвана фрагментацией
+        после предыдущих запросов.
+
+        Raises:
+            Exception: Ошибка вызова или повторная нехватка памяти.
+        """
+        try:
+            result = call(list(items))
+        except Exception as e:
+            if not is_oom_error(e):
+                raise
+            self.on_oom(bucket, len(items))
+            result = call(list(items))
+        self.on_success(bucket, len(items))
+        return result
+
+    def _merge(self, stored: Dict[str, int]) -> Dict[str, int]:
+        """Объединяет свои пределы с сохранёнными другими процессами.
+
+        Корзины, предел которых не менялся с загрузки, берутся из файла; если
+        предел изменили и этот процесс, и другой, сохраняется меньший.
+        """
+        merged = dict(stored)
+        for bucket, limit in self._limits.items():
+            saved = self._saved.get(bucket)
+            if limit == saved:
+                continue
+            other = stored.get(bucket)
+            if other is not None and other != saved:
+                limit = min(limit, other)
+            merged[bucket] = limit
+        return merged
+
+    def save(self) -> Optional[Path]:
+        """Сохраняет выученные пределы (если задан ``path``).
+
+        Запись идёт под блокировкой файла ``<path>.lock``, пределы
+        объединяются с сохранёнными другими процессами (см. описание модуля).
+        """
+        if self.path is None:
+            return None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with _locked(self.path.with_name(self.path.name + ".lock")):
+            stored: Dict[str, Any] = {}
+            if self.path.exists():
+                stored = json.loads(self.path.read_text(encoding="utf-8"))
+            with self._lock:
+                scopes = stored.setdefault(self.model_key, {})
+                if not self._limits and self.scope not in scopes:
+                    return self.path
+                merged = self._merge(scopes.get(self.scope, {}))
+                scopes[self.scope] = dict(sorted(merged.items()))
+                self._saved = dict(self._limits)
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_text(
+                json.dumps(stored, indent=2, ensure_ascii=False), encoding="utf-8"
+            )
+            tmp_path.replace(self.path)
+        return self.path
+
+    def stats(self) -> str:
+        """Возвращает строку с выученными пределами."""
+        with self._lock:
+            limits = ", ".join(
+                f"{bucket}: {limit}" for bucket, limit in sorted(self._limits.items())
+            )
+        return (
+            f"Пределы размера вызова ({self.scope}): {limits or 'не ограничены'}; "
+            f"вызовов {self.calls}, нехваток памяти {self.ooms}"
+        )
+
+    def close(self) -> None:
+        """Сохраняет пределы и печатает статистику, если была нехватка памяти."""
+        self.save()
+        if self.ooms:
+            print(self.stats())
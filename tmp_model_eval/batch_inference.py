@@ -0,0 +1,163 @@
+"""Батчевый инференс поверх обёрток моделей.
+
+Обёртки из ``model_interface`` гарантированно реализуют только
+``predict_on_image``. Если обёртка дополнительно реализует
+``predict_on_batch(images, prompts)``, вся пачка изображений уходит в модель
+одним вызовом; для остальных моделей сохраняется поэлементный цикл.
+"""
+
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from batch_controller import BatchController, resolution_bucket
+from inference_stats import InferenceRecord, timed_call
+
+T = TypeVar("T")
+
+
+def supports_batch(model: Any) -> bool:
+    """Проверяет, умеет ли обёртка модели обрабатывать батч за один вызов.
+
+    Args:
+        model (Any): Инициализированный объект модели.
+
+    Returns:
+        bool: True, если у модели есть метод ``predict_on_batch``.
+    """
+    return callable(getattr(model, "predict_on_batch", None))
+
+
+def iter_batches(items: Iterable[T], batch_size: int) -> Iterator[List[T]]:
+    """Разбивает поток элементов на последовательные батчи.
+
+    Args:
+        items (Iterable[T]): Исходные элементы (последовательность или итератор).
+        batch_size (int): Размер батча (значения меньше 1 трактуются как 1).
+
+    Yields:
+        List[T]: Очередной батч; последний может быть короче ``batch_size``.
+    """
+    batch_size = max(1, int(batch_size))
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _predict_one(
+    model: Any, image: Any, prompt: str, retries: int = 0
+) -> Tuple[Optional[str], Optional[InferenceRecord]]:
+    """Поэлементный вызов модели; ошибка превращается в ``None``."""
+    try:
+        return timed_call(
+            model,
+            lambda: model.predict_on_image(image=image, prompt=prompt),
+            num_images=1,
+            retries=retries,
+        )
+    except Exception as e:
+        print(f"Ошибка при предсказании для изображения {image}: {e}")
+        return None, None
+
+
+def _call_batch(
+    model: Any, pairs: List[Tuple[Any, str]]
+) -> List[Tuple[Optional[str], InferenceRecord]]:
+    """Один вызов ``predict_on_batch``; ответ не той длины — ошибка."""
+    images = [image for image, _ in pairs]
+    prompts = [prompt for _, prompt in pairs]
+    results, record = timed_call(
+        model,
+        lambda: model.predict_on_batch(images=images, prompts=prompts),
+        num_images=len(pairs),
+    )
+    if len(results) != len(pairs):
+        raise ValueError(f"predict_on_batch вернул {len(results)} ответов вместо {len(pairs)}")
+    item_record = record.share(len(pairs))
+    return [(result, item_record) for result in results]
+
+
+def predict_batch(
+    model: Any, images: Sequence[Any], prompts: Sequence[str]
+) -> List[Optional[str]]:
+    """Получает сырые ответы модели для батча изображений.
+
+    То же, что ``predict_batch_timed``, но без записей о стоимости.
+    """
+    return predict_batch_timed(model, images, prompts)[0]
+
+
+def predict_batch_timed(
+    model: Any,
+    images: Sequence[Any],
+    prompts: Sequence[str],
+    controller: Optional[BatchController] = None,
+) -> Tuple[List[Optional[str]], List[Optional[InferenceRecord]]]:
+    """Получает сырые ответы модели для батча изображений и их стоимость.
+
+    Контракт ``predict_on_batch``: принимает списки ``images`` и ``prompts``
+    одинаковой длины (i-й промпт относится к i-му изображению) и возвращает
+    список строковых ответов той же длины и в том же порядке.
+
+    Если модель не реализует ``predict_on_batch``, либо батчевый вызов упал
+    или вернул ответы не той длины, батч обрабатывается поэлементно через
+    ``predict_on_image``.
+
+    С ``controller`` батч делится на части по выученному пределу, а часть,
+    упавшая из-за нехватки памяти, повторяется частями меньшего размера.
+
+    Args:
+        model (Any): Инициализированный объект модели.
+        images (Sequence[Any]): Изображения (пути в виде строк или загруженные
+            изображения — то, что принимает обёртка модели). Элементы ``None``
+            (изображение не удалось загрузить) в модель не передаются.
+        prompts (Sequence[str]): Промпты, по одному на изображение.
+        controller (Optional[BatchController]): Контроллер размера батча;
+            None — весь батч одним вызовом.
+
+    Returns:
+        Tuple[List[Optional[str]], List[Optional[InferenceRecord]]]: Сырые
+        ответы модели (``None`` для изображений, которые не загрузились или
+        на которых инференс завершился ошибкой) и стоимость каждого
+        предсказания (``None``, если модель не вызывалась или упала).
+        После неудачного батчевого вызова у поэлементных ответов ``retries`` = 1.
+    """
+    if len(images) != len(prompts):
+        raise ValueError(
+            f"Число изображений ({len(images)}) не совпадает с числом промптов ({len(prompts)})"
+        )
+    # Изображения, которые не удалось загрузить (None), в модель не отправляем
+    valid = [i for i, image in enumerate(images) if image is not None]
+    responses: List[Optional[str]] = [None] * len(images)
+    records: List[Optional[InferenceRecord]] = [None] * len(images)
+    if not valid:
+        return responses, records
+
+    valid_images = [images[i] for i in valid]
+    valid_prompts = [prompts[i] for i in valid]
+
+    retries = 0
+    if supports_batch(model):
+        retries = 1
+        pairs = list(zip(valid_images, valid_prompts, strict=True))
+        try:
+            if controller is None:
+                outputs = _call_batch(model, pairs)
+            else:
+                outputs = controller.run_chunks(
+                    pairs,
+                    lambda chunk: _call_batch(model, chunk),
+                    resolution_bucket(valid_images),
+                )
+            for i, (result, record) in zip(valid, outputs, strict=True):
+                responses[i] = result
+                records[i] = record
+            return responses, records
+        except Exception as e:
+            print(f"Ошибка батчевого инференса, переходим на поэлементный режим: {e}")
+
+    for i, image, prompt in zip(valid, valid_images, valid_prompts, strict=True):
+        responses[i], records[i] = _predict_one(model, image, prompt, retries)
+    return responses, records
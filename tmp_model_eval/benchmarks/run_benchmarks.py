@@ -0,0 +1,465 @@
+"""Сквозной бенчмарк скриптов оценки на синтетических данных.
+
+Для каждого сценария (классификация, сортировка страниц, извлечение полей)
+и каждого масштаба генерирует датасет (``synthetic_data``), запускает
+скрипт в отдельном процессе с офлайн-моделью (``backend: synthetic``) или
+заглушкой сервера (``stub_server``) и измеряет:
+
+* ``items_per_s`` — обработанных элементов в секунду (изображений или
+  документов);
+* ``peak_rss_mb`` — пиковый объём резидентной памяти процесса;
+* ``wall_s`` и ``cpu_s`` — время работы и процессорное время;
+* ``model_s`` и ``harness_s`` — время внутри вызовов модели и всё
+  остальное (для классификации и сортировки страниц, где модель
+  вызывается последовательно).
+
+Результаты сравниваются с базовой линией (``baseline.json``): регрессией
+считается падение ``items_per_s`` или рост ``peak_rss_mb`` больше порогов,
+записанных в базовой линии. Базовая линия записывается с
+``--update-baseline`` на той же машине, на которой потом сравнивается:
+абсолютные числа между машинами несравнимы.
+
+Запуск::
+
+    python benchmarks/run_benchmarks.py --scales 50,200
+    python benchmarks/run_benchmarks.py --scales 50,200 --update-baseline
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+EVAL_DIR = BENCHMARKS_DIR.parent
+sys.path.insert(0, str(EVAL_DIR))
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+from synthetic_data import (  # noqa: E402
+    CLASSIFICATION_CLASSES,
+    PAGE_SORTING_DOC_TYPE,
+    make_classification_dataset,
+    make_entity_dataset,
+    make_page_sorting_dataset,
+)
+
+SCENARIOS = ("classification", "page_sorting", "entity_extraction")
+SCRIPT_MODULES = {
+    "classification": "check_classifiication",
+    "page_sorting": "check_page_sorting",
+    "entity_extraction": "check_entity_extractor",
+}
+DEFAULT_SCALES = (50, 200)
+DEFAULT_BASELINE = BENCHMARKS_DIR / "baseline.json"
+DEFAULT_DATA_DIR = Path(tempfile.gettempdir()) / "vlm_eval_benchmarks"
+
+# Допустимое падение пропускной способности и рост памяти относительно базовой линии
+DEFAULT_THRESHOLDS = {"items_per_s": 0.2, "peak_rss_mb": 0.25}
+
+CLASSIFICATION_PROMPT = "Определи тип документа. Классы: {classes}. Ответь номером класса."
+PAGE_SORTING_PROMPT = "Упорядочи страницы документа. Ответь JSON с ключом ordered_pages."
+ENTITY_PROMPT = "Извлеки поля документа."
+
+
+class TimedModel:
+    """Обёртка модели, суммирующая время вызовов ``predict_on_*``."""
+
+    def __init__(self, model: Any) -> None:
+        self.model = model
+        self.seconds = 0.0
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "model":
+            raise AttributeError(name)
+        attr = getattr(self.model, name)
+        if not (name.startswith("predict_on") and callable(attr)):
+            return attr
+
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - started
+
+        return timed
+
+
+def _install_model_timer(script: Any) -> List[TimedModel]:
+    """Подменяет ``create_model`` в модуле скрипта; возвращает созданные модели."""
+    created: List[TimedModel] = []
+    create_model = script.create_model
+
+    def create_timed_model(model_config: Dict[str, Any]) -> TimedModel:
+        model = TimedModel(create_model(model_config))
+        created.append(model)
+        return model
+
+    script.create_model = create_timed_model
+    return created
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _synthetic_model(responses: List[str], latency_ms: float) -> Dict[str, Any]:
+    return {
+        "model_name": "synthetic",
+        "backend": "synthetic",
+        "responses": responses,
+        "latency_ms": latency_ms,
+    }
+
+
+def _run_classification(dataset: Path, options: argparse.Namespace) -> Dict[str, Any]:
+    import check_classifiication as script
+
+    prompt_path = Path("prompt.txt")
+    prompt_path.write_text(CLASSIFICATION_PROMPT, encoding="utf-8")
+    config = {
+        "task": {
+            "dataset_path": str(dataset),
+            "prompt_path": str(prompt_path),
+            "subsets": ["clean"],
+            "sample_size": None,
+            "batch_size": options.batch_size,
+        },
+        "model": _synthetic_model(
+            [str(i) for i in range(len(CLASSIFICATION_CLASSES))], options.model_latency_ms
+        ),
+        "document_classes": CLASSIFICATION_CLASSES,
+    }
+    models = _install_model_timer(script)
+    script.run_evaluation(config)
+    return {"items": options.scale, "model_s": sum(m.seconds for m in models)}
+
+
+def _run_page_sorting(dataset: Path, options: argparse.Namespace) -> Dict[str, Any]:
+    import check_page_sorting as script
+
+    prompt_path = Path("prompt.txt")
+    prompt_path.write_text(PAGE_SORTING_PROMPT, encoding="utf-8")
+    config = {
+        "task": {
+            "dataset_path": str(dataset),
+            "prompt_path": str(prompt_path),
+            "subsets": ["clean"],
+            "sample_size": None,
+            "output_dir": "output",
+        },
+        "model": _synthetic_model(
+            ['{"ordered_pages": [1, 2, 3, 4]}', '{"ordered_pages": [2, 1, 4, 3]}'],
+            options.model_latency_ms,
+        ),
+        "document_classes": {PAGE_SORTING_DOC_TYPE: "Договор беспроцентного займа"},
+    }
+    models = _install_model_timer(script)
+    script.run_evaluation(config)
+    return {"items": options.scale, "model_s": sum(m.seconds for m in models)}
+
+
+def _run_entity_extraction(dataset: Path, options: argparse.Namespace) -> Dict[str, Any]:
+    import check_entity_extractor as script
+
+    prompt_path = Path("prompt.txt")
+    prompt_path.write_text(ENTITY_PROMPT, encoding="utf-8")
+    asyncio.run(script.check_entity_extractor(dataset, prompt_path, "stub", ["clean"]))
+    return {"items": options.scale}
+
+
+def child_main(options: argparse.Namespace) -> None:
+    """Запускает один сценарий в текущем процессе и печатает результат JSON-строкой."""
+    runners = {
+        "classification": _run_classification,
+        "page_sorting": _run_page_sorting,
+        "entity_extraction": _run_entity_extraction,
+    }
+    dataset = Path(options.dataset).resolve()
+    work_dir = Path(options.work_dir)
+    os.chdir(work_dir)
+    os.environ["RUNPOD_URL"] = options.server_url
+    # Импорт скрипта (pandas, matplotlib и т.д.) не входит в замер
+    importlib.import_module(SCRIPT_MODULES[options.child])
+
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    result = runners[options.child](dataset, options)
+    wall_s = time.perf_counter() - wall_started
+
+    result.update(
+        wall_s=wall_s,
+        cpu_s=time.process_time() - cpu_started,
+        items_per_s=result["items"] / wall_s if wall_s > 0 else 0.0,
+        peak_rss_mb=_peak_rss_mb(),
+    )
+    if "model_s" in result:
+        result["harness_s"] = wall_s - result["model_s"]
+    print("BENCHMARK_RESULT " + json.dumps(result), flush=True)
+
+
+def _prepare_dataset(scenario: str, scale: int, data_dir: Path) -> Path:
+    root = data_dir / "datasets" / f"{scenario}_{scale}"
+    if scenario == "classification":
+        return make_classification_dataset(root, scale)
+    if scenario == "page_sorting":
+        return make_page_sorting_dataset(root, scale)
+    return make_entity_dataset(root, scale)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_server(latency_ms: float, compile_ms: float) -> Tuple[subprocess.Popen, str]:
+    """Запускает ``stub_server.py`` в отдельном процессе и ждёт, пока он начнёт слушать."""
+    port = _free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            str(BENCHMARKS_DIR / "stub_server.py"),
+            "--port",
+            str(port),
+            "--latency-ms",
+            str(latency_ms),
+            "--compile-ms",
+            str(compile_ms),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Заглушка сервера не запустилась")
+
+
+def run_case(
+    scenario: str, scale: int, options: argparse.Namespace, server_url: str
+) -> Dict[str, Any]:
+    """Готовит датасет и запускает сценарий в дочернем процессе (лучший из повторов)."""
+    data_dir = Path(options.data_dir)
+    dataset = _prepare_dataset(scenario, scale, data_dir)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (str(EVAL_DIR), env.get("PYTHONPATH", "")) if p
+    )
+
+    best: Optional[Dict[str, Any]] = None
+    for _ in range(options.repeat):
+        work_dir = data_dir / "runs" / f"{scenario}_{scale}"
+        shutil.rmtree(work_dir, ignore_errors=True)
+        work_dir.mkdir(parents=True)
+        command = [
+            sys.executable,
+            str(Path(__file__).resolve()),
+            "--child",
+            scenario,
+            "--dataset",
+            str(dataset),
+            "--work-dir",
+            str(work_dir),
+            "--scale",
+            str(scale),
+            "--batch-size",
+            str(options.batch_size),
+            "--model-latency-ms",
+            str(options.model_latency_ms),
+            "--server-url",
+            server_url,
+        ]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        lines = [
+            line for line in completed.stdout.splitlines() if line.startswith("BENCHMARK_RESULT ")
+        ]
+        if completed.returncode != 0 or not lines:
+            raise RuntimeError(
+                f"Сценарий {scenario} (масштаб {scale}) завершился с ошибкой:\n"
+                f"{completed.stderr[-4000:]}"
+            )
+        result = json.loads(lines[-1][len("BENCHMARK_RESULT ") :])
+        if best is None or result["wall_s"] < best["wall_s"]:
+            best = result
+    if best is None:
+        raise RuntimeError(f"Сценарий {scenario} (масштаб {scale}) не запускался: repeat < 1")
+    return best
+
+
+def compare_with_baseline(
+    results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any]
+) -> List[str]:
+    """Возвращает описания регрессий относительно базовой линии."""
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get("thresholds", {})}
+    regressions = []
+    for case, result in results.items():
+        reference = baseline.get("results", {}).get(case)
+        if reference is None:
+            continue
+        min_rate = reference["items_per_s"] * (1 - thresholds["items_per_s"])
+        if result["items_per_s"] < min_rate:
+            regressions.append(
+                f"{case}: {result['items_per_s']:.1f} эл/с < {min_rate:.1f} "
+                f"(база {reference['items_per_s']:.1f})"
+            )
+        if result.get("peak_rss_mb") and reference.get("peak_rss_mb"):
+            max_rss = reference["peak_rss_mb"] * (1 + thresholds["peak_rss_mb"])
+            if result["peak_rss_mb"] > max_rss:
+                regressions.append(
+                    f"{case}: пиковая память {result['peak_rss_mb']:.0f} МБ > {max_rss:.0f} МБ "
+                    f"(база {reference['peak_rss_mb']:.0f} МБ)"
+                )
+    return regressions
+
+
+def _print_table(results: Dict[str, Dict[str, Any]]) -> None:
+    header = f"{'сценарий':<28}{'эл/с':>10}{'wall, с':>10}{'cpu, с':>10}{'модель, с':>11}{'RSS, МБ':>10}"
+    print(header)
+    print("-" * len(header))
+    for case, r in results.items():
+        model_s = f"{r['model_s']:.2f}" if "model_s" in r else "-"
+        rss = f"{r['peak_rss_mb']:.0f}" if r.get("peak_rss_mb") else "-"
+        print(
+            f"{case:<28}{r['items_per_s']:>10.1f}{r['wall_s']:>10.2f}"
+            f"{r['cpu_s']:>10.2f}{model_s:>11}{rss:>10}"
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк скриптов оценки")
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help="Сценарии через запятую: " + ", ".join(SCENARIOS),
+    )
+    parser.add_argument(
+        "--scales",
+        default=",".join(map(str, DEFAULT_SCALES)),
+        help="Число изображений (документов) через запятую",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Повторов (берётся лучший)")
+    parser.add_argument("--batch-size", type=int, default=1, help="batch_size классификации")
+    parser.add_argument(
+        "--model-latency-ms",
+        type=float,
+        default=0.0,
+        help="Задержка синтетической модели на изображение (0 — только накладные расходы)",
+    )
+    parser.add_argument("--server-latency-ms", type=float, default=0.0)
+    parser.add_argument("--compile-ms", type=float, default=0.0)
+    parser.add_argument("--data-dir", default=str(DEFAULT_DATA_DIR))
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--output", default=None, help="Куда сохранить результаты JSON")
+    parser.add_argument(
+        "--update-baseline", action="store_true", help="Записать результаты как базовую линию"
+    )
+    parser.add_argument("--items-tolerance", type=float, default=DEFAULT_THRESHOLDS["items_per_s"])
+    parser.add_argument("--rss-tolerance", type=float, default=DEFAULT_THRESHOLDS["peak_rss_mb"])
+    # Служебные параметры дочернего процесса
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--dataset", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--scale", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--server-url", default="", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    options = parse_args()
+    if options.child:
+        child_main(options)
+        return
+
+    scenarios = [s.strip() for s in options.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+    if options.repeat < 1:
+        raise SystemExit("--repeat должен быть не меньше 1")
+    scales = [int(s) for s in options.scales.split(",")]
+
+    server = None
+    server_url = ""
+    if "entity_extraction" in scenarios:
+        server, server_url = start_stub_server(options.server_latency_ms, options.compile_ms)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        for scenario in scenarios:
+            for scale in scales:
+                case = f"{scenario}@{scale}"
+                print(f"▶ {case}", flush=True)
+                results[case] = run_case(scenario, scale, options, server_url)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print()
+    _print_table(results)
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "batch_size": options.batch_size,
+            "model_latency_ms": options.model_latency_ms,
+            "server_latency_ms": options.server_latency_ms,
+            "compile_ms": options.compile_ms,
+            "repeat": options.repeat,
+        },
+        "thresholds": {
+            "items_per_s": options.items_tolerance,
+            "peak_rss_mb": options.rss_tolerance,
+        },
+        "results": results,
+    }
+    if options.output:
+        Path(options.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    baseline_path = Path(options.baseline)
+    if options.update_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nБазовая линия записана в {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print(f"\nБазовая линия {baseline_path} не найдена, сравнение пропущено")
+        return
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    if baseline.get("settings") != report["settings"]:
+        print("\n⚠️ Параметры запуска отличаются от базовой линии, сравнение может быть некорректным")
+    regressions = compare_with_baseline(results, baseline)
+    if regressions:
+        print("\n❌ Регрессии:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("\n✅ Регрессий относительно базовой линии нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Заглушка OpenAI-совместимого сервера для бенчмарка ``check_entity_extractor``.
+
+Отвечает на ``POST /v1/chat/completions`` JSON-объектом, в котором каждое
+свойство схемы ``guided_json`` заполнено строкой ``"x"``. Моделирует две
+составляющие задержки настоящего сервера:
+
+* ``--latency-ms`` — время генерации ответа (запросы обрабатываются
+  параллельно);
+* ``--compile-ms`` — компиляция грамматики для схемы, которой нет среди
+  ``--grammar-slots`` последних использованных; компиляция блокирует все
+  запросы, как и в vLLM.
+
+С ``--max-concurrency`` сервер отвечает ``--overload-status`` (по умолчанию
+429) на запросы сверх этого числа одновременно обрабатываемых — так
+проверяется адаптивный лимит клиента (``adaptive_client``).
+
+Запуск::
+
+    python stub_server.py --port 8765 --latency-ms 50 --compile-ms 150
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+
+class StubState:
+    """Параметры задержек, ёмкость сервера и кеш «скомпилированных» схем.
+
+    ``max_concurrency`` = 0 — без ограничения; его можно менять на ходу.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float,
+        compile_ms: float,
+        grammar_slots: int,
+        max_concurrency: int = 0,
+        overload_status: int = 429,
+    ) -> None:
+        self.latency = latency_ms / 1000
+        self.compile = compile_ms / 1000
+        self.grammar_slots = max(1, grammar_slots)
+        self.grammars: "OrderedDict[str, None]" = OrderedDict()
+        self.compile_lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self.overload_status = overload_status
+        self.in_flight = 0
+        self.rejected = 0
+        self.flight_lock = threading.Lock()
+
+    def enter(self) -> bool:
+        """Занимает место под запрос; False — сервер перегружен."""
+        with self.flight_lock:
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self) -> None:
+        with self.flight_lock:
+            self.in_flight -= 1
+
+    def use_schema(self, schema_text: str) -> None:
+        with self.compile_lock:
+            if schema_text in self.grammars:
+                self.grammars.move_to_end(schema_text)
+                return
+            time.sleep(self.compile)
+            self.grammars[schema_text] = None
+            if len(self.grammars) > self.grammar_slots:
+                self.grammars.popitem(last=False)
+
+
+def make_handler(state: StubState) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args: object) -> None:
+            pass
+
+        def _send_json(self, status: int, payload: bytes) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if not state.enter():
+                error = {"error": {"message": "server overloaded", "type": "overloaded"}}
+                self._send_json(state.overload_status, json.dumps(error).encode("utf-8"))
+                return
+            try:
+                self._complete(body)
+            finally:
+                state.leave()
+
+        def _complete(self, body: Dict[str, Any]) -> None:
+            schema = body.get("guided_json") or {}
+            state.use_schema(json.dumps(schema, sort_keys=True))
+            time.sleep(state.latency)
+
+            content = {name: "x" for name in schema.get("properties", {})}
+            payload = json.dumps(
+                {
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {
+                                "role": "assistant",
+                                "content": json.dumps(content, ensure_ascii=False),
+                            },
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }
+            ).encode("utf-8")
+            self._send_json(200, payload)
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Заглушка OpenAI-совместимого сервера")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--compile-ms", type=float, default=0.0)
+    parser.add_argument("--grammar-slots", type=int, default=4)
+    parser.add_argument(
+        "--max-concurrency", type=int, default=0, help="Ёмкость сервера (0 — без ограничения)"
+    )
+    parser.add_argument("--overload-status", type=int, default=429)
+    args = parser.parse_args()
+
+    state = StubState(
+        args.latency_ms,
+        args.compile_ms,
+        args.grammar_slots,
+        args.max_concurrency,
+        args.overload_status,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"Заглушка сервера слушает http://{args.host}:{args.port}/v1", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Генерация синтетических датасетов в тех раскладках, которые ждут скрипты оценки.
+
+* классификация: ``<root>/<class>/images/<subset>/<i>.jpg``;
+* сортировка страниц: ``<root>/<doc_type>/images/<subset>/<doc_id>/{0..3}.jpg``
+  и ``<root>/<doc_type>/jsons/<doc_id>.json`` с правильным порядком;
+* извлечение полей: ``<root>/images/<subset>/<id>.jpg`` и ``<root>/jsons/<id>.json``.
+
+Изображения — шум с уникальным для каждого файла зерном, поэтому хеши
+содержимого (кеши, replay-бэкенд) различаются так же, как на реальных
+данных. Повторная генерация с теми же параметрами пропускается.
+"""
+
+import json
+import random
+import zlib
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+CLASSIFICATION_CLASSES: Dict[str, str] = {
+    "tin_new": "ИНН нового образца",
+    "tin_old": "ИНН старого образца",
+    "passport": "Паспорт",
+    "snils": "СНИЛС",
+}
+PAGE_SORTING_DOC_TYPE = "interest_free_loan_agreement"
+PAGES_PER_DOCUMENT = 4
+
+# Наборы полей документов для извлечения (разные схемы guided_json)
+ENTITY_SCHEMAS: List[Dict[str, str]] = [
+    {"surname": "Иванов", "name": "Иван", "birth_date": "01.01.1990"},
+    {"inn": "7700000000", "kpp": "770001001", "org_name": "ООО Ромашка", "address": "Москва"},
+    {"snils": "000-000-000 00", "full_name": "Петров Пётр Петрович"},
+]
+
+DEFAULT_IMAGE_SIZE = (800, 1100)
+_MARKER = ".complete.json"
+
+
+def _seed(*parts: object) -> int:
+    """Детерминированное зерно по частям пути (``hash`` строк зависит от процесса)."""
+    return zlib.crc32("/".join(map(str, parts)).encode("utf-8"))
+
+
+def write_image(path: Path, seed: int, size: Tuple[int, int] = DEFAULT_IMAGE_SIZE) -> None:
+    """Сохраняет JPEG-шум размера ``size`` (ширина, высота) с заданным зерном."""
+    rng = np.random.default_rng(seed)
+    # Крупный шум, растянутый до нужного размера: JPEG получается реалистичного объёма
+    small = rng.integers(0, 256, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize(size, Image.Resampling.BILINEAR)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image.save(path, format="JPEG", quality=85)
+
+
+def _is_complete(root: Path, params: Dict) -> bool:
+    marker = root / _MARKER
+    return marker.exists() and json.loads(marker.read_text(encoding="utf-8")) == params
+
+
+def _mark_complete(root: Path, params: Dict) -> None:
+    (root / _MARKER).write_text(json.dumps(params), encoding="utf-8")
+
+
+def make_classification_dataset(
+    root: Path,
+    num_images: int,
+    subsets: Sequence[str] = ("clean",),
+    image_size: Tuple[int, int] = DEFAULT_IMAGE_SIZE,
+) -> Path:
+    """Создаёт датасет классификации: ``num_images`` изображений на сабсет.
+
+    Изображения распределяются по классам ``CLASSIFICATION_CLASSES`` поровну.
+
+    Returns:
+        Path: Корень датасета (``task.dataset_path``).
+    """
+    params = {
+        "kind": "classification",
+        "n": num_images,
+        "subsets": list(subsets),
+        "size": list(image_size),
+    }
+    if _is_complete(root, params):
+        return root
+    classes = list(CLASSIFICATION_CLASSES)
+    for subset in subsets:
+        for i in range(num_images):
+            class_name = classes[i % len(classes)]
+            path = root / class_name / "images" / subset / f"{i // len(classes)}.jpg"
+            write_image(path, _seed(subset, i), image_size)
+    _mark_complete(root, params)
+    return root
+
+
+def make_page_sorting_dataset(
+    root: Path,
+    num_documents: int,
+    subsets: Sequence[str] = ("clean",),
+    image_size: Tuple[int, int] = DEFAULT_IMAGE_SIZE,
+    seed: int = 0,
+) -> Path:
+    """Создаёт датасет сортировки страниц из ``num_documents`` документов на сабсет.
+
+    Returns:
+        Path: Каталог типа документа (``task.dataset_path``).
+    """
+    dataset_path = root / PAGE_SORTING_DOC_TYPE
+    params = {
+        "kind": "page_sorting",
+        "n": num_documents,
+        "subsets": list(subsets),
+        "size": list(image_size),
+        "seed": seed,
+    }
+    if _is_complete(root, params):
+        return dataset_path
+    rng = random.Random(seed)
+    jsons_dir = dataset_path / "jsons"
+    jsons_dir.mkdir(parents=True, exist_ok=True)
+    for doc_index in range(num_documents):
+        doc_id = f"doc_{doc_index:05d}"
+        order = list(range(PAGES_PER_DOCUMENT))
+        rng.shuffle(order)
+        ground_truth = {"fields": {PAGE_SORTING_DOC_TYPE: order}}
+        (jsons_dir / f"{doc_id}.json").write_text(json.dumps(ground_truth), encoding="utf-8")
+        for subset in subsets:
+            for page in range(PAGES_PER_DOCUMENT):
+                path = dataset_path / "images" / subset / doc_id / f"{page}.jpg"
+                write_image(path, _seed(subset, doc_index, page), image_size)
+    _mark_complete(root, params)
+    return dataset_path
+
+
+def make_entity_dataset(
+    root: Path,
+    num_images: int,
+    subsets: Sequence[str] = ("clean",),
+    image_size: Tuple[int, int] = DEFAULT_IMAGE_SIZE,
+) -> Path:
+    """Создаёт датасет извлечения полей: документы со схемами ``ENTITY_SCHEMAS`` вперемешку.
+
+    Returns:
+        Path: Корень датасета (``--dataset-path``).
+    """
+    params = {
+        "kind": "entity",
+        "n": num_images,
+        "subsets": list(subsets),
+        "size": list(image_size),
+    }
+    if _is_complete(root, params):
+        return root
+    jsons_dir = root / "jsons"
+    jsons_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(num_images):
+        image_id = f"{i:05d}"
+        fields = ENTITY_SCHEMAS[i % len(ENTITY_SCHEMAS)]
+        (jsons_dir / f"{image_id}.json").write_text(
+            json.dumps(fields, ensure_ascii=False), encoding="utf-8"
+        )
+        for subset in subsets:
+            path = root / "images" / subset / f"{image_id}.jpg"
+            write_image(path, _seed(subset, i), image_size)
+    _mark_complete(root, params)
+    return root
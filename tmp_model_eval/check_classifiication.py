@@ -1,10 +1,12 @@
+import argparse
+import functools
+from contextlib import ExitStack
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import pandas as pd
-from bench_utils.metrics import calculate_classification_metrics
-from bench_utils.model_utils import initialize_model, load_prompt, prepare_prompt
+from bench_utils.model_utils import load_prompt, prepare_prompt
 from bench_utils.utils import load_config, save_results_to_csv
 from print_utils import (  # type: ignore
     print_error,
@@ -13,15 +15,30 @@ from print_utils import (  # type: ignore
     print_section,
     print_success,
 )
-from sklearn.metrics import classification_report, confusion_matrix  # type: ignore
 from tqdm import tqdm
 
+from batch_controller import SCOPE_BATCH, BatchController
+from batch_inference import iter_batches, predict_batch_timed
+from classification_metrics import ConfusionAccumulator
+from dataset_manifest import DatasetManifest, manifest_from_config
+from image_normalization import ImageNormalizer, normalized_model_config
+from image_prefetch import Prefetcher, accepts_images, load_image, prefetch_settings
+from inference_stats import CACHED, STATS_FIELDS, InferenceRecord, summarize
+from model_backends import create_model
+from prediction_cache import CachedPrediction, PredictionCache, model_fingerprint, text_hash
+from run_journal import JournalMismatchError, RunJournal, journal_path
+from sampling import StratifiedSampler
+from sharded_eval import ShardedRunner, sharding_settings
+from stage_timer import configure_from, span, timed_iter
+
 
 def get_image_paths(
     dataset_path: Path,
     class_names: List[str],
     subset_name: str,
     sample_size: Optional[int] = None,
+    manifest: Optional[DatasetManifest] = None,
+    sampler: Optional[StratifiedSampler] = None,
 ) -> List[Path]:
     """Собирает пути к изображениям для указанного подмножества данных.
 
@@ -35,23 +52,40 @@ def get_image_paths(
         subset_name (str): Имя подмножества (например, 'clean', 'blur').
         sample_size (Optional[int]): Количество файлов для выборки из каждой
             директории класса. Если None, обрабатываются все файлы.
+        manifest (Optional[DatasetManifest]): Индекс датасета; если задан,
+            каталоги не обходятся, а берутся из индекса (в том же порядке).
+        sampler (Optional[StratifiedSampler]): Сэмплер с зерном и квотами;
+            если задан, ``sample_size`` не используется.
 
     Returns:
         List[Path]: Список объектов Path, ведущих к выбранным изображениям.
     """
-    selected_files = []
+    if sampler is None:
+        sampler = StratifiedSampler(sample_size)
+
+    entries: Dict[str, List[Path]] = {}
     print_section(f"Обработка сабсета: {subset_name}")
     for class_name in class_names:
         class_dir = dataset_path / class_name / "images" / subset_name
-        if not class_dir.exists():
+        if manifest is not None:
+            paths = manifest.iterdir(class_dir)
+            if paths is None:
+                continue
+        elif class_dir.exists():
+            paths = list(class_dir.iterdir())
+        else:
             continue
+        entries[class_name] = paths
 
-        paths = list(class_dir.iterdir())
-        if sample_size is not None:
-            paths = paths[:sample_size]
-
+    selected_files = []
+    for paths in sampler.sample(entries).values():
         for path in paths:
-            if path.is_file():
+            if manifest is not None:
+                if manifest.is_dir(path):
+                    selected_files.extend(manifest.files(path))
+                else:
+                    selected_files.append(path)
+            elif path.is_file():
                 selected_files.append(path)
             else:
                 selected_files.extend(p for p in path.iterdir() if p.is_file())
@@ -60,8 +94,37 @@ def get_image_paths(
     return selected_files
 
 
+def parse_prediction(result: Optional[str], document_classes: Dict[str, str]) -> str:
+    """Преобразует сырой ответ модели в ключ класса.
+
+    Args:
+        result (Optional[str]): Ответ модели (ожидается индекс класса) или None,
+            если инференс завершился ошибкой.
+        document_classes (Dict[str, str]): Словарь классов документов.
+
+    Returns:
+        str: Ключ класса (например, 'invoice') или 'None', если ответ
+             некорректен.
+    """
+    if not isinstance(result, str):
+        return "None"
+
+    prediction = result.strip().strip('"')
+
+    if prediction.isdigit():
+        class_index = int(prediction)
+        if 0 <= class_index < len(document_classes):
+            return list(document_classes.keys())[class_index]
+    return "None"
+
+
 def get_prediction(
-    model: Any, image_path: Path, prompt: str, document_classes: Dict[str, str]
+    model: Any,
+    image_path: Path,
+    prompt: str,
+    document_classes: Dict[str, str],
+    cache: Optional[PredictionCache] = None,
+    normalizer: Optional[ImageNormalizer] = None,
 ) -> str:
     """Получает предсказание модели для одного изображения.
 
@@ -70,50 +133,296 @@ def get_prediction(
         image_path (Path): Путь к файлу изображения.
         prompt (str): Промпт, который будет подан модели вместе с изображением.
         document_classes (Dict[str, str]): Словарь классов документов.
+        cache (Optional[PredictionCache]): Кеш ответов модели. Если ответ
+            для пары (промпт, изображение) уже есть в кеше, модель не вызывается.
+        normalizer (Optional[ImageNormalizer]): Нормализация изображения;
+            модели передаётся путь к нормализованному файлу.
 
     Returns:
         str: Предсказанный ключ класса (например, 'invoice') или 'None'
              в случае ошибки или некорректного ответа модели.
     """
     try:
+        cached = cache.get(prompt, image_path) if cache is not None else None
+        if cached is not None:
+            return parse_prediction(cached, document_classes)
+
+        model_input = image_path
+        if normalizer is not None:
+            with span("load_image"):
+                model_input = normalizer.prepare(image_path)
         # Передаем путь к изображению напрямую в модель
-        result = model.predict_on_image(image=str(image_path), prompt=prompt)
-        prediction = result.strip().strip('"')
-
-        if prediction.isdigit():
-            class_index = int(prediction)
-            if 0 <= class_index < len(document_classes):
-                pred_class_name = list(document_classes.values())[class_index]
-                # Создаем обратное отображение для быстрого поиска ключа класса
-                class_names_to_keys = {v: k for k, v in document_classes.items()}
-                return class_names_to_keys.get(pred_class_name, "None")
-        return "None"
+        with span("model"):
+            result = model.predict_on_image(image=str(model_input), prompt=prompt)
+        if cache is not None and isinstance(result, str):
+            cache.put(prompt, image_path, result)
+        with span("parse_response"):
+            return parse_prediction(result, document_classes)
 
     except Exception as e:
         print_error(f"Ошибка при классификации файла {image_path.name}: {e}")
         return "None"
 
 
+def get_predictions_batch(
+    model: Any,
+    images: List[Any],
+    prompt: str,
+    document_classes: Dict[str, str],
+    cache: Optional[PredictionCache] = None,
+    image_paths: Optional[List[Path]] = None,
+    controller: Optional[BatchController] = None,
+) -> Tuple[List[str], List[Optional[InferenceRecord]]]:
+    """Получает предсказания модели для батча изображений.
+
+    Если обёртка модели реализует ``predict_on_batch``, батч обрабатывается
+    одним вызовом, иначе — поэлементно через ``predict_on_image``.
+
+    Args:
+        model (Any): Инициализированный объект модели для классификации.
+        images (List[Any]): Изображения батча (пути или предзагруженные
+            изображения); None — изображение не удалось загрузить;
+            ``CachedPrediction`` — ответ уже найден в кеше.
+        prompt (str): Промпт, общий для всех изображений батча.
+        document_classes (Dict[str, str]): Словарь классов документов.
+        cache (Optional[PredictionCache]): Кеш, в который сохраняются новые
+            ответы модели (требует ``image_paths``).
+        image_paths (Optional[List[Path]]): Пути к изображениям батча.
+        controller (Optional[BatchController]): Контроллер размера батча,
+            делящий батч при нехватке памяти.
+
+    Returns:
+        Tuple[List[str], List[Optional[InferenceRecord]]]: Предсказанные ключи
+        классов в порядке ``images`` и стоимость каждого предсказания
+        (``CACHED`` для ответов из кеша, None — модель не вызывалась или упала).
+    """
+    responses: List[Optional[str]] = [None] * len(images)
+    records: List[Optional[InferenceRecord]] = [None] * len(images)
+    to_predict = []
+    for i, image in enumerate(images):
+        if isinstance(image, CachedPrediction):
+            responses[i] = image.response
+            records[i] = CACHED
+        else:
+            to_predict.append(i)
+
+    with span("model"):
+        results, result_records = predict_batch_timed(
+            model,
+            [str(images[i]) if isinstance(images[i], Path) else images[i] for i in to_predict],
+            [prompt] * len(to_predict),
+            controller,
+        )
+    for i, result, record in zip(to_predict, results, result_records, strict=True):
+        responses[i] = result
+        records[i] = record
+        if cache is not None and image_paths is not None and isinstance(result, str):
+            cache.put(prompt, image_paths[i], result)
+
+    with span("parse_response"):
+        labels = [parse_prediction(response, document_classes) for response in responses]
+    return labels, records
+
+
+def load_image_safe(
+    path: Path, normalizer: Optional[ImageNormalizer] = None, decode: bool = False
+) -> Optional[Any]:
+    """Готовит вход модели для предзагрузки; при ошибке возвращает None.
+
+    Args:
+        path (Path): Путь к файлу изображения.
+        normalizer (Optional[ImageNormalizer]): Нормализация изображения.
+        decode (bool): Декодировать изображение (для моделей, принимающих
+            изображения, см. ``image_prefetch.accepts_images``); иначе
+            возвращается путь к файлу (нормализованному, если задан ``normalizer``).
+
+    Returns:
+        Optional[Any]: Путь к файлу или декодированное изображение; None, если
+        файл не удалось прочитать (такое изображение получит предсказание 'None').
+    """
+    try:
+        with span("load_image"):
+            if not decode:
+                return str(path if normalizer is None else normalizer.prepare(path))
+            return load_image(path) if normalizer is None else normalizer.load(path)
+    except Exception as e:
+        print_error(f"Ошибка при загрузке файла {path.name}: {e}")
+        return None
+
+
+def load_for_inference(
+    path: Path,
+    prompt: str,
+    cache: Optional[PredictionCache],
+    normalizer: Optional[ImageNormalizer] = None,
+    decode: bool = False,
+) -> Optional[Any]:
+    """Готовит вход модели для изображения с учётом кеша предсказаний.
+
+    При попадании в кеш изображение не загружается вовсе.
+
+    Args:
+        path (Path): Путь к файлу изображения.
+        prompt (str): Отрендеренный промпт.
+        cache (Optional[PredictionCache]): Кеш ответов модели.
+        normalizer (Optional[ImageNormalizer]): Нормализация изображения.
+        decode (bool): Декодировать изображение (см. ``load_image_safe``).
+
+    Returns:
+        Optional[Any]: ``CachedPrediction``, путь к файлу, декодированное
+        изображение или None, если файл не удалось прочитать.
+    """
+    if cache is not None:
+        try:
+            with span("cache_lookup"):
+                cached = cache.get(prompt, path)
+        except OSError as e:
+            print_error(f"Ошибка при чтении файла {path.name}: {e}")
+            return None
+        if cached is not None:
+            return CachedPrediction(cached)
+    return load_image_safe(path, normalizer, decode)
+
+
+def predict_paths(
+    model: Any,
+    prefetcher: Prefetcher,
+    paths: List[Path],
+    prompt: str,
+    document_classes: Dict[str, str],
+    batch_size: int,
+    cache: Optional[PredictionCache] = None,
+    controller: Optional[BatchController] = None,
+) -> Iterator[Tuple[Path, Tuple[str, Optional[InferenceRecord]]]]:
+    """Получает предсказания для изображений, загружая их в фоне.
+
+    Args:
+        model (Any): Инициализированный объект модели для классификации.
+        prefetcher (Prefetcher): Предзагрузчик входов модели по путям.
+        paths (List[Path]): Пути к изображениям.
+        prompt (str): Промпт, общий для всех изображений.
+        document_classes (Dict[str, str]): Словарь классов документов.
+        batch_size (int): Размер батча.
+        cache (Optional[PredictionCache]): Кеш ответов модели.
+        controller (Optional[BatchController]): Контроллер размера батча.
+
+    Yields:
+        Tuple[Path, Tuple[str, Optional[InferenceRecord]]]: Путь к изображению,
+        предсказанный ключ класса и стоимость предсказания — в порядке ``paths``.
+    """
+    # Время ожидания батча — простой цикла из-за медленной загрузки изображений
+    for batch in timed_iter(iter_batches(prefetcher.iterate(paths), batch_size), "wait_input"):
+        batch_paths = [path for path, _ in batch]
+        batch_pred, batch_records = get_predictions_batch(
+            model,
+            [image for _, image in batch],
+            prompt,
+            document_classes,
+            cache=cache,
+            image_paths=batch_paths,
+            controller=controller,
+        )
+        yield from zip(batch_paths, zip(batch_pred, batch_records, strict=True), strict=True)
+
+
+class ClassificationWorker:
+    """Обработчик для шардированного режима (см. ``sharded_eval``).
+
+    Создаётся в дочернем процессе: загружает свою копию модели, открывает
+    кеш предсказаний и классифицирует присланные блоки изображений.
+
+    Args:
+        model_config (Dict[str, Any]): Секция ``model`` с ``device_map`` процесса.
+        task_config (Dict[str, Any]): Секция ``task`` конфига.
+        prompt (str): Отрендеренный промпт.
+        document_classes (Dict[str, str]): Словарь классов документов.
+    """
+
+    def __init__(
+        self,
+        model_config: Dict[str, Any],
+        task_config: Dict[str, Any],
+        prompt: str,
+        document_classes: Dict[str, str],
+    ) -> None:
+        self.timer = configure_from(task_config.get("profiling"))
+        self.model = create_model(model_config)
+        self.prompt = prompt
+        self.document_classes = document_classes
+        self.batch_size = int(task_config.get("batch_size", 1))
+        self.normalizer = ImageNormalizer.from_config(task_config.get("image_normalization"))
+        self.cache = PredictionCache.from_config(
+            task_config.get("prediction_cache"),
+            normalized_model_config(model_config, self.normalizer),
+        )
+        self.controller = BatchController.from_config(
+            task_config.get("batch_limits"), model_config, SCOPE_BATCH, self.batch_size
+        )
+        self.prefetcher: Prefetcher[Path] = Prefetcher(
+            lambda path: load_for_inference(
+                path, prompt, self.cache, self.normalizer, accepts_images(self.model)
+            ),
+            **prefetch_settings(task_config.get("prefetch")),
+        )
+
+    def __call__(self, paths: List[Path]) -> List[Tuple[str, Optional[InferenceRecord]]]:
+        predictions = predict_paths(
+            self.model,
+            self.prefetcher,
+            paths,
+            self.prompt,
+            self.document_classes,
+            self.batch_size,
+            self.cache,
+            self.controller,
+        )
+        return [pred for _, pred in predictions]
+
+    def close(self) -> None:
+        self.controller.close()
+        if self.normalizer is not None:
+            print_info(self.normalizer.stats())
+        if self.cache is not None:
+            print_info(self.cache.stats())
+            self.cache.close()
+        if self.timer.enabled:
+            print_info(f"Время по стадиям в обработчике:\n{self.timer.format_summary()}")
+
+
+def get_true_class(path: Path, dataset_path: Path) -> str:
+    """Определяет истинный класс изображения по его расположению в датасете.
+
+    Args:
+        path (Path): Путь к изображению.
+        dataset_path (Path): Корневой путь к датасету.
+
+    Returns:
+        str: Имя класса или 'Unknown', если его не удалось определить.
+    """
+    try:
+        # Имя класса всегда является первым сегментом после корневой директории датасета.
+        return path.relative_to(dataset_path).parts[0]
+    except ValueError:
+        # На случай, если path не является прямым потомком dataset_path
+        return path.parts[-5] if len(path.parts) >= 5 else "Unknown"
+
+
 def calculate_and_save_metrics(
-    y_true: List[str],
-    y_pred: List[str],
+    accumulator: ConfusionAccumulator,
     subset_name: str,
     run_id: str,
-    document_classes: Dict[str, str],
 ) -> Dict[str, float]:
     """Вычисляет и сохраняет метрики, возвращает словарь с основными метриками.
 
     Args:
-        y_true (List[str]): Список истинных меток классов.
-        y_pred (List[str]): Список предсказанных меток классов.
+        accumulator (ConfusionAccumulator): Матрица ошибок сабсета.
         subset_name (str): Имя обрабатываемого подмножества.
         run_id (str): Уникальный идентификатор запуска для именования файлов.
-        document_classes (Dict[str, str]): Словарь классов документов.
 
     Returns:
         Dict[str, float]: Словарь с вычисленными метриками или пустой словарь.
     """
-    metrics = calculate_classification_metrics(y_true, y_pred, document_classes)
+    metrics = accumulator.metrics()
     if metrics:
         save_results_to_csv(
             metrics, f"{run_id}_{subset_name}_classification_results.csv", subset_name
@@ -122,36 +431,25 @@ def calculate_and_save_metrics(
 
 
 def calculate_and_save_confusion_matrix(
-    y_true: List[str],
-    y_pred: List[str],
+    accumulator: ConfusionAccumulator,
     subset_name: str,
     run_id: str,
-    document_classes: Dict[str, str],
 ) -> None:
-    """Вычисляет матрицу ошибок и сохраняет её в CSV файл.
+    """Сохраняет матрицу ошибок в CSV файл.
 
     Args:
-        y_true (List[str]): Список истинных меток классов.
-        y_pred (List[str]): Список предсказанных меток классов.
+        accumulator (ConfusionAccumulator): Матрица ошибок сабсета.
         subset_name (str): Имя сабсета, для которого вычисляется матрица.
         run_id (str): Идентификатор запуска, используется в имени выходного файла.
-        document_classes (Dict[str, str]): Словарь классов документов.
     """
 
-    if not y_true:
+    if not accumulator.total:
         print("Нет данных для построения confusion matrix.")
         return
 
-    # Формируем полный список меток, включая возможный класс 'None'
-    labels = list(document_classes.keys())
-    if "None" in set(y_pred):
-        labels.append("None")
-
+    # Метки: классы документов и 'None', если модель давала некорректные ответы.
     # Обычная (ненормализованная) матрица ошибок — абсолютные количества
-    cm = confusion_matrix(y_true, y_pred, labels=labels)
-
-    # Преобразуем в DataFrame и округляем значения для наглядности
-    cm_df = pd.DataFrame(cm, index=labels, columns=labels).round(4)
+    cm_df = accumulator.confusion_frame()
 
     print_section(f"Confusion Matrix для сабсета {subset_name}")
     print(cm_df)
@@ -162,50 +460,102 @@ def calculate_and_save_confusion_matrix(
 
 
 def calculate_and_save_class_report(
-    y_true: List[str],
-    y_pred: List[str],
+    accumulator: ConfusionAccumulator,
     subset_name: str,
     run_id: str,
-    document_classes: Dict[str, str],
 ) -> None:
-    """Сохраняет подробный classification_report (precision/recall/F1 per class).
+    """Сохраняет подробный отчёт по классам (precision/recall/F1 per class).
 
     Args:
-        y_true: истинные метки.
-        y_pred: предсказанные метки.
+        accumulator: матрица ошибок сабсета или всего датасета.
         subset_name: имя сабсета или 'overall'.
         run_id: идентификатор запуска.
-        document_classes: словарь классов.
     """
 
-    if not y_true:
+    if not accumulator.total:
         return
 
-    all_classes = list(document_classes.keys())
-    if "None" in set(y_pred):
-        all_classes.append("None")
-
-    report = classification_report(
-        y_true, y_pred, labels=all_classes, output_dict=True, zero_division=0
-    )
-
-    report_df = pd.DataFrame(report).transpose().round(4)
+    report_df = accumulator.class_report().round(4)
 
     out_path = f"{run_id}_{subset_name}_class_report.csv"
     report_df.to_csv(out_path)
     print_success(f"Отчёт по классам сохранён в {out_path}")
 
 
-def run_evaluation(config: Dict[str, Any]) -> None:
+def save_inference_stats(rows: List[Dict[str, Any]], run_id: str) -> None:
+    """Печатает и сохраняет сводку стоимости инференса по сабсетам.
+
+    Args:
+        rows (List[Dict[str, Any]]): Результаты ``inference_stats.summarize``
+            с полем ``subset`` (последняя строка — ``overall``).
+        run_id (str): Уникальный идентификатор запуска.
+    """
+    stats_df = pd.DataFrame(rows)
+    print_section("Стоимость инференса")
+    overall = rows[-1]
+    if overall["requests_per_s"] is not None:
+        print_info(
+            f"Запросов/с: {overall['requests_per_s']}, изображений/с: {overall['images_per_s']}, "
+            f"изображений в запросе: {overall['mean_images_per_request']}"
+        )
+        print_info(
+            f"Задержка запроса p50/p95/p99, с: {overall['latency_p50_s']} / "
+            f"{overall['latency_p95_s']} / {overall['latency_p99_s']}"
+        )
+    if overall["completion_tokens_per_s"] is not None:
+        print_info(f"Токенов ответа/с: {overall['completion_tokens_per_s']}")
+    out_path = f"{run_id}_inference_stats.csv"
+    stats_df.to_csv(out_path, index=False)
+    print_success(f"Статистика инференса сохранена в {out_path}")
+
+
+def get_item_id(path: Path, dataset_path: Path) -> str:
+    """Возвращает идентификатор изображения для журнала запуска.
+
+    Args:
+        path (Path): Путь к изображению.
+        dataset_path (Path): Корневой путь к датасету.
+
+    Returns:
+        str: Путь относительно корня датасета (или исходный путь, если
+             изображение лежит вне датасета).
+    """
+    try:
+        return path.relative_to(dataset_path).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def run_evaluation(
+    config: Dict[str, Any], resume_run_id: Optional[str] = None, force: bool = False
+) -> None:
     """Основной цикл оценки модели.
 
     Оркестрирует весь процесс: от загрузки конфигурации и инициализации
     модели до итерации по подмножествам, сбора предсказаний и расчета
     итоговых средних метрик.
 
+    Каждое предсказание сразу дописывается в журнал ``<run_id>_journal.jsonl``.
+    При возобновлении запуска изображения из журнала повторно не обрабатываются,
+    а метрики считаются по всем предсказаниям — старым и новым. Журнал,
+    записанный с другими промптом или конфигурацией модели, не продолжается
+    без ``force``.
+
+    Если в ``task.sharding`` заданы устройства, инференс идёт в отдельных
+    процессах (по одному на устройство), а результаты собираются здесь же
+    в исходном порядке — выходные файлы совпадают с однопроцессным запуском.
+
     Args:
         config (Dict[str, Any]): Словарь с полной конфигурацией для запуска,
                                 содержащий секции 'task', 'model' и 'document_classes'.
+        resume_run_id (Optional[str]): Идентификатор прерванного запуска,
+            который нужно продолжить. Если None, начинается новый запуск.
+        force (bool): Продолжить запуск, даже если промпт или модель
+            изменились с момента его прерывания.
+
+    Raises:
+        JournalMismatchError: Если журнал прерванного запуска записан с
+            другими промптом или моделью, а ``force`` не задан.
     """
     # --- Вывод параметров перед стартом ---
     print_header()
@@ -219,13 +569,22 @@ def run_evaluation(config: Dict[str, Any]) -> None:
     print_info(f"Subsets: {', '.join(task_config['subsets'])}")
     if task_config.get("sample_size"):
         print_info(f"Sample size: {task_config['sample_size']}")
+    if task_config.get("sampling"):
+        print_info(f"Выборка: {task_config['sampling']}")
+    if task_config.get("image_normalization"):
+        print_info(f"Нормализация изображений: {task_config['image_normalization']}")
+    print_info(f"Batch size: {task_config.get('batch_size', 1)}")
     print_info(f"Модель: {model_config['model_name']}")
 
     dataset_path = Path(task_config["dataset_path"])
     prompt_path = Path(task_config["prompt_path"])
-    sample_size = task_config.get("sample_size")
-
-    model = initialize_model(model_config)
+    sampler = StratifiedSampler.from_config(task_config)
+    batch_size = int(task_config.get("batch_size", 1))
+    sharding = sharding_settings(task_config)
+    profiling = task_config.get("profiling")
+    timer = configure_from(profiling)
+    with span("dataset_scan"):
+        manifest = manifest_from_config(dataset_path, task_config.get("manifest"))
 
     template = load_prompt(prompt_path)
     classes_str = ", ".join(
@@ -233,52 +592,161 @@ def run_evaluation(config: Dict[str, Any]) -> None:
     )
     prompt = prepare_prompt(template, classes=classes_str)
 
-    # Формируем уникальный run_id = <model>_<prompt>_<YYYYMMDD_HHMMSS>
-    model_name_clean = model_config["model_name"].replace(" ", "_")
-    prompt_name = prompt_path.stem
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    run_id = f"{model_name_clean}_{prompt_name}_{timestamp}"
-    all_metrics = []
-
-    for subset in task_config["subsets"]:
-        image_paths = get_image_paths(
-            dataset_path, list(document_classes.keys()), subset, sample_size
-        )
-
-        if not image_paths:
-            continue
-
-        y_true, y_pred = [], []
-        for path in tqdm(image_paths, desc=f"Обработка {subset}"):
-            try:
-                # Имя класса всегда является первым сегментом после корневой директории датасета.
-                class_name = path.relative_to(dataset_path).parts[0]
-            except ValueError:
-                # На случай, если path не является прямым потомком dataset_path
-                class_name = path.parts[-5] if len(path.parts) >= 5 else "Unknown"
-
-            y_true.append(class_name)
-            y_pred.append(get_prediction(model, path, prompt, document_classes))
-
-        subset_metrics = calculate_and_save_metrics(
-            y_true, y_pred, subset, run_id, document_classes
-        )
-        # --- Confusion matrix ---
-        calculate_and_save_confusion_matrix(
-            y_true, y_pred, subset, run_id, document_classes
-        )
-        # --- Class-wise detailed metrics ---
-        calculate_and_save_class_report(
-            y_true, y_pred, subset, run_id, document_classes
-        )
-        if subset_metrics:
-            all_metrics.append(subset_metrics)
-
-    # --- Общий отчёт по классам на всём датасете ---
-    if y_true and y_pred:
-        calculate_and_save_class_report(
-            y_true, y_pred, "overall", run_id, document_classes
-        )
+    cache = None
+    normalizer = ImageNormalizer.from_config(task_config.get("image_normalization"))
+    # Ответы модели зависят и от нормализации изображений: она входит в ключи
+    # кеша ответов и в отпечаток модели в журнале
+    model_key_config = normalized_model_config(model_config, normalizer)
+    # Предсказания для списка путей: в процессах шардов или в текущем процессе
+    predict: Callable[[List[Path]], Iterator[Tuple[Path, Tuple[str, Optional[InferenceRecord]]]]]
+    # Процессы шардов, журнал, кеш и пределы закрываются и при ошибке
+    with ExitStack() as stack:
+        if resume_run_id:
+            run_id = resume_run_id
+            if not journal_path(run_id).exists():
+                raise FileNotFoundError(f"Журнал запуска не найден: {journal_path(run_id)}")
+            print_info(f"Продолжаем запуск: {run_id}")
+        else:
+            # Формируем уникальный run_id = <model>_<prompt>_<YYYYMMDD_HHMMSS>
+            model_name_clean = model_config["model_name"].replace(" ", "_")
+            prompt_name = prompt_path.stem
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            run_id = f"{model_name_clean}_{prompt_name}_{timestamp}"
+
+        journal = RunJournal(journal_path(run_id))
+        stack.callback(journal.close)
+        meta = {
+            "model_name": model_config["model_name"],
+            "model_sha256": model_fingerprint(model_key_config),
+            "prompt_sha256": text_hash(prompt),
+            "dataset_path": str(dataset_path),
+        }
+        journal.check_resume(meta, force)
+        journal.write_meta(**meta, started_at=datetime.now().isoformat(timespec="seconds"))
+
+        if sharding:
+            print_info(f"Шардирование: {', '.join(sharding['device_maps'])}")
+            runner = stack.enter_context(
+                ShardedRunner(
+                    ClassificationWorker,
+                    model_config,
+                    sharding["device_maps"],
+                    worker_args=(task_config, prompt, document_classes),
+                    chunk_size=sharding["chunk_size"],
+                )
+            )
+            predict = runner.map
+        else:
+            model = create_model(model_config)
+            cache = PredictionCache.from_config(task_config.get("prediction_cache"), model_key_config)
+            if cache is not None:
+                stack.callback(cache.close)
+            controller = BatchController.from_config(
+                task_config.get("batch_limits"), model_config, SCOPE_BATCH, batch_size
+            )
+            stack.callback(controller.close)
+            prefetcher: Prefetcher[Path] = Prefetcher(
+                lambda path: load_for_inference(
+                    path, prompt, cache, normalizer, accepts_images(model)
+                ),
+                **prefetch_settings(task_config.get("prefetch")),
+            )
+            predict = functools.partial(
+                predict_paths,
+                model,
+                prefetcher,
+                prompt=prompt,
+                document_classes=document_classes,
+                batch_size=batch_size,
+                cache=cache,
+                controller=controller,
+            )
+
+        all_metrics = []
+        overall = ConfusionAccumulator(document_classes.keys())
+        inference_rows = []
+        all_inference_records: List[Dict[str, Any]] = []
+
+        for subset in task_config["subsets"]:
+            with span("dataset_scan"):
+                image_paths = get_image_paths(
+                    dataset_path,
+                    list(document_classes.keys()),
+                    subset,
+                    manifest=manifest,
+                    sampler=sampler,
+                )
+
+            if not image_paths:
+                continue
+
+            accumulator = ConfusionAccumulator(document_classes.keys())
+
+            # Предсказания, уже сохранённые в журнале прерванного запуска
+            completed = journal.completed(subset)
+            pending = []
+            inference_records: List[Dict[str, Any]] = []
+            for path in image_paths:
+                record = completed.get(get_item_id(path, dataset_path))
+                if record is None:
+                    pending.append(path)
+                else:
+                    accumulator.update(record["y_true"], record["y_pred"])
+                    inference_records.append({key: record.get(key) for key in STATS_FIELDS})
+            del completed
+            if len(pending) < len(image_paths):
+                print_info(f"Восстановлено из журнала: {len(image_paths) - len(pending)}")
+
+            # Чтение и декодирование изображений идёт в фоне, параллельно с инференсом
+            with tqdm(
+                total=len(image_paths),
+                initial=len(image_paths) - len(pending),
+                desc=f"Обработка {subset}",
+            ) as pbar:
+                for path, (pred, inference) in predict(pending):
+                    true_class = get_true_class(path, dataset_path)
+                    accumulator.update(true_class, pred)
+                    stats = inference.as_fields() if inference is not None else {}
+                    inference_records.append(stats)
+                    with span("journal"):
+                        journal.append(
+                            subset,
+                            get_item_id(path, dataset_path),
+                            y_true=true_class,
+                            y_pred=pred,
+                            **stats,
+                        )
+                    pbar.update(1)
+                    pbar.set_postfix(acc=f"{accumulator.accuracy():.4f}")
+
+            with span("metrics"):
+                subset_metrics = calculate_and_save_metrics(accumulator, subset, run_id)
+                # --- Confusion matrix ---
+                calculate_and_save_confusion_matrix(accumulator, subset, run_id)
+                # --- Class-wise detailed metrics ---
+                calculate_and_save_class_report(accumulator, subset, run_id)
+            overall.merge(accumulator)
+            if subset_metrics:
+                all_metrics.append(subset_metrics)
+            inference_rows.append({"subset": subset, **summarize(inference_records)})
+            all_inference_records.extend(inference_records)
+
+        # --- Общий отчёт по классам на всём датасете ---
+        with span("metrics"):
+            calculate_and_save_class_report(overall, "overall", run_id)
+
+        print_info(f"Журнал запуска: {journal_path(run_id)}")
+
+        if inference_rows:
+            inference_rows.append({"subset": "overall", **summarize(all_inference_records)})
+            save_inference_stats(inference_rows, run_id)
+
+        if cache is not None:
+            print_info(cache.stats())
+
+        # При шардировании изображения нормализуют процессы-обработчики
+        if normalizer is not None and not sharding:
+            print_info(normalizer.stats())
 
     if all_metrics:
         final_df = pd.DataFrame(all_metrics)
@@ -293,16 +761,40 @@ def run_evaluation(config: Dict[str, Any]) -> None:
         final_df.to_csv(out_file, index=False)
         print_success(f"Итоговые метрики сохранены в {out_file}")
 
+    if timer.enabled:
+        print_section("Время по стадиям")
+        print_info(timer.format_summary())
+        if profiling.get("trace_path"):
+            trace_path = timer.export_trace(profiling["trace_path"])
+            print_success(f"Трасса сохранена в {trace_path}")
+
 
 def main() -> None:
     """Главная функция для запуска процесса классификации.
 
     Загружает конфигурацию и запускает основной цикл оценки.
     """
+    parser = argparse.ArgumentParser(description="Оценка модели на задаче классификации")
+    parser.add_argument(
+        "--config", default="config_classification.json", help="Путь к конфигу"
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="RUN_ID",
+        default=None,
+        help="Продолжить прерванный запуск по его run_id",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Продолжить запуск, даже если промпт или модель изменились",
+    )
+    args = parser.parse_args()
+
     try:
-        config = load_config("config_classification.json")
-        run_evaluation(config)
-    except (FileNotFoundError, KeyError) as e:
+        config = load_config(args.config)
+        run_evaluation(config, resume_run_id=args.resume, force=args.force)
+    except (FileNotFoundError, KeyError, JournalMismatchError) as e:
         print_error(f"Ошибка: {e}")
 
 
@@ -1,23 +1,57 @@
 import asyncio
 import base64
+import hashlib
 import json
 import os
+import time
 import uuid
 from asyncio import create_task
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 
 import click
-import Levenshtein
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionContentPartParam, ChatCompletionMessageParam
 from pydantic import BaseModel, create_model
-from sklearn.metrics import f1_score, precision_score, recall_score
 from tqdm.asyncio import tqdm
 
+from adaptive_client import AdaptiveLimiter, RequestPool, create_client
+from image_prefetch import (
+    DEFAULT_MAX_AHEAD,
+    DEFAULT_MAX_BYTES,
+    DEFAULT_NUM_WORKERS,
+    Prefetcher,
+    PrefetchSettings,
+    prefetch_settings,
+)
+from inference_stats import InferenceRecord, read_usage, summarize
+from json_loader import DEFAULT_NUM_WORKERS as DEFAULT_LOAD_WORKERS
+from json_loader import load_eval_records, read_json
+from payload_cache import DEFAULT_MAX_MEMORY_BYTES, PayloadCache
+from results_store import prompt_id, save_results
+from schema_scheduling import LatencyStats, order_by_schema
+from stage_timer import configure_from, span
+from text_metrics import batch_cer, batch_wer
+
 load_dotenv()
 
 client = AsyncOpenAI(
@@ -26,96 +60,126 @@ client = AsyncOpenAI(
 )
 
 
-def char_error_rate(gt_str, pred_str):
-    return Levenshtein.distance(gt_str, pred_str) / max(1, len(gt_str))
+def char_error_rate(gt: str, pred: str) -> float:
+    return float(batch_cer([gt], [pred])[0])
 
 
 def word_error_rate(gt: str, pred: str) -> float:
-    gt_words = gt.strip().split()
-    pred_words = pred.strip().split()
-    return Levenshtein.distance(" ".join(gt_words), " ".join(pred_words)) / max(
-        1, len(gt_words)
-    )
+    return float(batch_wer([gt], [pred])[0])
 
 
-def evaluate(gt_path, pred_path, fuzzy_threshold=90):
+def evaluate(
+    gt_path: Union[str, Path],
+    pred_path: Union[str, Path],
+    fuzzy_threshold: int = 90,
+    num_workers: int = DEFAULT_LOAD_WORKERS,
+) -> Dict[str, Any]:
     rows = []
 
-    gt_path = Path(gt_path)
-    pred_path = Path(pred_path)
-
-    files = sorted(gt_path.glob("*.json"))
-
-    for i, gt_file in enumerate(files):
-        with open(gt_file, "r", encoding="utf-8") as f:
-            gt = json.load(f)
-        with open(pred_path / gt_file.name, "r", encoding="utf-8") as f:
-            pred = json.load(f)
+    # Документы без предсказания учитываются с пустыми значениями всех полей
+    records = load_eval_records(gt_path, pred_path, num_workers)
 
+    for doc_id, gt, pred in records:
         for key in gt.keys():
             gt_val = gt.get(key, "").strip()
             pred_val = pred.get(key, "").strip()
 
             exact_match = int(gt_val == pred_val)
 
-            cer = char_error_rate(gt_val, pred_val)
-            wer = word_error_rate(gt_val, pred_val)
-
             rows.append(
                 {
-                    "doc_id": i,
+                    "doc_id": doc_id,
                     "field": key,
                     "gt": gt_val,
                     "pred": pred_val,
                     "exact_match": exact_match,
-                    "cer": cer,
-                    "wer": wer,
                 }
             )
 
-    df = pd.DataFrame(rows)
+    df = pd.DataFrame(rows, columns=["doc_id", "field", "gt", "pred", "exact_match"])
+
+    # CER/WER считаются сразу для всех ячеек, без Python-цикла по строкам
+    df["cer"] = batch_cer(df["gt"].tolist(), df["pred"].tolist())
+    df["wer"] = batch_wer(df["gt"].tolist(), df["pred"].tolist())
 
     df["y_true"] = df["gt"] != ""
     df["y_pred"] = df["gt"] == df["pred"]
 
-    precision = precision_score(df["y_true"], df["y_pred"])
-    recall = recall_score(df["y_true"], df["y_pred"])
-    f1 = f1_score(df["y_true"], df["y_pred"])
-
-    exact_accuracy = df["exact_match"].mean()
-    avg_cer = df["cer"].mean()
-    avg_wer = df["wer"].mean()
-
-    def compute_field_metrics(group):
-        return pd.Series(
-            {
-                "exact_match": group["exact_match"].mean(),
-                "cer": group["cer"].mean(),
-                "wer": group["wer"].mean(),
-                "precision": precision_score(
-                    group["y_true"], group["y_pred"], zero_division=0
-                ),
-                "recall": recall_score(
-                    group["y_true"], group["y_pred"], zero_division=0
-                ),
-                "f1": f1_score(group["y_true"], group["y_pred"], zero_division=0),
-            }
-        )
-
-    per_field = df.groupby("field").apply(compute_field_metrics).reset_index()
+    overall = aggregate_metrics(df).iloc[0]
 
     return {
-        "exact_accuracy": exact_accuracy,
-        "avg_cer": avg_cer,
-        "avg_wer": avg_wer,
-        "precision": precision,
-        "recall": recall,
-        "f1": f1,
-        "per_field_metrics": per_field,
+        "exact_accuracy": overall["exact_match"],
+        "avg_cer": overall["cer"],
+        "avg_wer": overall["wer"],
+        "precision": overall["precision"],
+        "recall": overall["recall"],
+        "f1": overall["f1"],
+        "per_field_metrics": aggregate_metrics(df, "field"),
+        "per_document_metrics": aggregate_metrics(df, "doc_id"),
         "full_df": df,
     }
 
 
+def _ratio(numerator: pd.Series, denominator: pd.Series) -> pd.Series:
+    """Поэлементное деление; 0 там, где знаменатель равен 0 (zero_division=0)."""
+    return (numerator / denominator.where(denominator != 0)).fillna(0.0)
+
+
+def aggregate_metrics(
+    df: pd.DataFrame, by: Optional[Union[str, List[str]]] = None
+) -> pd.DataFrame:
+    """Считает exact match, CER, WER, precision, recall и F1 по группам.
+
+    TP/FP/FN для всех групп считаются одним групповым суммированием
+    (y_true — поле заполнено в эталоне, y_pred — значение извлечено верно),
+    поэтому результат совпадает с sklearn ``precision_score``/``recall_score``/
+    ``f1_score`` с ``zero_division=0`` на каждой группе.
+
+    Если ``by`` не задан, возвращается одна строка по всей таблице.
+    """
+    counts = pd.DataFrame(
+        {
+            "exact_match": df["exact_match"],
+            "cer": df["cer"],
+            "wer": df["wer"],
+            "tp": df["y_true"] & df["y_pred"],
+            "fp": ~df["y_true"] & df["y_pred"],
+            "fn": df["y_true"] & ~df["y_pred"],
+        }
+    )
+    if by is None:
+        agg = pd.DataFrame(
+            [
+                {
+                    "exact_match": counts["exact_match"].mean(),
+                    "cer": counts["cer"].mean(),
+                    "wer": counts["wer"].mean(),
+                    "tp": counts["tp"].sum(),
+                    "fp": counts["fp"].sum(),
+                    "fn": counts["fn"].sum(),
+                }
+            ]
+        )
+    else:
+        grouped = counts.groupby(df[by] if isinstance(by, str) else [df[b] for b in by])
+        agg = grouped.agg(
+            exact_match=("exact_match", "mean"),
+            cer=("cer", "mean"),
+            wer=("wer", "mean"),
+            tp=("tp", "sum"),
+            fp=("fp", "sum"),
+            fn=("fn", "sum"),
+        )
+    agg["precision"] = _ratio(agg["tp"], agg["tp"] + agg["fp"])
+    agg["recall"] = _ratio(agg["tp"], agg["tp"] + agg["fn"])
+    agg["f1"] = _ratio(2 * agg["tp"], 2 * agg["tp"] + agg["fp"] + agg["fn"])
+    agg = agg.drop(columns=["tp", "fp", "fn"])
+
+    if by is None:
+        return agg.reset_index(drop=True)
+    return agg.reset_index()
+
+
 def plot_metrics(per_field_df):
     sns.set(style="whitegrid")
 
@@ -178,7 +242,7 @@ def print_top_errors(per_field_df, top_n=5):
 
 def generate_pydantic_model(
     json_data: Dict[str, Any], model_name: str = "ValidationGenerated"
-) -> BaseModel:
+) -> Type[BaseModel]:
     fields = {}
 
     def get_field_type(value: Any):
@@ -208,33 +272,106 @@ def generate_pydantic_model(
     return create_model(model_name, **fields)
 
 
+def structure_signature(value: Any) -> Hashable:
+    """Структурная сигнатура JSON: ключи и типы значений, рекурсивно.
+
+    Документы с одинаковой сигнатурой дают одинаковую модель
+    ``generate_pydantic_model`` (порядок ключей учитывается — он задаёт
+    порядок свойств в схеме).
+    """
+    if isinstance(value, dict):
+        return tuple((key, structure_signature(v)) for key, v in value.items())
+    if isinstance(value, (bool, int, float, str, list)):
+        return type(value).__name__
+    return "any"
+
+
+class CompiledSchema(NamedTuple):
+    """Модель и JSON-схема, построенные для одной структуры документа."""
+
+    model: Type[BaseModel]
+    json_schema: Dict[str, Any]
+    # Короткий хеш текста схемы (для группировки запросов и статистики)
+    schema_id: str
+
+
+# Сигнатура структуры -> построенная схема
+_schema_cache: Dict[Hashable, CompiledSchema] = {}
+
+
+def get_compiled_schema(
+    json_data: Dict[str, Any], model_name: str = "StructureModel"
+) -> CompiledSchema:
+    """Возвращает модель и JSON-схему для документа, строя их один раз на структуру.
+
+    Повторное использование схемы экономит ``create_model`` на каждом
+    документе и делает текст ``guided_json`` побайтно одинаковым для
+    документов одного типа, так что сервер переиспользует скомпилированную
+    грамматику.
+
+    Args:
+        json_data (Dict[str, Any]): Эталонный JSON документа.
+        model_name (str): Имя корневой модели.
+
+    Returns:
+        CompiledSchema: Модель pydantic и её JSON-схема.
+    """
+    key = (model_name, structure_signature(json_data))
+    compiled = _schema_cache.get(key)
+    if compiled is None:
+        model = generate_pydantic_model(json_data, model_name)
+        json_schema = model.model_json_schema()
+        schema_text = json.dumps(json_schema, ensure_ascii=False)
+        schema_id = hashlib.sha256(schema_text.encode("utf-8")).hexdigest()[:12]
+        compiled = CompiledSchema(model, json_schema, schema_id)
+        _schema_cache[key] = compiled
+    return compiled
+
+
 def read_prompt_from_file(filepath):
     with open(filepath, "r") as file:
         content = file.read()
     return content
 
 
-def image_to_base64(image_path):
+def image_to_base64(
+    image_path: Union[str, Path], payload_cache: Optional[PayloadCache] = None
+) -> str:
+    if payload_cache is not None:
+        return payload_cache.get(image_path)
     with open(image_path, "rb") as image_file:
         # Encode the image as base64
         encoded_string = base64.b64encode(image_file.read())
         return encoded_string.decode("utf-8")
 
 
-async def run_request_to_runpod(json_schema, base64_image, prompt, model_name):
-    content = [
+async def run_request_to_runpod(
+    json_schema: Dict[str, Any],
+    base64_image: str,
+    prompt: str,
+    model_name: str,
+    *,
+    openai_client: Optional[AsyncOpenAI] = None,
+    with_usage: bool = False,
+) -> Any:
+    content: List[ChatCompletionContentPartParam] = [
         {"type": "text", "text": prompt},
         {
             "type": "image_url",
             "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
         },
     ]
-    completion = await client.chat.completions.create(
+    messages: List[ChatCompletionMessageParam] = [{"role": "user", "content": content}]
+    completion = await (openai_client or client).chat.completions.create(
         model=model_name,
-        messages=[{"role": "user", "content": content}],
+        messages=messages,
         extra_body={"guided_json": json_schema},
     )
-    return json.loads(completion.choices[0].message.content)
+    result = json.loads(completion.choices[0].message.content or "")
+    if with_usage:
+        # usage нужен для подсчёта токенов (см. inference_stats)
+        return result, completion.usage
+    return result
 
 
 def read_json_file(file_path):
@@ -243,13 +380,107 @@ def read_json_file(file_path):
     return data
 
 
+class PlannedRequest(NamedTuple):
+    """Изображение и схема, с которой оно отправляется на сервер."""
+
+    image: Path
+    schema: CompiledSchema
+
+
+def plan_requests(
+    image_files: List[Path], dataset_path: Path, num_workers: int = DEFAULT_LOAD_WORKERS
+) -> List[PlannedRequest]:
+    """Строит схемы по ground truth и упорядочивает запросы по схемам.
+
+    Запросы с одинаковой схемой идут подряд, чтобы сервер не
+    перекомпилировал грамматику ``guided_json`` при чередовании схем.
+    Изображения, для которых не удалось прочитать ground truth, пропускаются.
+
+    Args:
+        image_files (List[Path]): Изображения сабсета.
+        dataset_path (Path): Корень датасета (эталоны в ``jsons/``).
+        num_workers (int): Число потоков чтения эталонов.
+
+    Returns:
+        List[PlannedRequest]: Запросы, сгруппированные по схеме.
+    """
+
+    def load(image: Path) -> Optional[Dict[str, Any]]:
+        try:
+            return read_json(dataset_path / "jsons" / f"{image.stem}.json")
+        except Exception as err:
+            print(f"Ошибка при загрузке {image}: {err}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        gt_data = list(executor.map(load, image_files))
+
+    requests = [
+        PlannedRequest(image, get_compiled_schema(json_data))
+        for image, json_data in zip(image_files, gt_data, strict=True)
+        if json_data is not None
+    ]
+    return order_by_schema(requests, lambda request: request.schema.schema_id)
+
+
+def load_request_payload(
+    request: PlannedRequest, payload_cache: Optional[PayloadCache] = None
+) -> Optional[str]:
+    """Готовит изображение запроса в base64.
+
+    Возвращает None, если файл не удалось прочитать.
+    """
+    try:
+        with span("encode_payload"):
+            return image_to_base64(request.image, payload_cache)
+    except Exception as err:
+        print(f"Ошибка при загрузке {request.image}: {err}")
+        return None
+
+
+async def run_prefetched(
+    stream: Iterator[Tuple[PlannedRequest, Optional[str]]],
+    handler: Callable[[PlannedRequest, str], Awaitable[None]],
+    semaphore: asyncio.Semaphore,
+    total: int,
+) -> None:
+    """Запускает ``handler(item, payload)`` для предзагруженных элементов.
+
+    Следующий элемент забирается из ``stream`` только после того, как
+    освободился слот семафора, поэтому в памяти одновременно находятся лишь
+    запросы в работе и окно предзагрузки. Элементы, которые не удалось
+    загрузить (payload is None), пропускаются.
+    """
+    loop = asyncio.get_running_loop()
+    pending: "set[asyncio.Task[None]]" = set()
+
+    async def run(item: PlannedRequest, payload: Optional[str]) -> None:
+        try:
+            if payload is not None:
+                await handler(item, payload)
+        finally:
+            semaphore.release()
+            pbar.update(1)
+
+    with tqdm(total=total) as pbar:
+        while True:
+            await semaphore.acquire()
+            loaded = await loop.run_in_executor(None, next, stream, None)
+            if loaded is None:
+                semaphore.release()
+                break
+            task = create_task(run(*loaded))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        await asyncio.gather(*pending)
+
+
 async def process_image(i, dataset_path, prompt, model_name):
 
     image = dataset_path / "images" / f"{i}.jpg"
     base64_image = image_to_base64(image)
     json_data = read_json_file(str(dataset_path / "jsons" / f"{i}.json"))
-    GeneratedModel = generate_pydantic_model(json_data, "StructureModel")
-    schema = GeneratedModel.model_json_schema()
+    schema = get_compiled_schema(json_data).json_schema
 
     # Вызов асинхронной функции для запроса
     gt = await run_request_to_runpod(schema, base64_image, prompt, model_name)
@@ -261,106 +492,242 @@ async def process_image(i, dataset_path, prompt, model_name):
         json.dump(gt, f, ensure_ascii=False, indent=4)
 
 
-async def check_entity_extractor(dataset_path, prompt_path, model_name, subsets):
-    run_id = uuid.uuid4()
-    subsets = [dataset_path / "images" / subset for subset in subsets]
-    print(subsets)
-    prompt = read_prompt_from_file(prompt_path)
-
-    all_dfs = []
-    all_field_metrics = []
-
-    for subset in subsets:
-        subset_name = subset.name
-        print(f"\n📂 Обработка сабсета: {subset_name}")
-
-        pred_dir = Path("output") / dataset_path.name / subset_name / "pred"
-        pred_dir.mkdir(exist_ok=True, parents=True)
-
-        image_files = sorted(list(subset.glob("*.jpg")))
-        semaphore = asyncio.Semaphore(3)
+async def check_entity_extractor(
+    dataset_path: Path,
+    prompt_path: Path,
+    model_name: str,
+    subsets: List[str],
+    prefetch: Optional[PrefetchSettings] = None,
+    concurrency: Optional[Dict[str, Any]] = None,
+    payload_cache: Optional[PayloadCache] = None,
+    profiling: Optional[Dict[str, Any]] = None,
+) -> None:
+    prefetch = prefetch or prefetch_settings(None)
+    timer = configure_from(profiling)
+    payload_cache = payload_cache or PayloadCache()
+    concurrency = concurrency or {}
+    limiter = AdaptiveLimiter(
+        initial_limit=concurrency.get("initial", 3),
+        max_limit=concurrency.get("max", 32),
+    )
+    request_pool = RequestPool(
+        limiter,
+        timeout=concurrency.get("timeout", 120.0),
+        max_retries=concurrency.get("max_retries", 3),
+    )
+    pooled_client = create_client(os.getenv("RUNPOD_URL"), limiter.max_limit)
+    try:
+        run_id = uuid.uuid4()
+        subset_dirs = [dataset_path / "images" / subset for subset in subsets]
+        print(subset_dirs)
+        prompt = read_prompt_from_file(prompt_path)
+        current_prompt_id = prompt_id(prompt)
+        # Полный текст промпта хранится один раз — в метаданных запуска,
+        # в таблицах результатов остаётся только его идентификатор
+        run_metadata = {
+            "run_id": str(run_id),
+            "model_name": model_name,
+            "dataset_path": str(dataset_path),
+            "prompt_path": str(prompt_path),
+            "prompts": {current_prompt_id: prompt},
+            "subsets": [subset.name for subset in subset_dirs],
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+        all_dfs = []
+        all_field_metrics = []
+        all_document_metrics = []
+        all_schema_latency = []
+        all_inference_records = []
+        inference_rows = []
+        total_elapsed = 0.0
+
+        for subset in subset_dirs:
+            subset_name = subset.name
+            print(f"\n📂 Обработка сабсета: {subset_name}")
+
+            pred_dir = Path("output") / dataset_path.name / subset_name / "pred"
+            pred_dir.mkdir(exist_ok=True, parents=True)
+
+            with span("dataset_scan"):
+                image_files = sorted(list(subset.glob("*.jpg")))
+            with span("plan_requests"):
+                requests = plan_requests(image_files, dataset_path)
+            schema_latency = LatencyStats()
+            inference_records: List[Dict[str, Any]] = []
+            # Ограничивает число запросов в памяти (включая ожидающие слот и повтор);
+            # сколько из них реально отправлено на сервер, решает AdaptiveLimiter
+            semaphore = asyncio.Semaphore(limiter.max_limit)
+            prefetcher: Prefetcher[PlannedRequest] = Prefetcher(
+                lambda request: load_request_payload(request, payload_cache),
+                **prefetch,
+            )
 
-        async def sem_task(i, *, _semaphore=semaphore, _image_files=image_files, _pred_dir=pred_dir):
-            async with _semaphore:
+            async def sem_task(
+                request: PlannedRequest,
+                base64_image: str,
+                *,
+                _pred_dir: Path = pred_dir,
+                _latency: LatencyStats = schema_latency,
+                _records: List[Dict[str, Any]] = inference_records,
+                _subset: str = subset_name,
+            ) -> None:
                 try:
-                    image = _image_files[i]
-                    image_id = image.stem
-                    base64_image = image_to_base64(image)
-                    json_data = read_json_file(
-                        dataset_path / "jsons" / f"{image_id}.json"
-                    )
-                    GeneratedModel = generate_pydantic_model(
-                        json_data, "StructureModel"
-                    )
-                    schema = GeneratedModel.model_json_schema()
-
-                    gt = await run_request_to_runpod(
-                        schema, base64_image, prompt, model_name
+                    image_id = request.image.stem
+                    schema = request.schema
+                    attempts = 0
+
+                    async def timed_request() -> Tuple[Any, float]:
+                        nonlocal attempts
+                        attempts += 1
+                        # Время успешной попытки, без ожидания слота и повторов
+                        started = time.monotonic()
+                        with span("request", overlapping=True):
+                            result = await run_request_to_runpod(
+                                schema.json_schema,
+                                base64_image,
+                                prompt,
+                                model_name,
+                                openai_client=pooled_client,
+                                with_usage=True,
+                            )
+                        latency = time.monotonic() - started
+                        _latency.record(schema.schema_id, latency)
+                        return result, latency
+
+                    (gt, usage), latency = await request_pool.run(timed_request)
+                    prompt_tokens, completion_tokens = read_usage(usage)
+                    record = InferenceRecord(
+                        latency_s=latency,
+                        images_per_request=1,
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                        retries=attempts - 1,
                     )
+                    _records.append({"doc_id": image_id, "subset": _subset, **record.as_fields()})
 
-                    with open(
-                        _pred_dir / f"{image_id}.json", "w", encoding="utf-8"
-                    ) as f:
-                        json.dump(gt, f, ensure_ascii=False, indent=4)
+                    with span("write_prediction"):
+                        with open(_pred_dir / f"{image_id}.json", "w", encoding="utf-8") as f:
+                            json.dump(gt, f, ensure_ascii=False, indent=4)
                 except Exception as err:
                     print(err)
 
-        tasks = [create_task(sem_task(i)) for i in range(len(image_files))]
-        await tqdm.gather(*tasks)
-
-        metrics = evaluate(dataset_path / "jsons", pred_dir)
-
-        print(f"\n📊 Метрики для сабсета {subset_name}:")
-        print(f"Exact Match Accuracy: {metrics['exact_accuracy']:.4f}")
-        print(f"Average CER: {metrics['avg_cer']:.4f}")
-        print(f"Average WER: {metrics['avg_wer']:.4f}")
-        print(f"Precision: {metrics['precision']:.4f}")
-        print(f"Recall: {metrics['recall']:.4f}")
-        print(f"F1-score: {metrics['f1']:.4f}")
-
-        print_top_errors(metrics["per_field_metrics"])
-
-        # Добавляем информацию о сабсете
-        metrics["full_df"]["subset"] = subset_name
-        metrics["full_df"]["prompt"] = prompt
-        metrics["per_field_metrics"]["subset"] = subset_name
-        metrics["per_field_metrics"]["prompt"] = prompt
-
-        all_dfs.append(metrics["full_df"])
-        all_field_metrics.append(metrics["per_field_metrics"])
-
-        # Сохраняем отдельно
-        metrics["full_df"].to_csv(
-            f"{run_id}_{subset_name}_detailed_result.csv", index=False
+            subset_started = time.monotonic()
+            await run_prefetched(
+                prefetcher.iterate(requests), sem_task, semaphore, len(requests)
+            )
+            subset_elapsed = time.monotonic() - subset_started
+            total_elapsed += subset_elapsed
+
+            print(request_pool.stats())
+            print(payload_cache.stats())
+
+            latency_df = schema_latency.frame()
+            latency_df["subset"] = subset_name
+            all_schema_latency.append(latency_df)
+            print(f"\n⏱️ Задержка запросов по схемам (с), сабсет {subset_name}:")
+            print(latency_df.drop(columns="subset").to_string(index=False))
+            # Запросы идут параллельно, поэтому скорости — по времени обработки сабсета
+            inference_rows.append(
+                {"subset": subset_name, **summarize(inference_records, subset_elapsed)}
+            )
+            all_inference_records.extend(inference_records)
+
+            with span("evaluate"):
+                metrics = evaluate(dataset_path / "jsons", pred_dir)
+
+            print(f"\n📊 Метрики для сабсета {subset_name}:")
+            print(f"Exact Match Accuracy: {metrics['exact_accuracy']:.4f}")
+            print(f"Average CER: {metrics['avg_cer']:.4f}")
+            print(f"Average WER: {metrics['avg_wer']:.4f}")
+            print(f"Precision: {metrics['precision']:.4f}")
+            print(f"Recall: {metrics['recall']:.4f}")
+            print(f"F1-score: {metrics['f1']:.4f}")
+
+            print_top_errors(metrics["per_field_metrics"])
+
+            # Добавляем информацию о сабсете
+            metrics["full_df"]["subset"] = subset_name
+            metrics["full_df"]["prompt"] = current_prompt_id
+            metrics["per_field_metrics"]["subset"] = subset_name
+            metrics["per_field_metrics"]["prompt"] = current_prompt_id
+            metrics["per_document_metrics"]["subset"] = subset_name
+
+            all_dfs.append(metrics["full_df"])
+            all_field_metrics.append(metrics["per_field_metrics"])
+            all_document_metrics.append(metrics["per_document_metrics"])
+
+            # Сохраняем отдельно
+            with span("save_results"):
+                save_results(
+                    metrics["full_df"], f"{run_id}_{subset_name}_detailed_result", run_metadata
+                )
+                metrics["per_field_metrics"].to_csv(
+                    f"{run_id}_{subset_name}_per_field_metrics.csv", index=False
+                )
+
+        # Объединение всех результатов
+        final_df = pd.concat(all_dfs, ignore_index=True)
+        final_field_metrics = pd.concat(all_field_metrics, ignore_index=True)
+        final_document_metrics = pd.concat(all_document_metrics, ignore_index=True)
+
+        # Пересчитываем общие метрики по всем сабсетам
+        overall = aggregate_metrics(final_df).iloc[0]
+        overall_metrics = {
+            "exact_accuracy": overall["exact_match"],
+            "avg_cer": overall["cer"],
+            "avg_wer": overall["wer"],
+            "precision": overall["precision"],
+            "recall": overall["recall"],
+            "f1": overall["f1"],
+        }
+        per_subset_metrics = aggregate_metrics(final_df, "subset")
+
+        print("\n📈 Общие метрики по всем сабсетам:")
+        for k, v in overall_metrics.items():
+            print(f"{k}: {v:.4f}")
+
+        inference_rows.append(
+            {"subset": "overall", **summarize(all_inference_records, total_elapsed)}
         )
-        metrics["per_field_metrics"].to_csv(
-            f"{run_id}_{subset_name}_per_field_metrics.csv", index=False
+        inference_df = pd.DataFrame(inference_rows)
+        print("\n💸 Стоимость инференса:")
+        print(
+            inference_df[
+                [
+                    "subset",
+                    "predictions",
+                    "retries",
+                    "requests_per_s",
+                    "latency_p50_s",
+                    "latency_p95_s",
+                    "latency_p99_s",
+                    "completion_tokens_per_s",
+                ]
+            ].to_string(index=False)
         )
 
-    # Объединение всех результатов
-    final_df = pd.concat(all_dfs, ignore_index=True)
-    final_field_metrics = pd.concat(all_field_metrics, ignore_index=True)
-
-    # Пересчитываем общие метрики по всем сабсетам
-    overall_metrics = {
-        "exact_accuracy": (final_df["gt"] == final_df["pred"]).mean(),
-        "avg_cer": final_df["cer"].mean(),
-        "avg_wer": final_df["wer"].mean(),
-        "precision": precision_score(
-            final_df["gt"] != "", final_df["gt"] == final_df["pred"]
-        ),
-        "recall": recall_score(
-            final_df["gt"] != "", final_df["gt"] == final_df["pred"]
-        ),
-        "f1": f1_score(final_df["gt"] != "", final_df["gt"] == final_df["pred"]),
-    }
-
-    print("\n📈 Общие метрики по всем сабсетам:")
-    for k, v in overall_metrics.items():
-        print(f"{k}: {v:.4f}")
+        with span("save_results"):
+            saved_path = save_results(final_df, f"{run_id}_ALL_detailed_result", run_metadata)
+            final_field_metrics.to_csv(f"{run_id}_ALL_per_field_metrics.csv", index=False)
+            final_document_metrics.to_csv(f"{run_id}_ALL_per_document_metrics.csv", index=False)
+            per_subset_metrics.to_csv(f"{run_id}_ALL_per_subset_metrics.csv", index=False)
+            pd.concat(all_schema_latency, ignore_index=True).to_csv(
+                f"{run_id}_ALL_schema_latency.csv", index=False
+            )
+            inference_df.to_csv(f"{run_id}_ALL_inference_stats.csv", index=False)
+            pd.DataFrame(all_inference_records).to_csv(
+                f"{run_id}_ALL_inference_requests.csv", index=False
+            )
+        print(f"Детальные результаты сохранены в {saved_path}")
+    finally:
+        await pooled_client.close()
 
-    final_df.to_csv(f"{run_id}_ALL_detailed_result.csv", index=False)
-    final_field_metrics.to_csv(f"{run_id}_ALL_per_field_metrics.csv", index=False)
+    if timer.enabled:
+        print(f"\n⏱️ Время по стадиям:\n{timer.format_summary()}")
+        if profiling.get("trace_path"):
+            trace_path = timer.export_trace(profiling["trace_path"])
+            print(f"Трасса сохранена в {trace_path}")
 
 
 @click.command()
@@ -373,13 +740,134 @@ async def check_entity_extractor(dataset_path, prompt_path, model_name, subsets)
     default=None,
     help="Список сабсетов через запятую, например: --subsets blur,noise,clean,bright,gray,rotated,spatter",
 )
-def main(dataset_path, prompt_path, model_name, subsets):
+@click.option(
+    "--prefetch-workers",
+    type=int,
+    default=DEFAULT_NUM_WORKERS,
+    help="Число потоков фоновой подготовки изображений",
+)
+@click.option(
+    "--prefetch-ahead",
+    type=int,
+    default=DEFAULT_MAX_AHEAD,
+    help="Сколько изображений готовить заранее",
+)
+@click.option(
+    "--prefetch-max-bytes",
+    type=int,
+    default=DEFAULT_MAX_BYTES,
+    help="Ограничение памяти под заранее подготовленные изображения, в байтах",
+)
+@click.option(
+    "--initial-concurrency",
+    type=int,
+    default=3,
+    help="Начальное число параллельных запросов к серверу",
+)
+@click.option(
+    "--max-concurrency",
+    type=int,
+    default=32,
+    help="Потолок числа параллельных запросов (лимит подбирается автоматически)",
+)
+@click.option(
+    "--request-timeout",
+    type=float,
+    default=120.0,
+    help="Таймаут одного запроса, секунды",
+)
+@click.option(
+    "--max-retries",
+    type=int,
+    default=3,
+    help="Число повторов запроса при 429/5xx/таймауте",
+)
+@click.option(
+    "--max-pixels",
+    type=int,
+    default=None,
+    help="Уменьшать изображения перед отправкой до этого числа пикселей",
+)
+@click.option(
+    "--payload-cache-dir",
+    type=click.Path(path_type=Path),
+    default=None,
+    help="Каталог дискового кеша уменьшенных изображений",
+)
+@click.option(
+    "--payload-cache-max-bytes",
+    type=int,
+    default=DEFAULT_MAX_MEMORY_BYTES,
+    help="Ограничение памяти под кеш закодированных изображений, в байтах",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Замерять время стадий и напечатать сводку в конце запуска",
+)
+@click.option(
+    "--trace-path",
+    type=click.Path(path_type=Path),
+    default=None,
+    help="Сохранить трассу стадий в формате Chrome Trace (включает --profile)",
+)
+def main(
+    dataset_path: Path,
+    prompt_path: Path,
+    model_name: str,
+    subsets: Optional[str],
+    prefetch_workers: int,
+    prefetch_ahead: int,
+    prefetch_max_bytes: int,
+    initial_concurrency: int,
+    max_concurrency: int,
+    request_timeout: float,
+    max_retries: int,
+    max_pixels: Optional[int],
+    payload_cache_dir: Optional[Path],
+    payload_cache_max_bytes: int,
+    profile: bool,
+    trace_path: Optional[Path],
+) -> None:
     if not subsets:
-        subsets = [d.name for d in (dataset_path / "images").iterdir() if d.is_dir()]
+        subset_names = [d.name for d in (dataset_path / "images").iterdir() if d.is_dir()]
     else:
-        subsets = [s.strip() for s in subsets.split(",")]
+        subset_names = [s.strip() for s in subsets.split(",")]
 
-    asyncio.run(check_entity_extractor(dataset_path, prompt_path, model_name, subsets))
+    prefetch = prefetch_settings(
+        {
+            "num_workers": prefetch_workers,
+            "max_ahead": prefetch_ahead,
+            "max_bytes": prefetch_max_bytes,
+        }
+    )
+    concurrency = {
+        "initial": initial_concurrency,
+        "max": max_concurrency,
+        "timeout": request_timeout,
+        "max_retries": max_retries,
+    }
+    payload_cache = PayloadCache(
+        cache_dir=payload_cache_dir,
+        max_memory_bytes=payload_cache_max_bytes,
+        max_pixels=max_pixels,
+    )
+    profiling = None
+    if profile or trace_path:
+        profiling = {"trace_path": trace_path}
+    asyncio.run(
+        check_entity_extractor(
+            dataset_path,
+            prompt_path,
+            model_name,
+            subset_names,
+            prefetch,
+            concurrency,
+            payload_cache,
+            profiling,
+        )
+    )
 
 
 if __name__ == "__main__":
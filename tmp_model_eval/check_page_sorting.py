@@ -1,11 +1,13 @@
+import functools
 import json
 import re
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import pandas as pd
 from bench_utils.metrics import calculate_ordering_metrics
-from bench_utils.model_utils import initialize_model, load_prompt, prepare_prompt
+from bench_utils.model_utils import load_prompt, prepare_prompt
 from bench_utils.utils import (
     get_document_type_from_config,
     get_run_id,
@@ -13,9 +15,27 @@ from bench_utils.utils import (
 )
 from tqdm import tqdm
 
+from batch_controller import SCOPE_PAGES, BatchController, resolution_bucket
+from dataset_manifest import DatasetManifest, manifest_from_config
+from image_normalization import ImageNormalizer
+from image_prefetch import Prefetcher, accepts_images, load_images, prefetch_settings
+from inference_stats import InferenceRecord, summarize, timed_call
+from model_backends import create_model
+from sampling import StratifiedSampler
+from sharded_eval import ShardedRunner, sharding_settings
+from stage_timer import configure_from, span, timed_iter
+
+# (doc_id, пути к страницам, правильный порядок)
+Document = Tuple[str, List[Path], List[int]]
+# (предсказанный порядок, стоимость запроса)
+Prediction = Tuple[List[int], Optional[InferenceRecord]]
+
 
 def get_image_paths_for_document(
-    dataset_path: Path, document_id: str, subset_name: str
+    dataset_path: Path,
+    document_id: str,
+    subset_name: str,
+    manifest: Optional[DatasetManifest] = None,
 ) -> List[Path]:
     """Получает пути к изображениям страниц для конкретного документа.
 
@@ -23,18 +43,30 @@ def get_image_paths_for_document(
         dataset_path (Path): Корневой путь к датасету.
         document_id (str): Идентификатор документа.
         subset_name (str): Имя подмножества (например, 'clean', 'blur').
+        manifest (Optional[DatasetManifest]): Индекс датасета; если задан,
+            наличие страниц проверяется по нему, без обращений к диску.
 
     Returns:
         List[Path]: Список путей к изображениям страниц документа в порядке номеров.
     """
     document_dir = dataset_path / "images" / subset_name / document_id
-    if not document_dir.exists():
+    if manifest is not None:
+        if not manifest.is_dir(document_dir):
+            return []
+        existing = {path.name for path in manifest.files(document_dir)}
+
+        def page_exists(path: Path) -> bool:
+            return path.name in existing
+
+    elif document_dir.exists():
+        page_exists = Path.exists
+    else:
         return []
 
     image_files = []
     for i in range(10):
         image_path = document_dir / f"{i}.jpg"
-        if image_path.exists():
+        if page_exists(image_path):
             image_files.append(image_path)
         else:
             break
@@ -43,7 +75,11 @@ def get_image_paths_for_document(
 
 
 def get_document_ids(
-    dataset_path: Path, subset_name: str, sample_size: Optional[int] = None
+    dataset_path: Path,
+    subset_name: str,
+    sample_size: Optional[int] = None,
+    manifest: Optional[DatasetManifest] = None,
+    sampler: Optional[StratifiedSampler] = None,
 ) -> List[str]:
     """Получает список ID документов в указанном подмножестве.
 
@@ -52,20 +88,27 @@ def get_document_ids(
         subset_name (str): Имя подмножества.
         sample_size (Optional[int]): Количество документов для выборки.
                                    Если None, обрабатываются все документы.
+        manifest (Optional[DatasetManifest]): Индекс датасета; если задан,
+            каталог сабсета не обходится.
+        sampler (Optional[StratifiedSampler]): Сэмплер с зерном и квотами;
+            если задан, ``sample_size`` не используется. Страта — тип
+            документа (имя каталога датасета), поэтому во всех сабсетах
+            выбираются одни и те же документы.
 
     Returns:
         List[str]: Список ID документов.
     """
     subset_dir = dataset_path / "images" / subset_name
-    if not subset_dir.exists():
+    if manifest is not None:
+        document_ids = [d.name for d in manifest.subdirs(subset_dir)]
+    elif subset_dir.exists():
+        document_ids = [d.name for d in subset_dir.iterdir() if d.is_dir()]
+    else:
         return []
 
-    document_ids = [d.name for d in subset_dir.iterdir() if d.is_dir()]
-
-    if sample_size is not None:
-        document_ids = document_ids[:sample_size]
-
-    return document_ids
+    if sampler is None:
+        sampler = StratifiedSampler(sample_size)
+    return sampler.sample({dataset_path.name: document_ids})[dataset_path.name]
 
 
 def load_ground_truth_dynamic(
@@ -184,23 +227,139 @@ def process_model_response(model_response: str) -> List[int]:
     return []
 
 
-def get_prediction(model: Any, image_paths: List[Path], prompt: str) -> List[int]:
+def load_document_pages(
+    image_paths: List[Path],
+    normalizer: Optional[ImageNormalizer] = None,
+    decode: bool = False,
+) -> Optional[List[Any]]:
+    """Готовит страницы документа для предзагрузки; при ошибке возвращает None.
+
+    С ``normalizer`` страницы приводятся к бюджету пикселей. Без ``decode``
+    возвращаются пути к файлам страниц, с ним — декодированные изображения
+    (для моделей, принимающих изображения, см. ``image_prefetch.accepts_images``).
+    """
     try:
-        image_paths_str = [str(path) for path in image_paths]
-        model_response = model.predict_on_images(
-            images=image_paths_str, prompt=prompt
-        )
-        return process_model_response(model_response)
+        with span("load_image"):
+            if not decode:
+                if normalizer is not None:
+                    return [str(normalizer.prepare(path)) for path in image_paths]
+                return [str(path) for path in image_paths]
+            if normalizer is not None:
+                return [normalizer.load(path) for path in image_paths]
+            return load_images(image_paths)
+    except Exception as e:
+        print(f"Ошибка при загрузке страниц {image_paths[0].parent.name}: {e}")
+        return None
+
+
+def get_prediction(
+    model: Any,
+    images: List[Any],
+    prompt: str,
+    controller: Optional[BatchController] = None,
+) -> Prediction:
+    """Предсказывает порядок страниц документа одним запросом.
+
+    С ``controller`` запрос, упавший из-за нехватки памяти, повторяется один
+    раз после освобождения памяти (страницы документа нельзя разделить).
+    """
+    try:
+        images_input = [str(img) if isinstance(img, Path) else img for img in images]
+
+        def call(pages: List[Any]) -> Tuple[Any, InferenceRecord]:
+            return timed_call(
+                model,
+                lambda: model.predict_on_images(images=pages, prompt=prompt),
+                num_images=len(pages),
+            )
+
+        with span("model"):
+            if controller is None:
+                model_response, record = call(images_input)
+            else:
+                model_response, record = controller.run_whole(
+                    images_input, call, resolution_bucket(images_input)
+                )
+        with span("parse_response"):
+            return process_model_response(model_response), record
     except Exception as e:
         print(f"Ошибка при предсказании для документа: {e}")
-        return []
+        return [], None
+
+
+def predict_documents(
+    model: Any,
+    prefetcher: Prefetcher,
+    documents: List[Document],
+    prompt: str,
+    controller: Optional[BatchController] = None,
+) -> Iterator[Tuple[Document, Optional[Prediction]]]:
+    """Предсказывает порядок страниц, загружая следующие документы в фоне.
+
+    Yields:
+        Tuple[Document, Optional[Prediction]]: Документ, предсказанный
+        порядок (пустой список — модель не дала ответа) и стоимость запроса
+        в порядке ``documents``; None — страницы не удалось загрузить.
+    """
+    for document, pages in timed_iter(prefetcher.iterate(documents), "wait_input"):
+        if pages is None:
+            yield document, None
+        else:
+            yield document, get_prediction(model, pages, prompt, controller)
+
 
+class PageSortingWorker:
+    """Обработчик для шардированного режима (см. ``sharded_eval``).
+
+    Args:
+        model_config (Dict[str, Any]): Секция ``model`` с ``device_map`` процесса.
+        task_config (Dict[str, Any]): Секция ``task`` конфига.
+        prompt (str): Отрендеренный промпт.
+    """
+
+    def __init__(
+        self, model_config: Dict[str, Any], task_config: Dict[str, Any], prompt: str
+    ) -> None:
+        self.timer = configure_from(task_config.get("profiling"))
+        self.model = create_model(model_config)
+        self.prompt = prompt
+        self.controller = BatchController.from_config(
+            task_config.get("batch_limits"), model_config, SCOPE_PAGES
+        )
+        self.normalizer = ImageNormalizer.from_config(task_config.get("image_normalization"))
+        self.prefetcher: Prefetcher[Document] = Prefetcher(
+            lambda document: load_document_pages(
+                document[1], self.normalizer, accepts_images(self.model)
+            ),
+            **prefetch_settings(task_config.get("prefetch")),
+        )
 
-def save_prediction(output_dir: Path, document_id: str, prediction: List[int]) -> None:
+    def __call__(self, documents: List[Document]) -> List[Optional[Prediction]]:
+        predictions = predict_documents(
+            self.model, self.prefetcher, documents, self.prompt, self.controller
+        )
+        return [prediction for _, prediction in predictions]
+
+    def close(self) -> None:
+        self.controller.close()
+        if self.normalizer is not None:
+            print(self.normalizer.stats())
+        if self.timer.enabled:
+            print(f"\n⏱️ Время по стадиям в обработчике:\n{self.timer.format_summary()}")
+
+
+def save_prediction(
+    output_dir: Path,
+    document_id: str,
+    prediction: List[int],
+    inference: Optional[InferenceRecord] = None,
+) -> None:
     output_dir.mkdir(parents=True, exist_ok=True)
     output_file = output_dir / f"{document_id}.json"
 
-    result = {"ordered_pages": prediction}
+    result: Dict[str, Any] = {"ordered_pages": prediction}
+    if inference is not None:
+        result["inference"] = inference.as_fields()
     with output_file.open("w", encoding="utf-8") as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
 
@@ -227,16 +386,43 @@ def calculate_and_save_metrics(
     return mean_metrics
 
 
+def save_inference_stats(rows: List[Dict[str, Any]], run_id: str) -> None:
+    """Печатает и сохраняет сводку стоимости инференса по сабсетам.
+
+    Args:
+        rows (List[Dict[str, Any]]): Результаты ``inference_stats.summarize``
+            с полем ``subset`` (последняя строка — ``overall``).
+        run_id (str): Уникальный идентификатор запуска.
+    """
+    overall = rows[-1]
+    if overall["requests_per_s"] is not None:
+        print("\n💸 Стоимость инференса:")
+        print(
+            f"  Документов/с: {overall['predictions_per_s']}, "
+            f"страниц/с: {overall['images_per_s']}"
+        )
+        print(
+            f"  Задержка запроса p50/p95/p99, с: {overall['latency_p50_s']} / "
+            f"{overall['latency_p95_s']} / {overall['latency_p99_s']}"
+        )
+        if overall["completion_tokens_per_s"] is not None:
+            print(f"  Токенов ответа/с: {overall['completion_tokens_per_s']}")
+    pd.DataFrame(rows).to_csv(f"{run_id}_inference_stats.csv", index=False)
+
+
 def run_evaluation(config: Dict[str, Any]) -> None:
     task_config = config["task"]
     model_config = config["model"]
 
     dataset_path = Path(task_config["dataset_path"])
     prompt_path = Path(task_config["prompt_path"])
-    sample_size = task_config.get("sample_size")
+    sampler = StratifiedSampler.from_config(task_config)
     output_base_dir = Path(task_config["output_dir"])
-
-    model = initialize_model(model_config)
+    sharding = sharding_settings(task_config)
+    profiling = task_config.get("profiling")
+    timer = configure_from(profiling)
+    with span("dataset_scan"):
+        manifest = manifest_from_config(dataset_path, task_config.get("manifest"))
 
     template = load_prompt(prompt_path)
     prompt = prepare_prompt(template)
@@ -255,57 +441,122 @@ def run_evaluation(config: Dict[str, Any]) -> None:
         print(f"Не удалось определить ключ документа для пути {dataset_path}")
         return
 
-    all_subset_metrics = []
-
-    for subset in task_config["subsets"]:
-        print(f"\n📂 Обработка сабсета: {subset}")
-
-        document_ids = get_document_ids(dataset_path, subset, sample_size)
-        if not document_ids:
-            print(f"Нет документов в сабсете {subset}")
-            continue
-
-        print(f"Найдено документов для обработки: {len(document_ids)}")
-
-        output_dir = output_base_dir / dataset_path.name / subset
-
-        all_metrics = {
-            "kendall_tau": [],
-            "accuracy": [],
-            "spearman_rho": [],
-        }
-
-        for doc_id in tqdm(document_ids, desc=f"Обработка {subset}"):
-            image_paths = get_image_paths_for_document(dataset_path, doc_id, subset)
-            if len(image_paths) != 4:
-                print(
-                    f"Документ {doc_id}: ожидается 4 страницы, найдено {len(image_paths)}"
+    normalizer = None
+    # Предсказания для списка документов: в процессах шардов или в текущем процессе
+    predict: Callable[[List[Document]], Iterator[Tuple[Document, Optional[Prediction]]]]
+    # Процессы шардов и пределы закрываются и при ошибке
+    with ExitStack() as stack:
+        if sharding:
+            # Каждый процесс загружает свою копию модели на своё устройство
+            print(f"Шардирование: {', '.join(sharding['device_maps'])}")
+            runner = stack.enter_context(
+                ShardedRunner(
+                    PageSortingWorker,
+                    model_config,
+                    sharding["device_maps"],
+                    worker_args=(task_config, prompt),
+                    chunk_size=sharding["chunk_size"],
                 )
-                continue
-
-            true_order = load_ground_truth_dynamic(
-                dataset_path, doc_id, document_type_key
             )
-            if not true_order:
-                print(f"Не удалось загрузить правильный порядок для документа {doc_id}")
-                continue
-
-            predicted_order = get_prediction(model, image_paths, prompt)
-            if not predicted_order:
-                print(f"Не удалось получить предсказание для документа {doc_id}")
-                continue
+            predict = runner.map
+        else:
+            model = create_model(model_config)
+            controller = BatchController.from_config(
+                task_config.get("batch_limits"), model_config, SCOPE_PAGES
+            )
+            stack.callback(controller.close)
+            normalizer = ImageNormalizer.from_config(task_config.get("image_normalization"))
+            prefetcher: Prefetcher[Document] = Prefetcher(
+                lambda document: load_document_pages(
+                    document[1], normalizer, accepts_images(model)
+                ),
+                **prefetch_settings(task_config.get("prefetch")),
+            )
+            predict = functools.partial(
+                predict_documents, model, prefetcher, prompt=prompt, controller=controller
+            )
 
-            save_prediction(output_dir, doc_id, predicted_order)
+        all_subset_metrics = []
+        inference_rows = []
+        all_inference_records: List[Dict[str, Any]] = []
 
-            metrics = calculate_ordering_metrics(true_order, predicted_order)
-            for key, value in metrics.items():
-                all_metrics[key].append(value)
+        for subset in task_config["subsets"]:
+            print(f"\n📂 Обработка сабсета: {subset}")
 
-            print(f"Документ {doc_id}: {metrics}")
+            with span("dataset_scan"):
+                document_ids = get_document_ids(
+                    dataset_path, subset, manifest=manifest, sampler=sampler
+                )
+            if not document_ids:
+                print(f"Нет документов в сабсете {subset}")
+                continue
 
-        subset_metrics = calculate_and_save_metrics(all_metrics, subset, run_id)
-        if subset_metrics:
-            all_subset_metrics.append(subset_metrics)
+            print(f"Найдено документов для обработки: {len(document_ids)}")
+
+            output_dir = output_base_dir / dataset_path.name / subset
+
+            all_metrics = {
+                "kendall_tau": [],
+                "accuracy": [],
+                "spearman_rho": [],
+            }
+            inference_records: List[Dict[str, Any]] = []
+
+            documents = []
+            for doc_id in document_ids:
+                with span("dataset_scan"):
+                    image_paths = get_image_paths_for_document(
+                        dataset_path, doc_id, subset, manifest
+                    )
+                if len(image_paths) != 4:
+                    print(
+                        f"Документ {doc_id}: ожидается 4 страницы, найдено {len(image_paths)}"
+                    )
+                    continue
+
+                with span("load_ground_truth"):
+                    true_order = load_ground_truth_dynamic(
+                        dataset_path, doc_id, document_type_key
+                    )
+                if not true_order:
+                    print(f"Не удалось загрузить правильный порядок для документа {doc_id}")
+                    continue
+
+                documents.append((doc_id, image_paths, true_order))
+
+            # Страницы следующих документов читаются в фоне, пока модель занята текущим
+            for (doc_id, _, true_order), prediction in tqdm(
+                predict(documents), total=len(documents), desc=f"Обработка {subset}"
+            ):
+                if prediction is None:
+                    continue
+
+                predicted_order, inference = prediction
+                if inference is not None:
+                    inference_records.append(inference.as_fields())
+                if not predicted_order:
+                    print(f"Не удалось получить предсказание для документа {doc_id}")
+                    continue
+
+                with span("write_prediction"):
+                    save_prediction(output_dir, doc_id, predicted_order, inference)
+
+                with span("metrics"):
+                    metrics = calculate_ordering_metrics(true_order, predicted_order)
+                for key, value in metrics.items():
+                    all_metrics[key].append(value)
+
+                print(f"Документ {doc_id}: {metrics}")
+
+            with span("metrics"):
+                subset_metrics = calculate_and_save_metrics(all_metrics, subset, run_id)
+            if subset_metrics:
+                all_subset_metrics.append(subset_metrics)
+            inference_rows.append({"subset": subset, **summarize(inference_records)})
+            all_inference_records.extend(inference_records)
+
+        if normalizer is not None:
+            print(normalizer.stats())
 
     if all_subset_metrics:
         final_df = pd.DataFrame(all_subset_metrics)
@@ -318,6 +569,16 @@ def run_evaluation(config: Dict[str, Any]) -> None:
 
         final_df.to_csv(f"{run_id}_final_page_sorting_results.csv", index=False)
 
+    if inference_rows:
+        inference_rows.append({"subset": "overall", **summarize(all_inference_records)})
+        save_inference_stats(inference_rows, run_id)
+
+    if timer.enabled:
+        print(f"\n⏱️ Время по стадиям:\n{timer.format_summary()}")
+        if profiling.get("trace_path"):
+            trace_path = timer.export_trace(profiling["trace_path"])
+            print(f"Трасса сохранена в {trace_path}")
+
 
 def main() -> None:
     """Главная функция для запуска процесса упорядочивания страниц.
@@ -0,0 +1,228 @@
+"""Потоковый подсчёт метрик классификации.
+
+``ConfusionAccumulator`` хранит только целочисленную матрицу ошибок и
+обновляет её после каждого предсказания. Accuracy, precision/recall/F1
+(macro и micro), матрица ошибок и отчёт по классам выводятся из неё за
+O(число классов²), без хранения списков истинных и предсказанных меток.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Метка, которую получает изображение при некорректном ответе модели
+NONE_LABEL = "None"
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Поэлементное деление с нулём там, где знаменатель равен нулю."""
+    result = np.zeros(numerator.shape, dtype=float)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return result
+
+
+class ConfusionAccumulator:
+    """Матрица ошибок, накапливаемая по одному предсказанию.
+
+    Строки соответствуют истинным меткам, столбцы — предсказанным. Метки
+    ``class_keys`` идут первыми в заданном порядке; метки, не входящие в
+    них (например, 'None'), добавляются по мере появления.
+
+    Args:
+        class_keys (Iterable[str]): Ключи классов документов.
+    """
+
+    def __init__(self, class_keys: Iterable[str]) -> None:
+        self.class_keys: List[str] = list(class_keys)
+        self.labels: List[str] = list(self.class_keys)
+        self._index: Dict[str, int] = {label: i for i, label in enumerate(self.labels)}
+        self.matrix = np.zeros((len(self.labels), len(self.labels)), dtype=np.int64)
+
+    def _label_index(self, label: str) -> int:
+        index = self._index.get(label)
+        if index is None:
+            index = len(self.labels)
+            self.labels.append(label)
+            self._index[label] = index
+            self.matrix = np.pad(self.matrix, ((0, 1), (0, 1)))
+        return index
+
+    def update(self, y_true: str, y_pred: str) -> None:
+        """Учитывает одно предсказание.
+
+        Args:
+            y_true (str): Истинная метка.
+            y_pred (str): Предсказанная метка.
+        """
+        row = self._label_index(y_true)
+        col = self._label_index(y_pred)
+        self.matrix[row, col] += 1
+
+    def merge(self, other: "ConfusionAccumulator") -> None:
+        """Прибавляет к матрице матрицу другого аккумулятора.
+
+        Args:
+            other (ConfusionAccumulator): Аккумулятор с теми же или другими
+                метками (недостающие метки добавляются).
+        """
+        indices = [self._label_index(label) for label in other.labels]
+        self.matrix[np.ix_(indices, indices)] += other.matrix
+
+    @property
+    def total(self) -> int:
+        """Число учтённых предсказаний."""
+        return int(self.matrix.sum())
+
+    def accuracy(self) -> float:
+        """Доля верных предсказаний."""
+        total = self.total
+        return float(np.trace(self.matrix) / total) if total else 0.0
+
+    def _per_label(self, labels: List[str]) -> Dict[str, np.ndarray]:
+        """Precision, recall, F1 и support для указанных меток."""
+        indices = [self._index[label] for label in labels if label in self._index]
+        tp = np.zeros(len(labels), dtype=np.int64)
+        predicted = np.zeros(len(labels), dtype=np.int64)
+        support = np.zeros(len(labels), dtype=np.int64)
+        positions = [i for i, label in enumerate(labels) if label in self._index]
+        if indices:
+            tp[positions] = np.diag(self.matrix)[indices]
+            predicted[positions] = self.matrix.sum(axis=0)[indices]
+            support[positions] = self.matrix.sum(axis=1)[indices]
+
+        precision = _safe_divide(tp, predicted)
+        recall = _safe_divide(tp, support)
+        f1 = _safe_divide(2 * precision * recall, precision + recall)
+        return {
+            "tp": tp,
+            "predicted": predicted,
+            "support": support,
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+        }
+
+    def metrics(self) -> Dict[str, float]:
+        """Вычисляет основные метрики по классам документов.
+
+        Macro-усреднение — среднее по ``class_keys``; micro — по суммарным
+        TP/FP/FN этих же классов.
+
+        Returns:
+            Dict[str, float]: accuracy, precision, recall, f1 (macro) и их
+            micro-варианты с суффиксом ``_micro``. Пустой словарь, если
+            предсказаний не было.
+        """
+        if not self.total:
+            return {}
+
+        stats = self._per_label(self.class_keys)
+        tp = stats["tp"].sum()
+        precision_micro = tp / stats["predicted"].sum() if stats["predicted"].sum() else 0.0
+        recall_micro = tp / stats["support"].sum() if stats["support"].sum() else 0.0
+        f1_micro = (
+            2 * precision_micro * recall_micro / (precision_micro + recall_micro)
+            if precision_micro + recall_micro
+            else 0.0
+        )
+        return {
+            "accuracy": self.accuracy(),
+            "precision": float(stats["precision"].mean()),
+            "recall": float(stats["recall"].mean()),
+            "f1": float(stats["f1"].mean()),
+            "precision_micro": float(precision_micro),
+            "recall_micro": float(recall_micro),
+            "f1_micro": float(f1_micro),
+        }
+
+    def report_labels(self) -> List[str]:
+        """Метки для отчётов: классы документов и 'None', если оно предсказывалось."""
+        labels = list(self.class_keys)
+        none_index = self._index.get(NONE_LABEL)
+        if none_index is not None and self.matrix[:, none_index].sum() > 0:
+            labels.append(NONE_LABEL)
+        return labels
+
+    def confusion_frame(self, labels: Optional[List[str]] = None) -> pd.DataFrame:
+        """Матрица ошибок в виде DataFrame (строки — истина, столбцы — прогноз).
+
+        Args:
+            labels (Optional[List[str]]): Метки строк и столбцов. По умолчанию
+                ``report_labels()``.
+        """
+        labels = labels if labels is not None else self.report_labels()
+        indices = [self._index.get(label) for label in labels]
+        frame = np.zeros((len(labels), len(labels)), dtype=np.int64)
+        for row, i in enumerate(indices):
+            for col, j in enumerate(indices):
+                if i is not None and j is not None:
+                    frame[row, col] = self.matrix[i, j]
+        return pd.DataFrame(frame, index=labels, columns=labels)
+
+    def class_report(self, labels: Optional[List[str]] = None) -> pd.DataFrame:
+        """Отчёт по классам в формате ``sklearn.metrics.classification_report``.
+
+        Строки — метки, затем 'accuracy' (или 'micro avg', если встречались
+        метки вне ``labels``), 'macro avg' и 'weighted avg'; столбцы —
+        precision, recall, f1-score, support.
+
+        Args:
+            labels (Optional[List[str]]): Метки отчёта. По умолчанию
+                ``report_labels()``.
+        """
+        labels = labels if labels is not None else self.report_labels()
+        stats = self._per_label(labels)
+        support = stats["support"]
+
+        rows = {
+            label: {
+                "precision": stats["precision"][i],
+                "recall": stats["recall"][i],
+                "f1-score": stats["f1"][i],
+                "support": float(support[i]),
+            }
+            for i, label in enumerate(labels)
+        }
+
+        observed = {
+            label
+            for i, label in enumerate(self.labels)
+            if self.matrix[i, :].sum() or self.matrix[:, i].sum()
+        }
+        total_support = float(support.sum())
+        if observed <= set(labels):
+            accuracy = self.accuracy()
+            rows["accuracy"] = {
+                "precision": accuracy,
+                "recall": accuracy,
+                "f1-score": accuracy,
+                "support": accuracy,
+            }
+        else:
+            tp = stats["tp"].sum()
+            predicted = stats["predicted"].sum()
+            precision = tp / predicted if predicted else 0.0
+            recall = tp / total_support if total_support else 0.0
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            rows["micro avg"] = {
+                "precision": precision,
+                "recall": recall,
+                "f1-score": f1,
+                "support": total_support,
+            }
+
+        rows["macro avg"] = {
+            "precision": stats["precision"].mean(),
+            "recall": stats["recall"].mean(),
+            "f1-score": stats["f1"].mean(),
+            "support": total_support,
+        }
+        weights = support / total_support if total_support else np.zeros(len(labels))
+        rows["weighted avg"] = {
+            "precision": float((stats["precision"] * weights).sum()),
+            "recall": float((stats["recall"] * weights).sum()),
+            "f1-score": float((stats["f1"] * weights).sum()),
+            "support": total_support,
+        }
+        return pd.DataFrame(rows).transpose()
@@ -0,0 +1,531 @@
+"""Индекс файлов датасета вместо повторного обхода каталогов.
+
+Скрипты оценки находят изображения через ``iterdir``/``exists`` на каждом
+запуске (а ``optimize_prompt`` — на каждой попытке). На сетевом диске один
+такой обход занимает минуты. ``DatasetManifest`` обходит датасет один раз —
+параллельно, по уровням каталогов — и сохраняет компактный индекс: для
+каждого каталога его ``mtime`` и список элементов (в порядке ``scandir``,
+как их вернул бы ``iterdir``), для файлов — размер, ``mtime`` и, по
+желанию, sha256 содержимого.
+
+При следующем запуске индекс проверяется инкрементально: для каждого
+каталога делается один ``stat``, и перечитываются только каталоги, у
+которых изменился ``mtime`` (в них добавили, удалили или переименовали
+файлы). Правка файла «на месте» не меняет ``mtime`` каталога, поэтому файлы
+неизменившихся каталогов перепроверяются одним ``stat`` на файл — это
+дешевле чтения каталога. Хеши файлов с прежними размером и ``mtime`` не
+пересчитываются. Между обновлениями ``entry`` так же сверяет размер и
+``mtime`` файла с диском и не отдаёт хеш изменившегося файла.
+
+Индекс включается секцией ``task.manifest`` конфига (без неё каталоги
+обходятся напрямую)::
+
+    "manifest": {"path": "./cache/manifests/dataset.json", "num_workers": 16,
+                 "hash_content": false}
+
+Индекс можно построить заранее из командной строки::
+
+    python dataset_manifest.py ./dataset --hash-content
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import pandas as pd
+
+from prediction_cache import text_hash
+
+DEFAULT_NUM_WORKERS = 16
+DEFAULT_MANIFEST_DIR = Path("cache") / "manifests"
+
+_FORMAT_VERSION = 1
+_HASH_CHUNK = 1024 * 1024
+# Каталог, изменённый позже этого момента до начала обхода, при следующем
+# запуске перечитывается заново: mtime на части ФС имеет точность 1–2 с, и
+# изменение в ту же секунду, что и обход, было бы незаметно
+_MTIME_SLACK_NS = 2_000_000_000
+
+
+class Entry(NamedTuple):
+    """Элемент каталога: файл или подкаталог (у подкаталога размер и хеш пустые)."""
+
+    name: str
+    is_dir: bool
+    size: int = 0
+    mtime_ns: int = 0
+    sha256: str = ""
+
+
+class DirRecord(NamedTuple):
+    """Содержимое каталога на момент обхода (``mtime_ns`` = -1 — перечитать)."""
+
+    mtime_ns: int
+    entries: List[Entry]
+
+
+class RefreshStats(NamedTuple):
+    """Итог обновления индекса."""
+
+    scanned_dirs: int
+    reused_dirs: int
+    changed_files: int
+    hashed_files: int
+    seconds: float
+
+    def __str__(self) -> str:
+        return (
+            f"Индекс датасета: перечитано каталогов {self.scanned_dirs}, "
+            f"без изменений {self.reused_dirs}, изменено файлов на месте "
+            f"{self.changed_files}, захешировано файлов {self.hashed_files} "
+            f"за {self.seconds:.1f} с"
+        )
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _join(rel: str, name: str) -> str:
+    return f"{rel}/{name}" if rel else name
+
+
+class DatasetManifest:
+    """Индекс файлов датасета.
+
+    Пути в запросах (``iterdir``, ``files`` и т.д.) задаются так же, как при
+    обходе каталогов — от ``root``; возвращаемые пути строятся от того же
+    ``root``, поэтому совпадают с тем, что вернул бы ``Path.iterdir``.
+
+    Args:
+        root (Union[str, Path]): Корень датасета.
+        hash_content (bool): Считать ли sha256 содержимого файлов.
+    """
+
+    def __init__(self, root: Union[str, Path], hash_content: bool = False) -> None:
+        self.root = Path(root)
+        self.hash_content = hash_content
+        self.dirs: Dict[str, DirRecord] = {}
+        self._resolved_root = self.root.resolve()
+        # Словари «имя -> запись» по каталогам, строятся по запросу ``entry``
+        self._names: Dict[str, Tuple[DirRecord, Dict[str, Entry]]] = {}
+
+    # --- Построение и хранение ---
+
+    @classmethod
+    def build(
+        cls,
+        root: Union[str, Path],
+        path: Optional[Union[str, Path]] = None,
+        num_workers: int = DEFAULT_NUM_WORKERS,
+        hash_content: bool = False,
+        rebuild: bool = False,
+    ) -> "DatasetManifest":
+        """Загружает сохранённый индекс, обновляет его и сохраняет обратно.
+
+        Args:
+            root (Union[str, Path]): Корень датасета.
+            path (Optional[Union[str, Path]]): Файл индекса; по умолчанию —
+                ``default_manifest_path(root)``.
+            num_workers (int): Число потоков обхода и хеширования.
+            hash_content (bool): Считать ли sha256 содержимого файлов.
+            rebuild (bool): Игнорировать сохранённый индекс.
+
+        Returns:
+            DatasetManifest: Актуальный индекс.
+        """
+        path = Path(path) if path else default_manifest_path(root)
+        manifest = None if rebuild else cls.load(path, root)
+        if manifest is None:
+            manifest = cls(root, hash_content)
+        manifest.hash_content = manifest.hash_content or hash_content
+        stats = manifest.refresh(num_workers)
+        print(stats)
+        if stats.scanned_dirs or stats.changed_files or stats.hashed_files or not path.exists():
+            try:
+                manifest.save(path)
+            except OSError as e:
+                print(f"Не удалось сохранить индекс датасета в {path}: {e}")
+        return manifest
+
+    @classmethod
+    def load(
+        cls, path: Union[str, Path], root: Union[str, Path]
+    ) -> Optional["DatasetManifest"]:
+        """Читает индекс из файла; None, если его нет или он для другого корня."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Индекс датасета {path} не читается, строим заново: {e}")
+            return None
+        manifest = cls(root, bool(data.get("hash_content")))
+        if (
+            data.get("version") != _FORMAT_VERSION
+            or data.get("root") != str(manifest._resolved_root)
+        ):
+            return None
+        manifest.dirs = {
+            rel: DirRecord(
+                mtime_ns,
+                [
+                    Entry(name, bool(is_dir), size, mtime, sha)
+                    for name, is_dir, size, mtime, sha in entries
+                ],
+            )
+            for rel, (mtime_ns, entries) in data["dirs"].items()
+        }
+        return manifest
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Атомарно сохраняет индекс в файл JSON."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": _FORMAT_VERSION,
+            "root": str(self._resolved_root),
+            "hash_content": self.hash_content,
+            # Элемент — [имя, каталог ли, размер, mtime_ns, sha256]
+            "dirs": {
+                rel: [record.mtime_ns, [list(entry) for entry in record.entries]]
+                for rel, record in self.dirs.items()
+            },
+        }
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def refresh(self, num_workers: int = DEFAULT_NUM_WORKERS) -> RefreshStats:
+        """Приводит индекс в соответствие с диском.
+
+        Каталоги обходятся по уровням, каталоги одного уровня — параллельно.
+        Каталог перечитывается, только если изменился его ``mtime``; у файлов
+        остальных каталогов сверяются размер и ``mtime``.
+
+        Args:
+            num_workers (int): Число потоков.
+
+        Returns:
+            RefreshStats: Сколько каталогов перечитано, файлов изменено на
+            месте и захешировано.
+        """
+        started = time.monotonic()
+        scan_started_ns = time.time_ns()
+        previous = self.dirs
+        dirs: Dict[str, DirRecord] = {}
+        scanned = reused = changed = 0
+        level = [""]
+        with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+            while level:
+                results = executor.map(
+                    lambda rel: self._scan_dir(rel, previous.get(rel), scan_started_ns), level
+                )
+                next_level: List[str] = []
+                for rel, record, was_scanned, changed_files in results:
+                    if record is None:
+                        continue
+                    dirs[rel] = record
+                    scanned += was_scanned
+                    reused += not was_scanned
+                    changed += changed_files
+                    next_level.extend(
+                        _join(rel, entry.name) for entry in record.entries if entry.is_dir
+                    )
+                level = next_level
+
+            hashed = 0
+            if self.hash_content:
+                hashed = self._hash_missing(dirs, executor)
+        self.dirs = dirs
+        return RefreshStats(scanned, reused, changed, hashed, time.monotonic() - started)
+
+    def _scan_dir(
+        self, rel: str, previous: Optional[DirRecord], scan_started_ns: int
+    ) -> Tuple[str, Optional[DirRecord], bool, int]:
+        path = self.root / rel if rel else self.root
+        try:
+            dir_mtime = os.stat(path).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return rel, None, False, 0
+        if previous is not None and previous.mtime_ns == dir_mtime:
+            record, changed = self._restat_files(path, previous)
+            return rel, record, False, changed
+
+        known = {entry.name: entry for entry in previous.entries} if previous else {}
+        entries = []
+        with os.scandir(path) as it:
+            for item in it:
+                if item.is_dir():
+                    entries.append(Entry(item.name, True))
+                    continue
+                if not item.is_file():
+                    continue
+                stat = item.stat()
+                old = known.get(item.name)
+                sha = ""
+                if old is not None and (old.size, old.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                    sha = old.sha256
+                entries.append(Entry(item.name, False, stat.st_size, stat.st_mtime_ns, sha))
+        if scan_started_ns - dir_mtime < _MTIME_SLACK_NS:
+            dir_mtime = -1
+        return rel, DirRecord(dir_mtime, entries), True, 0
+
+    @staticmethod
+    def _restat_files(path: Path, record: DirRecord) -> Tuple[DirRecord, int]:
+        """Сверяет файлы неизменившегося каталога с диском.
+
+        У файлов с другими размером или ``mtime`` (перезаписанных на месте)
+        обновляются размер и ``mtime``, а хеш сбрасывается.
+
+        Returns:
+            Tuple[DirRecord, int]: Запись каталога (прежняя, если файлы не
+            менялись) и число изменившихся файлов.
+        """
+        entries = []
+        changed = 0
+        for entry in record.entries:
+            if entry.is_dir:
+                entries.append(entry)
+                continue
+            try:
+                stat = os.stat(path / entry.name)
+            except FileNotFoundError:
+                changed += 1
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (entry.size, entry.mtime_ns):
+                changed += 1
+                entry = entry._replace(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256="")
+            entries.append(entry)
+        if not changed:
+            return record, 0
+        return DirRecord(record.mtime_ns, entries), changed
+
+    def _hash_missing(self, dirs: Dict[str, DirRecord], executor: ThreadPoolExecutor) -> int:
+        missing = [
+            (rel, index)
+            for rel, record in dirs.items()
+            for index, entry in enumerate(record.entries)
+            if not entry.is_dir and not entry.sha256
+        ]
+
+        def digest(item: Tuple[str, int]) -> Optional[str]:
+            rel, index = item
+            try:
+                return _sha256(self.root / _join(rel, dirs[rel].entries[index].name))
+            except OSError:
+                return None
+
+        for (rel, index), sha in zip(missing, executor.map(digest, missing), strict=True):
+            if sha is not None:
+                entries = dirs[rel].entries
+                entries[index] = entries[index]._replace(sha256=sha)
+        return len(missing)
+
+    # --- Запросы ---
+
+    def _rel(self, path: Union[str, Path]) -> Optional[str]:
+        path = Path(path)
+        try:
+            rel = path.relative_to(self.root)
+        except ValueError:
+            try:
+                rel = path.resolve().relative_to(self._resolved_root)
+            except ValueError:
+                return None
+        return "" if str(rel) == "." else rel.as_posix()
+
+    def _record(self, path: Union[str, Path]) -> Optional[DirRecord]:
+        rel = self._rel(path)
+        return None if rel is None else self.dirs.get(rel)
+
+    def is_dir(self, path: Union[str, Path]) -> bool:
+        """Есть ли такой каталог в индексе."""
+        return self._record(path) is not None
+
+    def iterdir(self, path: Union[str, Path]) -> Optional[List[Path]]:
+        """Элементы каталога в порядке обхода или None, если каталога нет."""
+        record = self._record(path)
+        if record is None:
+            return None
+        return [Path(path) / entry.name for entry in record.entries]
+
+    def files(self, path: Union[str, Path]) -> List[Path]:
+        """Файлы каталога (пустой список, если каталога нет)."""
+        record = self._record(path)
+        if record is None:
+            return []
+        return [Path(path) / entry.name for entry in record.entries if not entry.is_dir]
+
+    def subdirs(self, path: Union[str, Path]) -> List[Path]:
+        """Подкаталоги каталога (пустой список, если каталога нет)."""
+        record = self._record(path)
+        if record is None:
+            return []
+        return [Path(path) / entry.name for entry in record.entries if entry.is_dir]
+
+    def entry(self, path: Union[str, Path]) -> Optional[Entry]:
+        """Запись о файле или подкаталоге (None, если её нет в индексе).
+
+        Размер и ``mtime`` файла сверяются с диском: если файл перезаписали
+        на месте, возвращается запись с новыми размером и ``mtime`` и без
+        хеша, а если удалили — None.
+        """
+        path = Path(path)
+        parent = self._rel(path.parent)
+        if parent is None:
+            return None
+        record = self.dirs.get(parent)
+        if record is None:
+            return None
+        names = self._names.get(parent)
+        if names is None or names[0] is not record:
+            names = (record, {entry.name: entry for entry in record.entries})
+            self._names[parent] = names
+        entry = names[1].get(path.name)
+        if entry is None or entry.is_dir:
+            return entry
+        try:
+            stat = os.stat(self.root / _join(parent, entry.name))
+        except OSError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (entry.size, entry.mtime_ns):
+            return entry._replace(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256="")
+        return entry
+
+    def iter_files(self) -> Iterable[Tuple[str, Entry]]:
+        """Все файлы индекса: путь относительно корня и запись о файле."""
+        for rel, record in self.dirs.items():
+            for entry in record.entries:
+                if not entry.is_dir:
+                    yield _join(rel, entry.name), entry
+
+    def fingerprint(self) -> str:
+        """Отпечаток содержимого датасета.
+
+        Строится по путям и sha256 файлов (или по размеру и ``mtime``, если
+        хеши не считались) и меняется при любом изменении набора файлов.
+        """
+        parts = sorted(
+            f"{rel}\x00{entry.sha256 or f'{entry.size}:{entry.mtime_ns}'}"
+            for rel, entry in self.iter_files()
+        )
+        return text_hash("\n".join(parts))
+
+    def frame(self) -> pd.DataFrame:
+        """Таблица файлов с полями, выведенными из раскладки датасета.
+
+        Раскладка ``[<класс>/]images/<сабсет>/[<документ>/]<файл>``: ``class_name``
+        — каталог перед ``images``, ``subset`` — каталог после него,
+        ``doc_id`` и ``page`` — для страниц в каталоге документа,
+        ``page_count`` — число файлов в каталоге документа.
+        """
+        rows = []
+        for rel, entry in self.iter_files():
+            parts = rel.split("/")
+            class_name = subset = doc_id = page = None
+            if "images" in parts[:-1]:
+                index = parts.index("images")
+                class_name = parts[index - 1] if index > 0 else None
+                subset = parts[index + 1] if index + 1 < len(parts) - 1 else None
+                if index + 2 < len(parts) - 1:
+                    doc_id = parts[index + 2]
+                    stem = Path(parts[-1]).stem
+                    page = int(stem) if stem.isdigit() else None
+            rows.append(
+                {
+                    "path": rel,
+                    "class_name": class_name,
+                    "subset": subset,
+                    "doc_id": doc_id,
+                    "page": page,
+                    "size": entry.size,
+                    "mtime_ns": entry.mtime_ns,
+                    "sha256": entry.sha256 or None,
+                }
+            )
+        df = pd.DataFrame(
+            rows,
+            columns=[
+                "path", "class_name", "subset", "doc_id", "page", "size", "mtime_ns", "sha256"
+            ],
+        )
+        doc_dirs = df["path"].str.rsplit("/", n=1).str[0]
+        df["page_count"] = df.groupby(doc_dirs)["path"].transform("size").where(
+            df["doc_id"].notna()
+        )
+        return df
+
+
+def default_manifest_path(root: Union[str, Path]) -> Path:
+    """Файл индекса по умолчанию: ``cache/manifests/<каталог>_<хеш пути>.json``."""
+    resolved = Path(root).resolve()
+    return DEFAULT_MANIFEST_DIR / f"{resolved.name}_{text_hash(str(resolved))[:12]}.json"
+
+
+def manifest_from_config(
+    dataset_path: Union[str, Path], config: Any
+) -> Optional[DatasetManifest]:
+    """Строит индекс по секции ``task.manifest`` конфига.
+
+    Args:
+        dataset_path (Union[str, Path]): Корень датасета.
+        config (Any): Секция ``manifest``: словарь с полями ``path``,
+            ``num_workers``, ``hash_content``; True или ``{}`` — параметры по
+            умолчанию; None, False или ``"enabled": false`` — индекс не
+            используется.
+
+    Returns:
+        Optional[DatasetManifest]: Индекс или None, если он выключен.
+    """
+    if config is None or config is False:
+        return None
+    config = {} if config is True else config
+    if not config.get("enabled", True):
+        return None
+    return DatasetManifest.build(
+        dataset_path,
+        path=config.get("path"),
+        num_workers=int(config.get("num_workers", DEFAULT_NUM_WORKERS)),
+        hash_content=bool(config.get("hash_content", False)),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Построение индекса файлов датасета")
+    parser.add_argument("dataset_path", type=Path)
+    parser.add_argument("--path", type=Path, default=None, help="Файл индекса")
+    parser.add_argument("--num-workers", type=int, default=DEFAULT_NUM_WORKERS)
+    parser.add_argument("--hash-content", action="store_true", help="Считать sha256 файлов")
+    parser.add_argument("--rebuild", action="store_true", help="Построить индекс заново")
+    args = parser.parse_args()
+
+    manifest = DatasetManifest.build(
+        args.dataset_path,
+        path=args.path,
+        num_workers=args.num_workers,
+        hash_content=args.hash_content,
+        rebuild=args.rebuild,
+    )
+    df = manifest.frame()
+    print(f"Файлов: {len(df)}, каталогов: {len(manifest.dirs)}")
+    summary = df.groupby(["class_name", "subset"], dropna=False).size()
+    if not summary.empty:
+        print(summary.to_string())
+    print(f"Отпечаток датасета: {manifest.fingerprint()}")
+
+
+if __name__ == "__main__":
+    main()
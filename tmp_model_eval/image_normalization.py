@@ -0,0 +1,259 @@
+"""Нормализация разрешения изображений перед отправкой в модель.
+
+Скрипты оценки передают модели исходные сканы. Скан 6000×4000 стоит
+визуальных токенов в разы больше, чем его копия на 1500 пикселей по
+длинной стороне, а на классификацию это не влияет; для сортировки страниц,
+где в запросе четыре изображения, от разрешения зависит, поместится ли
+запрос в память вообще.
+
+``ImageNormalizer`` приводит изображение к бюджету пикселей с сохранением
+пропорций: большие уменьшаются до ``max_pixels``, маленькие увеличиваются до
+``min_pixels``; по желанию изображение переводится в оттенки серого.
+Результат сохраняется в ``cache_dir`` как JPEG с ключом (хеш содержимого
+исходного файла, параметры нормализации), поэтому каждый скан обрабатывается
+один раз, а следующие запуски читают уже маленький файл. Изображения,
+которые менять не нужно, не копируются — используется исходный файл.
+
+Параметры задаются секцией ``task.image_normalization``::
+
+    "image_normalization": {"max_pixels": 1003520, "grayscale": false}
+
+Ответы модели на нормализованных изображениях отличаются от ответов на
+исходных, поэтому параметры нормализации входят в ключи кеша предсказаний и
+хранилища оценок (см. ``normalized_model_config``).
+"""
+
+import hashlib
+import json
+import math
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+from image_prefetch import load_image
+from prediction_cache import file_digest
+
+DEFAULT_CACHE_DIR = Path("cache") / "normalized"
+DEFAULT_JPEG_QUALITY = 90
+# Пикселей на визуальный токен: патч 14×14 с объединением 2×2 (семейство Qwen2-VL)
+DEFAULT_PIXELS_PER_TOKEN = 28 * 28
+
+
+def target_size(
+    width: int,
+    height: int,
+    max_pixels: Optional[int] = None,
+    min_pixels: Optional[int] = None,
+) -> Tuple[int, int]:
+    """Размер изображения после приведения к бюджету пикселей.
+
+    Args:
+        width (int): Ширина исходного изображения.
+        height (int): Высота исходного изображения.
+        max_pixels (Optional[int]): Максимальное число пикселей; None — без ограничения.
+        min_pixels (Optional[int]): Минимальное число пикселей; None — без ограничения.
+
+    Returns:
+        Tuple[int, int]: Новые ширина и высота (пропорции сохраняются).
+    """
+    pixels = width * height
+    if max_pixels and pixels > max_pixels:
+        scale = math.sqrt(max_pixels / pixels)
+        return max(1, int(width * scale)), max(1, int(height * scale))
+    if min_pixels and 0 < pixels < min_pixels:
+        scale = math.sqrt(min_pixels / pixels)
+        return math.ceil(width * scale), math.ceil(height * scale)
+    return width, height
+
+
+def normalize_image(
+    image: Image.Image,
+    max_pixels: Optional[int] = None,
+    min_pixels: Optional[int] = None,
+    grayscale: bool = False,
+) -> Image.Image:
+    """Приводит изображение к бюджету пикселей.
+
+    Поворот из EXIF применяется сразу: при перекодировании EXIF теряется.
+
+    Args:
+        image (Image.Image): Исходное изображение.
+        max_pixels (Optional[int]): Максимальное число пикселей.
+        min_pixels (Optional[int]): Минимальное число пикселей.
+        grayscale (bool): Перевести в оттенки серого (режим ``L``).
+
+    Returns:
+        Image.Image: Изображение в режиме ``RGB`` или ``L``.
+    """
+    image = ImageOps.exif_transpose(image)
+    mode = "L" if grayscale else "RGB"
+    if image.mode != mode:
+        image = image.convert(mode)
+    size = target_size(image.width, image.height, max_pixels, min_pixels)
+    if size != image.size:
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    return image
+
+
+class ImageNormalizer:
+    """Нормализация изображений с дисковым кешем результатов.
+
+    Методы потокобезопасны: нормализация идёт в потоках предзагрузки.
+
+    Args:
+        max_pixels (Optional[int]): Максимальное число пикселей изображения.
+        min_pixels (Optional[int]): Минимальное число пикселей изображения.
+        grayscale (bool): Переводить изображения в оттенки серого.
+        cache_dir (Union[str, Path]): Каталог нормализованных изображений.
+        jpeg_quality (int): Качество JPEG нормализованных изображений.
+        pixels_per_token (int): Сколько пикселей приходится на один
+            визуальный токен — только для оценки экономии в ``stats``.
+    """
+
+    def __init__(
+        self,
+        max_pixels: Optional[int] = None,
+        min_pixels: Optional[int] = None,
+        grayscale: bool = False,
+        cache_dir: Union[str, Path] = DEFAULT_CACHE_DIR,
+        jpeg_quality: int = DEFAULT_JPEG_QUALITY,
+        pixels_per_token: int = DEFAULT_PIXELS_PER_TOKEN,
+    ) -> None:
+        if max_pixels and min_pixels and min_pixels > max_pixels:
+            raise ValueError(
+                f"min_pixels ({min_pixels}) не может быть больше max_pixels ({max_pixels})"
+            )
+        self.max_pixels = max_pixels
+        self.min_pixels = min_pixels
+        self.grayscale = grayscale
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.jpeg_quality = jpeg_quality
+        self.pixels_per_token = max(1, pixels_per_token)
+        self.created = 0
+        self.reused = 0
+        self.unchanged = 0
+        self.source_pixels = 0
+        self.output_pixels = 0
+        self._lock = threading.Lock()
+        self._spec_hash = hashlib.sha256(
+            json.dumps(self.spec(), sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> Optional["ImageNormalizer"]:
+        """Создаёт нормализатор по секции ``task.image_normalization`` конфига.
+
+        Args:
+            config (Optional[Dict[str, Any]]): Секция с полями ``max_pixels``,
+                ``min_pixels``, ``grayscale``, ``cache_dir``, ``jpeg_quality``,
+                ``pixels_per_token`` или None.
+
+        Returns:
+            Optional[ImageNormalizer]: Нормализатор или None, если секция не
+            задана или выключена (``enabled: false``).
+        """
+        if not config or not config.get("enabled", True):
+            return None
+        return cls(
+            max_pixels=config.get("max_pixels"),
+            min_pixels=config.get("min_pixels"),
+            grayscale=bool(config.get("grayscale", False)),
+            cache_dir=config.get("cache_dir", DEFAULT_CACHE_DIR),
+            jpeg_quality=int(config.get("jpeg_quality", DEFAULT_JPEG_QUALITY)),
+            pixels_per_token=int(config.get("pixels_per_token", DEFAULT_PIXELS_PER_TOKEN)),
+        )
+
+    def spec(self) -> Dict[str, Any]:
+        """Параметры, от которых зависит результат нормализации."""
+        return {
+            "max_pixels": self.max_pixels,
+            "min_pixels": self.min_pixels,
+            "grayscale": self.grayscale,
+            "jpeg_quality": self.jpeg_quality,
+        }
+
+    def prepare(self, image_path: Union[str, Path]) -> Path:
+        """Возвращает путь к нормализованной версии изображения.
+
+        При первом обращении нормализованный файл создаётся в ``cache_dir``.
+
+        Args:
+            image_path (Union[str, Path]): Путь к исходному изображению.
+
+        Returns:
+            Path: Путь к нормализованному файлу или сам ``image_path``, если
+            изображение уже соответствует параметрам.
+        """
+        image_path = Path(image_path)
+        with Image.open(image_path) as image:
+            source_size = image.size
+            size = target_size(image.width, image.height, self.max_pixels, self.min_pixels)
+            if size == source_size and (not self.grayscale or image.mode == "L"):
+                self._count(source_size, size, "unchanged")
+                return image_path
+
+            key = hashlib.sha256(
+                f"{file_digest(image_path)}\x00{self._spec_hash}".encode("utf-8")
+            ).hexdigest()
+            output_path = self.cache_dir / f"{key}.jpg"
+            if output_path.exists():
+                self._count(source_size, size, "reused")
+                return output_path
+
+            if image.format == "JPEG" and size[0] * size[1] < source_size[0] * source_size[1]:
+                # JPEG декодируется сразу в уменьшенном масштабе — в разы быстрее
+                image.draft("L" if self.grayscale else "RGB", size)
+            normalized = normalize_image(image, self.max_pixels, self.min_pixels, self.grayscale)
+            # После draft размер может отличаться от расчётного на пиксель
+            size = normalized.size
+
+        tmp_path = output_path.with_name(f"{output_path.name}.{threading.get_ident()}.tmp")
+        normalized.save(tmp_path, format="JPEG", quality=self.jpeg_quality)
+        os.replace(tmp_path, output_path)
+        self._count(source_size, size, "created")
+        return output_path
+
+    def load(self, image_path: Union[str, Path]) -> Image.Image:
+        """Загружает нормализованное изображение в RGB (см. ``prepare``)."""
+        return load_image(self.prepare(image_path))
+
+    def _count(self, source_size: Tuple[int, int], size: Tuple[int, int], outcome: str) -> None:
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.source_pixels += source_size[0] * source_size[1]
+            self.output_pixels += size[0] * size[1]
+
+    def stats(self) -> str:
+        """Возвращает строку с экономией пикселей и визуальных токенов."""
+        total = self.created + self.reused + self.unchanged
+        saved = 1 - self.output_pixels / self.source_pixels if self.source_pixels else 0.0
+        return (
+            f"Нормализация изображений: {total} (создано {self.created}, "
+            f"из кеша {self.reused}, без изменений {self.unchanged}); "
+            f"пикселей {self.source_pixels / 1e6:.1f} Мп -> {self.output_pixels / 1e6:.1f} Мп "
+            f"({saved:.0%} экономии), визуальных токенов ≈ "
+            f"{self.source_pixels // self.pixels_per_token} -> "
+            f"{self.output_pixels // self.pixels_per_token}"
+        )
+
+
+def normalized_model_config(
+    model_config: Dict[str, Any], normalizer: Optional[ImageNormalizer]
+) -> Dict[str, Any]:
+    """Секция ``model`` с параметрами нормализации — для ключей кешей ответов.
+
+    Args:
+        model_config (Dict[str, Any]): Секция ``model`` конфига.
+        normalizer (Optional[ImageNormalizer]): Нормализатор или None.
+
+    Returns:
+        Dict[str, Any]: ``model_config`` без изменений, если нормализации нет,
+        иначе его копия с полем ``image_normalization``.
+    """
+    if normalizer is None:
+        return model_config
+    return {**model_config, "image_normalization": normalizer.spec()}
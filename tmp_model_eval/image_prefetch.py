@@ -0,0 +1,202 @@
+"""Фоновая предзагрузка изображений для циклов оценки.
+
+Чтение и декодирование изображения с диска не должно стоять на критическом
+пути перед вызовом модели. ``Prefetcher`` загружает элементы в пуле потоков
+на несколько шагов вперёд и отдаёт их потребителю строго в исходном порядке.
+
+Окно предзагрузки ограничено и по количеству элементов (``max_ahead``), и по
+суммарному объёму загруженных, но ещё не отданных данных (``max_bytes``),
+поэтому потребление памяти не растёт с размером сабсета.
+
+Обёртки ``model_interface`` принимают пути к файлам, поэтому по умолчанию
+предзагрузка только готовит пути (поиск в кеше, нормализация), а
+декодирует изображения лишь для моделей, которые принимают их напрямую
+(см. ``accepts_images``).
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypedDict,
+    TypeVar,
+)
+
+from PIL import Image
+
+T = TypeVar("T")
+
+DEFAULT_NUM_WORKERS = 4
+DEFAULT_MAX_AHEAD = 16
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class PrefetchSettings(TypedDict):
+    """Аргументы конструктора ``Prefetcher`` (см. ``prefetch_settings``)."""
+
+    num_workers: int
+    max_ahead: int
+    max_bytes: int
+
+
+def accepts_images(model: Any) -> bool:
+    """Принимает ли модель декодированные изображения вместо путей.
+
+    Обёртка, умеющая работать с ``PIL.Image``, объявляет это атрибутом
+    ``accepts_images = True``; остальным передаются пути к файлам.
+    """
+    return bool(getattr(model, "accepts_images", False))
+
+
+def load_image(path: Path) -> Image.Image:
+    """Читает и полностью декодирует изображение в RGB.
+
+    Args:
+        path (Path): Путь к файлу изображения.
+
+    Returns:
+        Image.Image: Декодированное изображение, готовое к передаче модели.
+    """
+    with Image.open(path) as img:
+        return img.convert("RGB")
+
+
+def load_images(paths: List[Path]) -> List[Image.Image]:
+    """Загружает несколько изображений (например, все страницы документа)."""
+    return [load_image(path) for path in paths]
+
+
+def payload_size(payload: Any) -> int:
+    """Оценивает объём памяти, занимаемый загруженными данными, в байтах.
+
+    Поддерживаются изображения PIL, строки/байты, а также списки, кортежи и
+    словари из них. Для прочих объектов возвращается 0.
+    """
+    if isinstance(payload, Image.Image):
+        return payload.width * payload.height * len(payload.getbands())
+    if isinstance(payload, (bytes, bytearray, str)):
+        return len(payload)
+    if isinstance(payload, (list, tuple)):
+        return sum(payload_size(p) for p in payload)
+    if isinstance(payload, dict):
+        return sum(payload_size(p) for p in payload.values())
+    return 0
+
+
+def prefetch_settings(config: Optional[Dict[str, Any]]) -> PrefetchSettings:
+    """Извлекает параметры предзагрузки из секции ``prefetch`` конфига.
+
+    Args:
+        config (Optional[Dict[str, Any]]): Секция ``prefetch`` или None.
+
+    Returns:
+        PrefetchSettings: Аргументы ``num_workers``, ``max_ahead`` и
+        ``max_bytes`` для конструктора ``Prefetcher``.
+    """
+    config = config or {}
+    return {
+        "num_workers": int(config.get("num_workers", DEFAULT_NUM_WORKERS)),
+        "max_ahead": int(config.get("max_ahead", DEFAULT_MAX_AHEAD)),
+        "max_bytes": int(config.get("max_bytes", DEFAULT_MAX_BYTES)),
+    }
+
+
+class Prefetcher(Generic[T]):
+    """Ограниченный конвейер предзагрузки поверх пула потоков.
+
+    Args:
+        load_fn (Callable[[T], Any]): Функция, загружающая данные для элемента.
+        num_workers (int): Число потоков загрузки.
+        max_ahead (int): Максимум элементов, загружаемых впереди потребителя.
+        max_bytes (int): Ограничение на суммарный объём загруженных, но ещё
+            не отданных данных. Один элемент загружается всегда, даже если
+            он сам больше ограничения.
+        size_fn (Callable[[Any], int]): Оценка объёма данных элемента.
+
+    Пример:
+        >>> prefetcher = Prefetcher(load_image, max_ahead=8)
+        >>> for path, image in prefetcher.iterate(image_paths):
+        ...     model.predict_on_image(image=image, prompt=prompt)
+    """
+
+    def __init__(
+        self,
+        load_fn: Callable[[T], Any],
+        num_workers: int = DEFAULT_NUM_WORKERS,
+        max_ahead: int = DEFAULT_MAX_AHEAD,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        size_fn: Callable[[Any], int] = payload_size,
+    ) -> None:
+        self.load_fn = load_fn
+        self.num_workers = max(1, num_workers)
+        self.max_ahead = max(1, max_ahead)
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+
+    def _load(self, item: T) -> Tuple[Any, int]:
+        payload = self.load_fn(item)
+        return payload, self.size_fn(payload)
+
+    def iterate(self, items: Iterable[T]) -> Iterator[Tuple[T, Any]]:
+        """Отдаёт пары (элемент, загруженные данные) в исходном порядке.
+
+        Исключение, возникшее при загрузке элемента, пробрасывается в момент,
+        когда потребитель доходит до этого элемента.
+
+        Args:
+            items (Iterable[T]): Элементы для загрузки (например, пути).
+
+        Yields:
+            Tuple[T, Any]: Элемент и результат ``load_fn`` для него.
+        """
+        source = iter(items)
+        window: Deque[Tuple[T, Future]] = deque()
+        # Средний размер уже загруженных элементов — оценка для тех, что ещё в работе
+        loaded_count = 0
+        loaded_bytes = 0
+
+        def buffered_bytes() -> int:
+            avg = loaded_bytes // loaded_count if loaded_count else 0
+            total = 0
+            for _, future in window:
+                total += future.result()[1] if future.done() and not future.exception() else avg
+            return total
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            exhausted = False
+            try:
+                while True:
+                    while (
+                        not exhausted
+                        and len(window) < self.max_ahead
+                        and (not window or buffered_bytes() < self.max_bytes)
+                    ):
+                        try:
+                            item = next(source)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        window.append((item, executor.submit(self._load, item)))
+
+                    if not window:
+                        return
+
+                    item, future = window.popleft()
+                    payload, size = future.result()
+                    loaded_count += 1
+                    loaded_bytes += size
+                    yield item, payload
+            finally:
+                # Потребитель мог прервать итерацию: не ждём лишних загрузок
+                for _, future in window:
+                    future.cancel()
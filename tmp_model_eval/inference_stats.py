@@ -0,0 +1,217 @@
+"""Стоимость инференса: задержка, токены и размер запросов.
+
+Для каждого предсказания сохраняется ``InferenceRecord``: задержка запроса
+к модели, число изображений в запросе, число повторов и (если бэкенд их
+сообщает) токены промпта и ответа. ``summarize`` сводит записи в
+показатели пропускной способности — запросов и изображений в секунду,
+токенов ответа в секунду и перцентили задержки, — чтобы модели можно было
+сравнивать не только по качеству, но и по цене.
+
+Токены обёртка модели сообщает атрибутом ``last_usage`` — словарём (или
+объектом) с полями ``prompt_tokens`` и ``completion_tokens`` для последнего
+вызова. Обёртка должна создавать новый объект на каждый вызов: если после
+вызова ``last_usage`` остался прежним, считается, что токены не сообщены.
+
+Если один запрос дал несколько предсказаний (батч, ``batch_size`` > 1),
+задержка запроса записывается каждому его предсказанию, а токены делятся
+между ними поровну; в сводке каждое предсказание входит в число запросов
+с весом ``1 / batch_size``. Запрос с несколькими изображениями на одно
+предсказание (страницы документа) — это один запрос с ``batch_size`` = 1.
+"""
+
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, TypeVar
+
+import numpy as np
+
+T = TypeVar("T")
+
+# Поля записи в журнале и таблицах результатов
+STATS_FIELDS = (
+    "latency_s",
+    "images_per_request",
+    "batch_size",
+    "prompt_tokens",
+    "completion_tokens",
+    "retries",
+    "cached",
+)
+
+
+class InferenceRecord(NamedTuple):
+    """Стоимость одного предсказания."""
+
+    latency_s: float
+    images_per_request: int
+    batch_size: int = 1
+    prompt_tokens: Optional[float] = None
+    completion_tokens: Optional[float] = None
+    retries: int = 0
+    cached: bool = False
+
+    def share(self, num_items: int) -> "InferenceRecord":
+        """Доля одного из ``num_items`` предсказаний общего запроса."""
+        if num_items <= 1:
+            return self
+        return self._replace(
+            batch_size=num_items,
+            prompt_tokens=_divide(self.prompt_tokens, num_items),
+            completion_tokens=_divide(self.completion_tokens, num_items),
+        )
+
+    def as_fields(self) -> Dict[str, Any]:
+        """Поля для журнала (задержка округлена до микросекунд)."""
+        fields = self._asdict()
+        fields["latency_s"] = round(self.latency_s, 6)
+        return fields
+
+
+CACHED = InferenceRecord(latency_s=0.0, images_per_request=0, batch_size=0, cached=True)
+
+
+def _divide(value: Optional[float], divisor: int) -> Optional[float]:
+    return None if value is None else value / divisor
+
+
+def _usage_value(usage: Any, name: str) -> Optional[int]:
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return int(value) if isinstance(value, (int, float)) else None
+
+
+def read_usage(usage: Any) -> Tuple[Optional[int], Optional[int]]:
+    """Достаёт число токенов промпта и ответа из ``usage`` (словаря или объекта).
+
+    Returns:
+        Tuple[Optional[int], Optional[int]]: ``(prompt_tokens, completion_tokens)``;
+        None для значений, которые не сообщены.
+    """
+    if usage is None:
+        return None, None
+    return _usage_value(usage, "prompt_tokens"), _usage_value(usage, "completion_tokens")
+
+
+def timed_call(
+    model: Any, call: Callable[[], T], num_images: int, retries: int = 0
+) -> Tuple[T, InferenceRecord]:
+    """Вызывает модель, замеряя задержку и считывая ``model.last_usage``.
+
+    Args:
+        model (Any): Обёртка модели (источник ``last_usage``).
+        call (Callable[[], T]): Сам вызов модели.
+        num_images (int): Число изображений в запросе.
+        retries (int): Сколько раз этот запрос уже повторялся.
+
+    Returns:
+        Tuple[T, InferenceRecord]: Результат вызова и его стоимость.
+    """
+    usage_before = getattr(model, "last_usage", None)
+    started = time.perf_counter()
+    result = call()
+    latency = time.perf_counter() - started
+    usage = getattr(model, "last_usage", None)
+    prompt_tokens, completion_tokens = read_usage(None if usage is usage_before else usage)
+    return result, InferenceRecord(
+        latency_s=latency,
+        images_per_request=num_images,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        retries=retries,
+    )
+
+
+def _weighted_percentiles(
+    values: np.ndarray, weights: np.ndarray, quantiles: List[float]
+) -> List[float]:
+    order = np.argsort(values)
+    values, weights = values[order], weights[order]
+    cumulative = np.cumsum(weights) / weights.sum()
+    return [float(values[min(np.searchsorted(cumulative, q), len(values) - 1)]) for q in quantiles]
+
+
+def summarize(
+    records: Iterable[Dict[str, Any]], elapsed_s: Optional[float] = None
+) -> Dict[str, Any]:
+    """Сводит записи о стоимости предсказаний в показатели пропускной способности.
+
+    Закешированные предсказания учитываются только в ``cached``. Скорости
+    считаются по суммарному времени работы модели (без чтения данных и
+    разбора ответов), поэтому не зависят от скорости остального конвейера.
+
+    Args:
+        records (Iterable[Dict[str, Any]]): Записи с полями ``STATS_FIELDS``
+            (например, записи журнала); записи без ``latency_s`` пропускаются.
+        elapsed_s (Optional[float]): Время, по которому считать скорости,
+            вместо суммарного времени модели — для параллельных запросов,
+            чьи задержки перекрываются.
+
+    Returns:
+        Dict[str, Any]: ``predictions``, ``cached``, ``requests``,
+        ``mean_images_per_request``, ``retries``, ``model_time_s``,
+        ``requests_per_s``, ``predictions_per_s``, ``images_per_s``, ``prompt_tokens``,
+        ``completion_tokens``, ``completion_tokens_per_s`` и
+        ``latency_p50_s``/``latency_p95_s``/``latency_p99_s`` (задержка запроса).
+    """
+    latencies: List[float] = []
+    weights: List[float] = []
+    images = 0.0
+    cached = retries = 0
+    prompt_tokens = completion_tokens = 0.0
+    has_tokens = False
+    for record in records:
+        if record.get("latency_s") is None:
+            continue
+        if record.get("cached"):
+            cached += 1
+            continue
+        latencies.append(float(record["latency_s"]))
+        weight = 1 / max(int(record.get("batch_size") or 1), 1)
+        weights.append(weight)
+        images += int(record.get("images_per_request") or 1) * weight
+        retries += int(record.get("retries") or 0)
+        if record.get("completion_tokens") is not None:
+            has_tokens = True
+            prompt_tokens += float(record.get("prompt_tokens") or 0)
+            completion_tokens += float(record["completion_tokens"])
+
+    summary: Dict[str, Any] = {
+        "predictions": len(latencies),
+        "cached": cached,
+        "requests": round(sum(weights), 2),
+        "mean_images_per_request": None,
+        "retries": retries,
+        "model_time_s": None,
+        "requests_per_s": None,
+        "predictions_per_s": None,
+        "images_per_s": None,
+        "prompt_tokens": round(prompt_tokens) if has_tokens else None,
+        "completion_tokens": round(completion_tokens) if has_tokens else None,
+        "completion_tokens_per_s": None,
+        "latency_p50_s": None,
+        "latency_p95_s": None,
+        "latency_p99_s": None,
+    }
+    if not latencies:
+        return summary
+
+    values = np.asarray(latencies)
+    request_weights = np.asarray(weights)
+    # Время запроса записано каждому его предсказанию — суммируем с весами
+    model_time = float((values * request_weights).sum())
+    p50, p95, p99 = _weighted_percentiles(values, request_weights, [0.5, 0.95, 0.99])
+    summary.update(
+        {
+            "mean_images_per_request": round(images / request_weights.sum(), 2),
+            "model_time_s": round(model_time, 3),
+            "latency_p50_s": round(p50, 4),
+            "latency_p95_s": round(p95, 4),
+            "latency_p99_s": round(p99, 4),
+        }
+    )
+    rate_time = model_time if elapsed_s is None else elapsed_s
+    if rate_time > 0:
+        summary["requests_per_s"] = round(request_weights.sum() / rate_time, 3)
+        summary["predictions_per_s"] = round(len(latencies) / rate_time, 3)
+        summary["images_per_s"] = round(images / rate_time, 3)
+        if has_tokens:
+            summary["completion_tokens_per_s"] = round(completion_tokens / rate_time, 1)
+    return summary
@@ -0,0 +1,96 @@
+"""Параллельная загрузка пар (эталон, предсказание) для оценки извлечения полей.
+
+На сетевых файловых системах время уходит в основном на задержку открытия
+и чтения каждого файла, поэтому файлы читаются в пуле потоков. Для разбора
+используется ``orjson``, если он установлен, иначе стандартный ``json``.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+    _DECODE_ERRORS: Tuple[Type[BaseException], ...] = (orjson.JSONDecodeError, UnicodeDecodeError)
+except ImportError:
+    _loads = json.loads
+    _DECODE_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
+DEFAULT_NUM_WORKERS = 16
+
+# (doc_id, эталон, предсказание)
+EvalRecord = Tuple[str, Dict[str, Any], Dict[str, Any]]
+
+
+def read_json(path: Union[str, Path]) -> Any:
+    """Читает и разбирает JSON-файл."""
+    with open(path, "rb") as f:
+        return _loads(f.read())
+
+
+def _read_prediction(path: Path) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Читает предсказание; отсутствующий или битый файл — пустой словарь.
+
+    Returns:
+        Tuple[Dict[str, Any], Optional[str]]: Предсказание и причина,
+        по которой оно заменено пустым ('missing' / 'invalid'), либо None.
+    """
+    try:
+        data = read_json(path)
+    except FileNotFoundError:
+        return {}, "missing"
+    except _DECODE_ERRORS:
+        return {}, "invalid"
+    if not isinstance(data, dict):
+        return {}, "invalid"
+    return data, None
+
+
+def load_eval_records(
+    gt_path: Union[str, Path],
+    pred_path: Union[str, Path],
+    num_workers: int = DEFAULT_NUM_WORKERS,
+) -> List[EvalRecord]:
+    """Загружает эталоны и соответствующие им предсказания.
+
+    Документы упорядочены по имени файла эталона. Если предсказания для
+    документа нет (модель не ответила) или его не удалось разобрать, вместо
+    него подставляется пустой словарь — все поля документа считаются
+    неизвлечёнными.
+
+    Args:
+        gt_path (Union[str, Path]): Каталог с эталонными JSON.
+        pred_path (Union[str, Path]): Каталог с предсказаниями (имена файлов
+            совпадают с эталонными).
+        num_workers (int): Число потоков чтения.
+
+    Returns:
+        List[EvalRecord]: Записи (doc_id, эталон, предсказание), где doc_id —
+        имя файла без расширения.
+    """
+    gt_path = Path(gt_path)
+    pred_path = Path(pred_path)
+    gt_files = sorted(gt_path.glob("*.json"))
+
+    def load(gt_file: Path) -> Tuple[EvalRecord, Optional[str]]:
+        gt = read_json(gt_file)
+        pred, problem = _read_prediction(pred_path / gt_file.name)
+        return (gt_file.stem, gt, pred), problem
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        loaded = list(executor.map(load, gt_files))
+    elapsed = time.perf_counter() - started
+
+    missing = sum(1 for _, problem in loaded if problem == "missing")
+    invalid = sum(1 for _, problem in loaded if problem == "invalid")
+    rate = len(loaded) / elapsed if elapsed > 0 else float("inf")
+    print(
+        f"Загружено документов: {len(loaded)} за {elapsed:.2f} с ({rate:.0f} док/с); "
+        f"без предсказания: {missing}, с нечитаемым предсказанием: {invalid}"
+    )
+    return [record for record, _ in loaded]
@@ -0,0 +1,350 @@
+"""Выбор бэкенда модели по секции ``model`` конфига.
+
+Кроме настоящей модели (``bench_utils.model_utils.initialize_model``)
+поддерживаются бэкенды, не требующие GPU и весов модели, — с ними можно
+измерять собственные накладные расходы конвейера (чтение изображений,
+разбор ответов, метрики, журналы) на обычной машине:
+
+* ``"backend": "replay"`` — ответы берутся из файла, записанного ранее
+  с ``record_path`` (см. ниже); при необходимости воспроизводится и
+  записанная задержка;
+* ``"backend": "synthetic"`` — ответы выбираются из списка ``responses``,
+  задержка — из логнормального распределения.
+
+Если в секции задан ``record_path``, ответы настоящей модели дописываются в
+этот файл (JSONL) вместе с задержкой и затем могут быть воспроизведены.
+
+Все бэкенды сообщают число токенов последнего вызова атрибутом
+``last_usage`` (см. ``inference_stats``): синтетический — оценку, replay —
+записанное значение, если настоящая модель его сообщала.
+
+Запрос идентифицируется хешем промпта и содержимого изображений: для путей —
+хешем файла, для загруженных изображений — хешем пикселей. Поэтому при
+записи и воспроизведении изображения нужно передавать одинаково (что и
+делают скрипты оценки при одинаковом конфиге). Скрипты передают пути всем
+моделям, кроме объявивших ``accepts_images`` (см. ``image_prefetch``); из
+офлайн-бэкендов изображения принимает только синтетический.
+"""
+
+import abc
+import hashlib
+import json
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from PIL import Image
+
+from batch_controller import OutOfMemoryError
+from inference_stats import read_usage
+from prediction_cache import file_digest, text_hash
+
+# Доля задержки одного изображения, добавляемая каждым следующим изображением
+# батча (батч на GPU дешевле последовательных вызовов)
+DEFAULT_BATCH_SCALING = 0.25
+
+# Оценка числа токенов промпта на одно изображение для синтетической модели
+DEFAULT_TOKENS_PER_IMAGE = 256
+
+
+def image_digest(image: Any) -> str:
+    """Хеш содержимого изображения: пути к файлу или загруженного изображения."""
+    if isinstance(image, Image.Image):
+        digest = hashlib.sha256(f"{image.mode}:{image.size}".encode("utf-8"))
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+    if isinstance(image, (str, Path)):
+        return file_digest(image)
+    return text_hash(repr(image))
+
+
+def _quick_digest(image: Any) -> str:
+    """Дешёвый детерминированный отпечаток изображения (для синтетической модели).
+
+    Для загруженных изображений хешируется миниатюра 32×32, для путей — сам путь.
+    """
+    if isinstance(image, Image.Image):
+        thumbnail = image.resize((32, 32), Image.Resampling.NEAREST)
+        return hashlib.sha256(thumbnail.tobytes()).hexdigest()
+    return text_hash(str(image))
+
+
+def request_key(images: Sequence[Any], prompt: str) -> str:
+    """Ключ запроса к модели: промпт и изображения (с учётом порядка)."""
+    parts = [text_hash(prompt)] + [image_digest(image) for image in images]
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+class _BaseBackend(abc.ABC):
+    """Общая часть офлайн-бэкендов: три метода интерфейса модели."""
+
+    @abc.abstractmethod
+    def _respond(self, images: Sequence[Any], prompt: str) -> str:
+        """Ответ модели на промпт с изображениями."""
+
+    def predict_on_image(self, image: Any, prompt: str) -> str:
+        return self._respond([image], prompt)
+
+    def predict_on_images(self, images: List[Any], prompt: str) -> str:
+        return self._respond(images, prompt)
+
+    def predict_on_batch(self, images: List[Any], prompts: List[str]) -> List[str]:
+        return [
+            self._respond([image], prompt)
+            for image, prompt in zip(images, prompts, strict=True)
+        ]
+
+
+class SyntheticModel(_BaseBackend):
+    """Модель-заглушка с синтетической задержкой.
+
+    Параметры секции ``model``:
+
+    * ``responses`` — список ответов; ответ выбирается детерминированно по
+      промпту и изображениям (по умолчанию ``["0"]``);
+    * ``latency_ms`` — медианная задержка на одно изображение, мс (по умолчанию 0);
+    * ``latency_sigma`` — разброс логнормального распределения задержки
+      (по умолчанию 0 — задержка постоянна);
+    * ``batch_scaling`` — доля задержки, добавляемая каждым следующим
+      изображением батча (по умолчанию 0.25);
+    * ``seed`` — зерно генератора задержек;
+    * ``tokens_per_image`` — сколько токенов промпта добавляет одно
+      изображение в ``last_usage`` (по умолчанию 256; токены текста
+      оцениваются числом слов);
+    * ``oom_above`` — вызов с большим числом изображений бросает
+      ``OutOfMemoryError`` (по умолчанию не бросает; для проверки
+      ``batch_controller``).
+
+    Args:
+        model_config (Dict[str, Any]): Секция ``model`` конфига.
+    """
+
+    # Скрипты оценки передают модели декодированные изображения
+    accepts_images = True
+
+    def __init__(self, model_config: Dict[str, Any]) -> None:
+        oom_above = model_config.get("oom_above")
+        self.oom_above: Optional[int] = None if oom_above is None else int(oom_above)
+        self.responses: List[str] = list(model_config.get("responses") or ["0"])
+        self.tokens_per_image = int(model_config.get("tokens_per_image", DEFAULT_TOKENS_PER_IMAGE))
+        self.last_usage: Optional[Dict[str, int]] = None
+        self.latency = float(model_config.get("latency_ms", 0)) / 1000
+        self.latency_sigma = float(model_config.get("latency_sigma", 0))
+        self.batch_scaling = float(model_config.get("batch_scaling", DEFAULT_BATCH_SCALING))
+        self._random = random.Random(model_config.get("seed", 0))
+        self._lock = threading.Lock()
+
+    def _sleep(self, num_images: int) -> None:
+        if self.oom_above is not None and num_images > self.oom_above:
+            raise OutOfMemoryError(f"Синтетическая нехватка памяти: {num_images} изображений")
+        if self.latency <= 0:
+            return
+        with self._lock:
+            factor = self._random.lognormvariate(0, self.latency_sigma)
+        time.sleep(self.latency * factor * (1 + self.batch_scaling * max(num_images - 1, 0)))
+
+    def _choose(self, images: Sequence[Any], prompt: str) -> str:
+        # Полный хеш пикселей дорог и исказил бы замеры накладных расходов
+        parts = [text_hash(prompt)] + [_quick_digest(image) for image in images]
+        key = hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+        return self.responses[int(key[:8], 16) % len(self.responses)]
+
+    def _set_usage(
+        self, num_images: int, prompts: Sequence[str], responses: Sequence[str]
+    ) -> None:
+        self.last_usage = {
+            "prompt_tokens": sum(len(prompt.split()) for prompt in prompts)
+            + self.tokens_per_image * num_images,
+            "completion_tokens": sum(len(response.split()) for response in responses),
+        }
+
+    def _respond(self, images: Sequence[Any], prompt: str) -> str:
+        self._sleep(len(images))
+        response = self._choose(images, prompt)
+        self._set_usage(len(images), [prompt], [response])
+        return response
+
+    def predict_on_batch(self, images: List[Any], prompts: List[str]) -> List[str]:
+        self._sleep(len(images))
+        responses = [
+            self._choose([image], prompt)
+            for image, prompt in zip(images, prompts, strict=True)
+        ]
+        self._set_usage(len(images), prompts, responses)
+        return responses
+
+
+class ReplayModel(_BaseBackend):
+    """Модель, отвечающая по записанному файлу ответов.
+
+    Параметры секции ``model``:
+
+    * ``responses_path`` — файл JSONL, записанный с ``record_path``;
+    * ``replay_latency`` — воспроизводить записанную задержку (по умолчанию нет);
+    * ``on_miss`` — что делать с запросом, которого нет в файле: ``"cycle"``
+      (по умолчанию) — детерминированно выбрать один из записанных ответов,
+      ``"error"`` — бросить ``KeyError``.
+
+    Args:
+        model_config (Dict[str, Any]): Секция ``model`` конфига.
+    """
+
+    def __init__(self, model_config: Dict[str, Any]) -> None:
+        path = Path(model_config["responses_path"])
+        self.records: Dict[str, Dict[str, Any]] = {}
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records[record["key"]] = record
+        if not self.records:
+            raise ValueError(f"В файле ответов нет записей: {path}")
+        self._ordered = list(self.records.values())
+        self.replay_latency = bool(model_config.get("replay_latency", False))
+        self.on_miss = model_config.get("on_miss", "cycle")
+        self.last_usage: Optional[Dict[str, int]] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _respond(self, images: Sequence[Any], prompt: str) -> str:
+        key = request_key(images, prompt)
+        record = self.records.get(key)
+        if record is None:
+            self.misses += 1
+            if self.on_miss == "error":
+                raise KeyError(f"Ответ для запроса {key[:12]} не записан")
+            record = self._ordered[int(key[:8], 16) % len(self._ordered)]
+        else:
+            self.hits += 1
+        if self.replay_latency and record.get("latency"):
+            time.sleep(record["latency"])
+        # Новый объект на каждый вызов — иначе повтор ответа выглядит как «токены не сообщены»
+        self.last_usage = dict(record["usage"]) if record.get("usage") else None
+        return record["response"]
+
+
+class RecordingModel:
+    """Обёртка, записывающая ответы модели для последующего воспроизведения.
+
+    Args:
+        model (Any): Настоящая модель.
+        path (Union[str, Path]): Файл JSONL, в который дописываются ответы.
+    """
+
+    def __init__(self, model: Any, path: Union[str, Path]) -> None:
+        self.model = model
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = self.path.open("a", encoding="utf-8", buffering=1)
+
+    def __getattr__(self, name: str) -> Any:
+        # Остальные атрибуты берём у настоящей модели
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _usage(self, usage_before: Any) -> Optional[Dict[str, Optional[int]]]:
+        usage = getattr(self.model, "last_usage", None)
+        if usage is None or usage is usage_before:
+            return None
+        prompt_tokens, completion_tokens = read_usage(usage)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+    def _record(
+        self,
+        images: Sequence[Any],
+        prompt: str,
+        response: Any,
+        latency: float,
+        usage: Optional[Dict[str, Optional[int]]] = None,
+    ) -> None:
+        if not isinstance(response, str):
+            return
+        record = {
+            "key": request_key(images, prompt),
+            "response": response,
+            "latency": round(latency, 6),
+            "num_images": len(images),
+        }
+        if usage:
+            record["usage"] = usage
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def predict_on_image(self, image: Any, prompt: str) -> Any:
+        usage_before = getattr(self.model, "last_usage", None)
+        started = time.perf_counter()
+        response = self.model.predict_on_image(image=image, prompt=prompt)
+        latency = time.perf_counter() - started
+        self._record([image], prompt, response, latency, self._usage(usage_before))
+        return response
+
+    def predict_on_images(self, images: List[Any], prompt: str) -> Any:
+        usage_before = getattr(self.model, "last_usage", None)
+        started = time.perf_counter()
+        response = self.model.predict_on_images(images=images, prompt=prompt)
+        latency = time.perf_counter() - started
+        self._record(images, prompt, response, latency, self._usage(usage_before))
+        return response
+
+    def predict_on_batch(self, images: List[Any], prompts: List[str]) -> List[Any]:
+        if not callable(getattr(self.model, "predict_on_batch", None)):
+            return [
+                self.predict_on_image(image, prompt)
+                for image, prompt in zip(images, prompts, strict=True)
+            ]
+        usage_before = getattr(self.model, "last_usage", None)
+        started = time.perf_counter()
+        responses = self.model.predict_on_batch(images=images, prompts=prompts)
+        # Задержку и токены батча делим поровну между его элементами
+        latency = (time.perf_counter() - started) / max(len(images), 1)
+        usage = self._usage(usage_before)
+        if usage:
+            usage = {
+                name: None if value is None else round(value / max(len(images), 1))
+                for name, value in usage.items()
+            }
+        for image, prompt, response in zip(images, prompts, responses, strict=False):
+            self._record([image], prompt, response, latency, usage)
+        return responses
+
+    def close(self) -> None:
+        """Закрывает файл записи."""
+        with self._lock:
+            self._file.close()
+
+
+def create_model(model_config: Dict[str, Any]) -> Any:
+    """Создаёт модель по секции ``model`` конфига.
+
+    Args:
+        model_config (Dict[str, Any]): Секция ``model``. Поле ``backend``
+            выбирает бэкенд: не задано — настоящая модель, ``"replay"`` или
+            ``"synthetic"`` — офлайн-бэкенды (см. описание модуля).
+
+    Returns:
+        Any: Объект с методами ``predict_on_image`` и ``predict_on_images``.
+
+    Raises:
+        ValueError: Если бэкенд неизвестен.
+    """
+    backend: Optional[str] = model_config.get("backend")
+    if backend == "replay":
+        model = ReplayModel(model_config)
+    elif backend == "synthetic":
+        model = SyntheticModel(model_config)
+    elif backend is None:
+        # Импорт здесь: офлайн-бэкендам не нужны torch и веса модели
+        from bench_utils.model_utils import initialize_model  # type: ignore
+
+        model = initialize_model(model_config)
+    else:
+        raise ValueError(f"Неизвестный бэкенд модели: {backend}")
+
+    if model_config.get("record_path"):
+        model = RecordingModel(model, model_config["record_path"])
+    return model
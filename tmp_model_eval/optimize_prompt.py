@@ -1,16 +1,21 @@
+import functools
 import json
-import random
+import math
 import re
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-
-import torch  # type: ignore  # нужен для обработки OutOfMemoryError
-from bench_utils.metrics import calculate_classification_metrics  # type: ignore
+from typing import Any, Dict, List, Optional, Tuple
 
 # --- Внутренние пакеты проекта ---
-from bench_utils.model_utils import initialize_model, load_prompt, prepare_prompt  # type: ignore
+from bench_utils.model_utils import load_prompt, prepare_prompt  # type: ignore
 from tqdm import tqdm
 
+from batch_controller import (
+    SCOPE_BATCH,
+    SCOPE_PROMPT_IMAGES,
+    BatchController,
+    resolution_bucket,
+)
+
 # Переиспользуем вспомогательные функции из скрипта классификации
 from check_classifiication import (
     get_image_paths as _collect_image_paths,
@@ -18,17 +23,34 @@ from check_classifiication import (
 from check_classifiication import (
     get_prediction as _predict_single,
 )
+from check_classifiication import get_true_class
+from classification_metrics import ConfusionAccumulator
+from dataset_manifest import DatasetManifest, manifest_from_config
+from image_normalization import ImageNormalizer, normalized_model_config
+from image_prefetch import prefetch_settings
+from model_backends import create_model
+from prediction_cache import PredictionCache, text_hash
+from prompt_leaderboard import Leaderboard
+from prompt_race import DEFAULT_ALPHA, DEFAULT_WORSE_RATE, race_prompts
+from sampling import StratifiedSampler
+from score_store import ScoreStore, sample_fingerprint
 
 # --- Константы ---
 PROMPTS_DIR = Path("prompts")
 PROMPTS_DIR.mkdir(exist_ok=True)
 
-# Максимум картинок, отправляемых модели одномоментно при генерации нового промпта
+# Максимум картинок, отправляемых модели одномоментно при генерации нового промпта;
+# при нехватке памяти число снижается (см. ``batch_controller``)
 MAX_IMAGES_IN_REQUEST = 4
 # Минимальная допустимая длина валидного промпта
 MIN_PROMPT_LENGTH = 30
 # Сколько изображений каждого класса брать для генерации нового промпта
 IMAGES_PER_CLASS = 1
+# Таблица лидеров режима последовательного отсева
+LEADERBOARD_PATH = PROMPTS_DIR / "leaderboard.csv"
+
+# Изображение и его истинный класс
+Item = Tuple[Path, str]
 
 
 # -------------------------------------------------------------
@@ -55,25 +77,76 @@ def extract_prompt_from_output(model_output: str) -> str:
     return cleaned.strip().strip("\"")
 
 
+def render_prompt(prompt_template: str, document_classes: Dict[str, str]) -> str:
+    """Подставляет список классов в шаблон промпта."""
+    classes_str = ", ".join(f"{idx}: {name}" for idx, name in enumerate(document_classes.values()))
+    return prepare_prompt(prompt_template, classes=classes_str)
+
+
+def sample_spec(
+    subsets: List[str], document_classes: Dict[str, str], sampler: StratifiedSampler
+) -> Dict[str, Any]:
+    """Параметры выборки — для ключей оценок и таблицы лидеров."""
+    return {
+        "subsets": list(subsets),
+        "classes": list(document_classes.keys()),
+        "sampling": sampler.spec(),
+    }
+
+
+def dataset_fingerprint(dataset_path: Path, manifest: Optional[DatasetManifest]) -> str:
+    """Отпечаток датасета; без индекса датасет различается только по пути."""
+    if manifest is not None:
+        return manifest.fingerprint()
+    return text_hash(str(dataset_path.resolve()))
+
+
+def collect_items(
+    config: Dict[str, Any],
+    manifest: Optional[DatasetManifest],
+    sampler: StratifiedSampler,
+) -> Dict[str, List[Item]]:
+    """Собирает выборку изображений с истинными классами по сабсетам."""
+    task_cfg = config["task"]
+    dataset_path = Path(task_cfg["dataset_path"])
+    class_names = list(config["document_classes"].keys())
+    items: Dict[str, List[Item]] = {}
+    for subset in task_cfg["subsets"]:
+        paths = _collect_image_paths(
+            dataset_path, class_names, subset, manifest=manifest, sampler=sampler
+        )
+        items[subset] = [(path, get_true_class(path, dataset_path)) for path in paths]
+    return items
+
+
 def sample_images_for_improvement(
     dataset_path: Path,
     document_classes: Dict[str, str],
     subset: str,
     images_per_class: int,
+    manifest: Optional[DatasetManifest] = None,
+    seed: int = 0,
 ) -> List[Path]:
-    """Сэмплирует *images_per_class* изображений для каждого класса."""
-    sampled: List[Path] = []
+    """Сэмплирует *images_per_class* изображений для каждого класса.
+
+    Выборка детерминирована (см. ``sampling``) и задаётся зерном ``seed``.
+    Если передан ``manifest``, списки файлов берутся из индекса датасета.
+    """
+    files: Dict[str, List[Path]] = {}
     for class_name in document_classes.keys():
         class_dir = dataset_path / class_name / "images" / subset
-        if not class_dir.exists():
+        if manifest is not None:
+            if not manifest.is_dir(class_dir):
+                continue
+            all_files: List[Path] = manifest.files(class_dir)
+        elif class_dir.exists():
+            all_files = [p for p in class_dir.iterdir() if p.is_file()]
+        else:
             continue
+        files[class_name] = all_files
 
-        all_files: List[Path] = [p for p in class_dir.iterdir() if p.is_file()]
-        if len(all_files) > images_per_class:
-            sampled.extend(random.sample(all_files, images_per_class))
-        else:
-            sampled.extend(all_files)
-    return sampled
+    sampler = StratifiedSampler(images_per_class, seed=seed)
+    return [path for paths in sampler.sample(files).values() for path in paths]
 
 
 def evaluate_prompt(
@@ -83,14 +156,41 @@ def evaluate_prompt(
     subsets: List[str],
     sample_size: Optional[int],
     prompt_template: str,
+    cache: Optional[PredictionCache] = None,
+    manifest: Optional[DatasetManifest] = None,
+    sampler: Optional[StratifiedSampler] = None,
+    scores: Optional[ScoreStore] = None,
+    normalizer: Optional[ImageNormalizer] = None,
 ) -> float:
-    """Вычисляет accuracy для переданного промпта."""
+    """Вычисляет accuracy для переданного промпта.
+
+    Если передан ``cache``, ответы модели для уже встречавшихся пар
+    (промпт, изображение) берутся из него; ``manifest`` избавляет от
+    повторного обхода датасета при оценке каждого кандидата. ``sampler``
+    задаёт детерминированную выборку вместо первых ``sample_size`` файлов.
+    ``scores`` запоминает оценки между запусками: итоговую accuracy (при
+    неизменных промпте, модели, датасете и выборке; нужен ``manifest``) и
+    предсказания на отдельных изображениях. ``normalizer`` приводит
+    изображения к бюджету пикселей.
+    """
 
-    classes_str = ", ".join(f"{idx}: {name}" for idx, name in enumerate(document_classes.values()))
-    prompt = prepare_prompt(prompt_template, classes=classes_str)
+    prompt = render_prompt(prompt_template, document_classes)
+    if sampler is None:
+        sampler = StratifiedSampler(sample_size)
+
+    score_key = None
+    if scores is not None:
+        score_key = scores.score_key(
+            prompt, manifest, sample_spec(subsets, document_classes, sampler)
+        )
+        stored = scores.get_score(score_key)
+        if stored is not None:
+            print(f"Оценка промпта взята из хранилища ({stored.evaluated} изображений)")
+            return stored.accuracy
 
-    y_true: List[str] = []
-    y_pred: List[str] = []
+    accumulator = ConfusionAccumulator(document_classes.keys())
+    # Итоговую оценку запоминаем, только если все ответы разобраны
+    complete = True
 
     for subset in subsets:
         image_paths = _collect_image_paths(
@@ -98,26 +198,69 @@ def evaluate_prompt(
             list(document_classes.keys()),
             subset,
             sample_size,
+            manifest,
+            sampler,
         )
         for img_path in tqdm(image_paths, desc=f"Eval {subset}"):
-            try:
-                class_name = img_path.relative_to(dataset_path).parts[0]
-            except ValueError:
-                class_name = img_path.parts[-5] if len(img_path.parts) >= 5 else "Unknown"
-
-            y_true.append(class_name)
-            y_pred.append(_predict_single(model, img_path, prompt, document_classes))
-
-    metrics = calculate_classification_metrics(y_true, y_pred, document_classes)
-    return metrics.get("accuracy", 0.0)
+            true_class = get_true_class(img_path, dataset_path)
+            if scores is None:
+                prediction = _predict_single(
+                    model,
+                    img_path,
+                    prompt,
+                    document_classes,
+                    cache=cache,
+                    normalizer=normalizer,
+                )
+            else:
+                item_key = ScoreStore.item_key(img_path, true_class, manifest)
+                prediction = scores.get_prediction(prompt, item_key)
+                if prediction is None:
+                    prediction = _predict_single(
+                        model,
+                        img_path,
+                        prompt,
+                        document_classes,
+                        cache=cache,
+                        normalizer=normalizer,
+                    )
+                    # 'None' может означать временную ошибку — такой ответ не запоминаем
+                    if prediction != "None":
+                        scores.put_prediction(
+                            prompt, item_key, prediction, prediction == true_class
+                        )
+            complete = complete and prediction != "None"
+            accumulator.update(true_class, prediction)
+
+    accuracy = accumulator.accuracy()
+    if scores is not None and complete:
+        scores.put_score(score_key, accuracy, accumulator.total)
+    return accuracy
+
+
+def create_generation_controller(
+    limits_cfg: Optional[Dict[str, Any]], model_cfg: Dict[str, Any]
+) -> BatchController:
+    """Контроллер числа изображений в запросе на генерацию промпта."""
+    return BatchController.from_config(
+        limits_cfg, model_cfg, SCOPE_PROMPT_IMAGES, MAX_IMAGES_IN_REQUEST, min_limit=0
+    )
 
 
 def generate_improved_prompt(
     model: Any,
     images: List[Path],
     current_prompt: str,
+    controller: Optional[BatchController] = None,
+    normalizer: Optional[ImageNormalizer] = None,
 ) -> str:
-    """Запрашивает у модели улучшенную версию текущего промпта."""
+    """Запрашивает у модели улучшенную версию текущего промпта.
+
+    Модели отправляются первые изображения-примеры — столько, сколько
+    помещается в память: при нехватке памяти ``controller`` уменьшает их
+    число вплоть до запроса без изображений и запоминает предел.
+    ``normalizer`` приводит изображения к бюджету пикселей.
+    """
     instruction = (
         "Вы — ассистент, который помогает улучшить системный промпт для "
         "задачи классификации документов. В ответе верните ТОЛЬКО новый текст "
@@ -127,50 +270,50 @@ def generate_improved_prompt(
         f"{current_prompt}\n"
     )
 
-    # Ограничиваем batch, чтобы не словить OOM
-    images_batch = images[:MAX_IMAGES_IN_REQUEST]
-    images_str = [str(p) for p in images_batch]
-
-    try:
-        model_output = model.predict_on_images(images=images_str, prompt=instruction)
-    except torch.cuda.OutOfMemoryError:
-        # Фолбэк: пробуем с одной картинкой, если всё ещё падает — убираем картинки вовсе
-        torch.cuda.empty_cache()
-        try:
-            model_output = model.predict_on_images(images=[images_str[0]], prompt=instruction)
-        except Exception:
-            # Последний фолбэк — вызываем только текстовый prompt без изображений
-            print("⚠️  OOM при генерации промпта, пробуем без изображений…")
-            model_output = model.predict_on_images(images=[], prompt=instruction)
-    except AttributeError:
-        # На случай, если в конкретной реализации название метода иное.
-        model_output = model.predict_on_images(images=images_str, prompt=instruction)  # type: ignore
+    if controller is None:
+        controller = create_generation_controller(None, {})
+    images = images[:MAX_IMAGES_IN_REQUEST]
+    if normalizer is not None:
+        images = [normalizer.prepare(p) for p in images]
+    images_str = [str(p) for p in images]
+    model_output = controller.run_prefix(
+        images_str,
+        lambda batch: model.predict_on_images(images=batch, prompt=instruction),
+        resolution_bucket(images_str),
+    )
 
     return extract_prompt_from_output(model_output)
 
 
-# -------------------------------------------------------------
-# Основной процесс
-# -------------------------------------------------------------
 
-def main() -> None:
-    config_path = Path("config_prompt_optimization.json")
-    if not config_path.exists():
-        msg = (
-            "Файл конфигурации 'config_prompt_optimization.json' не найден. "
-            "Создайте его по образцу 'config_classification.json'."
-        )
-        raise FileNotFoundError(msg)
+def is_valid_candidate(candidate_prompt: str, previous: List[str]) -> bool:
+    """Проверяет, что модель вернула новый промпт достаточной длины."""
+    return (
+        bool(candidate_prompt)
+        and candidate_prompt not in previous
+        and len(candidate_prompt.strip()) >= MIN_PROMPT_LENGTH
+    )
 
-    with config_path.open("r", encoding="utf-8") as f:
-        config: Dict[str, Any] = json.load(f)
 
+def optimize_sequential(
+    model: Any,
+    config: Dict[str, Any],
+    prompt_template: str,
+    cache: Optional[PredictionCache],
+    manifest: Optional[DatasetManifest],
+    sampler: StratifiedSampler,
+    scores: Optional[ScoreStore] = None,
+    generation: Optional[BatchController] = None,
+    normalizer: Optional[ImageNormalizer] = None,
+) -> Tuple[float, float, str]:
+    """Последовательный режим: кандидат за кандидатом, каждый на всей выборке.
+
+    Returns:
+        Tuple[float, float, str]: Базовая accuracy, лучшая accuracy и лучший промпт.
+    """
     task_cfg = config["task"]
-    model_cfg = config["model"]
     optim_cfg = config.get("optimization", {})
-
     dataset_path = Path(task_cfg["dataset_path"])
-    prompt_path = Path(task_cfg["prompt_path"])
     subsets = task_cfg["subsets"]
     sample_size = task_cfg.get("sample_size")
 
@@ -178,27 +321,33 @@ def main() -> None:
     subset_for_improve: str = optim_cfg.get("subset_for_improvement", subsets[0])
     images_per_class: int = IMAGES_PER_CLASS
 
-    # --- Инициализация модели ---
-    model = initialize_model(model_cfg)
-
     # --- Базовый промпт ---
-    current_prompt_template = load_prompt(prompt_path)
     baseline_acc = evaluate_prompt(
         model,
         dataset_path,
         config["document_classes"],
         subsets,
         sample_size,
-        current_prompt_template,
+        prompt_template,
+        cache,
+        manifest,
+        sampler,
+        scores,
+        normalizer,
     )
     print(f"Базовая accuracy: {baseline_acc:.4f}\n")
 
-    best_prompt: str = current_prompt_template
+    best_prompt: str = prompt_template
     best_acc: float = baseline_acc
 
     # --- Оптимизация ---
     images_for_update = sample_images_for_improvement(
-        dataset_path, config["document_classes"], subset_for_improve, images_per_class
+        dataset_path,
+        config["document_classes"],
+        subset_for_improve,
+        images_per_class,
+        manifest,
+        seed=sampler.seed,
     )
     if not images_for_update:
         raise RuntimeError("Не удалось подобрать изображения для улучшения промпта")
@@ -206,14 +355,10 @@ def main() -> None:
     for attempt in range(1, num_attempts + 1):
         print(f"\n➤ Попытка {attempt}/{num_attempts}")
         candidate_prompt = generate_improved_prompt(
-            model, images_for_update, best_prompt
+            model, images_for_update, best_prompt, generation, normalizer
         )
 
-        if (
-            not candidate_prompt
-            or candidate_prompt == best_prompt
-            or len(candidate_prompt.strip()) < MIN_PROMPT_LENGTH
-        ):
+        if not is_valid_candidate(candidate_prompt, [best_prompt]):
             print(
                 "  ⚠️  Модель не вернула валидный промпт (слишком короткий или повтор). Пропускаем."
             )
@@ -226,6 +371,11 @@ def main() -> None:
             subsets,
             sample_size,
             candidate_prompt,
+            cache,
+            manifest,
+            sampler,
+            scores,
+            normalizer,
         )
         print(f"  ➜ Accuracy с новым промптом: {acc:.4f}")
 
@@ -241,6 +391,404 @@ def main() -> None:
         else:
             print("  🔸 Новый промпт не превзошёл лучший результат.")
 
+    return baseline_acc, best_acc, best_prompt
+
+
+def optimize_population(
+    model: Any,
+    config: Dict[str, Any],
+    prompt_template: str,
+    cache: Optional[PredictionCache],
+    manifest: Optional[DatasetManifest],
+    sampler: StratifiedSampler,
+    scores: Optional[ScoreStore] = None,
+    generation: Optional[BatchController] = None,
+    normalizer: Optional[ImageNormalizer] = None,
+) -> Tuple[float, float, str]:
+    """Режим популяции: в каждом раунде ``size`` кандидатов оцениваются забегом.
+
+    Все кандидаты раунда оцениваются одновременно на одних и тех же
+    изображениях (см. ``prompt_race``), проигрывающие снимаются досрочно.
+    Промпт заменяется лучшим из дошедших до конца выборки кандидатов, если
+    тот превзошёл действующий. Общее число кандидатов ограничено
+    ``num_attempts``, как и в последовательном режиме.
+
+    Returns:
+        Tuple[float, float, str]: Базовая accuracy, лучшая accuracy и лучший промпт.
+    """
+    task_cfg = config["task"]
+    optim_cfg = config.get("optimization", {})
+    population_cfg = optim_cfg["population"]
+    document_classes = config["document_classes"]
+    dataset_path = Path(task_cfg["dataset_path"])
+    subsets = task_cfg["subsets"]
+
+    num_attempts: int = int(optim_cfg.get("num_attempts", 5))
+    subset_for_improve: str = optim_cfg.get("subset_for_improvement", subsets[0])
+    population_size = max(1, int(population_cfg.get("size", 4)))
+    controller = BatchController.from_config(
+        task_cfg.get("batch_limits"), config["model"], SCOPE_BATCH
+    )
+    race = functools.partial(
+        race_prompts,
+        batch_size=int(task_cfg.get("batch_size", 1)),
+        cache=cache,
+        prefetch=prefetch_settings(task_cfg.get("prefetch")),
+        alpha=float(population_cfg.get("alpha", DEFAULT_ALPHA)),
+        worse_rate=float(population_cfg.get("worse_rate", DEFAULT_WORSE_RATE)),
+        scores=scores,
+        manifest=manifest,
+        controller=controller,
+        normalizer=normalizer,
+    )
+
+    try:
+        items = [
+            item
+            for subset_items in collect_items(config, manifest, sampler).values()
+            for item in subset_items
+        ]
+
+        # --- Базовый промпт ---
+        incumbent = race(
+            model,
+            [render_prompt(prompt_template, document_classes)],
+            items,
+            document_classes,
+        )[0]
+        baseline_acc = incumbent.accuracy
+        print(f"Базовая accuracy: {baseline_acc:.4f}\n")
+
+        best_prompt: str = prompt_template
+        best_acc: float = baseline_acc
+        evaluated_pairs = full_pairs = 0
+
+        # --- Оптимизация ---
+        num_rounds = math.ceil(num_attempts / population_size)
+        attempt = 0
+        for round_index in range(1, num_rounds + 1):
+            print(f"\n➤ Раунд {round_index}/{num_rounds}")
+            candidates: List[str] = []
+            while len(candidates) < population_size and attempt < num_attempts:
+                attempt += 1
+                # Каждому кандидату — свои примеры изображений, чтобы кандидаты различались
+                images_for_update = sample_images_for_improvement(
+                    dataset_path,
+                    document_classes,
+                    subset_for_improve,
+                    IMAGES_PER_CLASS,
+                    manifest,
+                    seed=sampler.seed + attempt,
+                )
+                candidate_prompt = generate_improved_prompt(
+                    model, images_for_update, best_prompt, generation, normalizer
+                )
+                if not is_valid_candidate(candidate_prompt, [best_prompt, *candidates]):
+                    print(f"  ⚠️  Попытка {attempt}: модель не вернула валидный промпт. Пропускаем.")
+                    continue
+                candidates.append(candidate_prompt)
+            if not candidates:
+                continue
+
+            results = race(
+                model,
+                [render_prompt(candidate, document_classes) for candidate in candidates],
+                items,
+                document_classes,
+                incumbent=incumbent.outcomes,
+            )
+            winner = None
+            for index, (candidate_prompt, result) in enumerate(
+                zip(candidates, results, strict=True), start=1
+            ):
+                out_path = PROMPTS_DIR / f"improved_prompt_round_{round_index}_{index}.txt"
+                out_path.write_text(candidate_prompt, encoding="utf-8")
+                evaluated_pairs += result.evaluated
+                full_pairs += len(items)
+                if result.dropped:
+                    print(
+                        f"  ✖ Кандидат {index}: снят после {result.evaluated}/{len(items)} "
+                        f"изображений (accuracy {result.accuracy:.4f}), промпт: {out_path}"
+                    )
+                    continue
+                print(f"  ➜ Кандидат {index}: accuracy {result.accuracy:.4f}, промпт: {out_path}")
+                if result.accuracy > best_acc and (
+                    winner is None or result.accuracy > winner[1].accuracy
+                ):
+                    winner = (candidate_prompt, result)
+
+            if winner is not None:
+                print("  ✅ Новый промпт лучше предыдущего! Обновляем лучший вариант.")
+                best_prompt, incumbent = winner
+                best_acc = incumbent.accuracy
+            else:
+                print("  🔸 Ни один кандидат не превзошёл лучший результат.")
+
+        if full_pairs:
+            print(
+                f"\nОценено пар (промпт, изображение): {evaluated_pairs} из {full_pairs} "
+                f"({1 - evaluated_pairs / full_pairs:.0%} сэкономлено досрочным выбыванием)"
+            )
+        return baseline_acc, best_acc, best_prompt
+    finally:
+        controller.close()
+
+
+def _item_name(item: Item) -> str:
+    # Имя файла вместе с родительским каталогом: в подпапках документов имена
+    # страниц повторяются, а для плоских сабсетов родитель — сам сабсет
+    path = item[0]
+    return f"{path.parent.name}/{path.name}"
+
+
+def halving_slices(
+    items: Dict[str, List[Item]], min_size: int, eta: int, seed: int
+) -> List[List[Item]]:
+    """Вложенные стратифицированные срезы выборки для ступеней отсева.
+
+    Срез ступени ``r`` содержит по ``min_size * eta**r`` изображений каждого
+    класса в каждом сабсете (выбранных так же, как ``sampling``), последний
+    срез — вся выборка. Каждый срез содержит предыдущий, поэтому на новой
+    ступени оцениваются только добавившиеся изображения.
+
+    Args:
+        items (Dict[str, List[Item]]): Выборка по сабсетам (см. ``collect_items``).
+        min_size (int): Размер первого среза на класс.
+        eta (int): Во сколько раз растёт срез на каждой ступени.
+        seed (int): Зерно выборки.
+
+    Returns:
+        List[List[Item]]: Срезы от меньшего к большему.
+    """
+    total = sum(len(subset_items) for subset_items in items.values())
+    slices: List[List[Item]] = []
+    size = max(1, min_size)
+    while True:
+        sampler = StratifiedSampler(size, seed=seed)
+        chunk: List[Item] = []
+        for subset_items in items.values():
+            by_class: Dict[str, List[Item]] = {}
+            for item in subset_items:
+                by_class.setdefault(item[1], []).append(item)
+            for selected in sampler.sample(by_class, key=_item_name).values():
+                chunk.extend(selected)
+        slices.append(chunk)
+        if len(chunk) >= total:
+            return slices
+        size *= max(2, eta)
+
+
+def optimize_halving(
+    model: Any,
+    config: Dict[str, Any],
+    prompt_template: str,
+    cache: Optional[PredictionCache],
+    manifest: Optional[DatasetManifest],
+    sampler: StratifiedSampler,
+    scores: Optional[ScoreStore] = None,
+    generation: Optional[BatchController] = None,
+    normalizer: Optional[ImageNormalizer] = None,
+) -> Tuple[float, float, str]:
+    """Режим последовательного отсева (successive halving).
+
+    Сначала генерируются ``num_attempts`` кандидатов. Все они оцениваются на
+    маленьком стратифицированном срезе выборки, на следующую ступень проходит
+    лучшая ``1 / eta`` доля, а срез растёт в ``eta`` раз — так до полной
+    выборки или до исчерпания бюджета ``budget`` (число оценённых пар
+    промпт–изображение). Исходный промпт проходит все ступени как эталон и
+    не занимает места кандидатов. После каждой ступени оценки записываются в
+    таблицу лидеров (см. ``prompt_leaderboard``).
+
+    Returns:
+        Tuple[float, float, str]: Accuracy исходного промпта, лучшая accuracy
+        и лучший промпт — на последней пройденной ступени.
+    """
+    task_cfg = config["task"]
+    optim_cfg = config.get("optimization", {})
+    halving_cfg = optim_cfg["halving"]
+    document_classes = config["document_classes"]
+    dataset_path = Path(task_cfg["dataset_path"])
+    model_name = config["model"]["model_name"]
+
+    num_attempts: int = int(optim_cfg.get("num_attempts", 5))
+    subset_for_improve: str = optim_cfg.get("subset_for_improvement", task_cfg["subsets"][0])
+    eta = max(2, int(halving_cfg.get("eta", 2)))
+    budget = halving_cfg.get("budget")
+    leaderboard = Leaderboard(halving_cfg.get("leaderboard_path", LEADERBOARD_PATH))
+    board_key = {
+        "dataset_fingerprint": dataset_fingerprint(dataset_path, manifest),
+        "sample_fingerprint": sample_fingerprint(
+            sample_spec(task_cfg["subsets"], document_classes, sampler)
+        ),
+    }
+    controller = BatchController.from_config(
+        task_cfg.get("batch_limits"), config["model"], SCOPE_BATCH
+    )
+    race = functools.partial(
+        race_prompts,
+        batch_size=int(task_cfg.get("batch_size", 1)),
+        cache=cache,
+        prefetch=prefetch_settings(task_cfg.get("prefetch")),
+        scores=scores,
+        manifest=manifest,
+        controller=controller,
+        normalizer=normalizer,
+    )
+
+    try:
+        # --- Кандидаты ---
+        prompts: List[str] = [prompt_template]
+        for attempt in tqdm(range(1, num_attempts + 1), desc="Генерация кандидатов"):
+            images_for_update = sample_images_for_improvement(
+                dataset_path,
+                document_classes,
+                subset_for_improve,
+                IMAGES_PER_CLASS,
+                manifest,
+                seed=sampler.seed + attempt,
+            )
+            candidate_prompt = generate_improved_prompt(
+                model, images_for_update, prompt_template, generation, normalizer
+            )
+            if is_valid_candidate(candidate_prompt, prompts):
+                prompts.append(candidate_prompt)
+        print(f"Валидных кандидатов: {len(prompts) - 1} из {num_attempts}")
+
+        slices = halving_slices(
+            collect_items(config, manifest, sampler),
+            int(halving_cfg.get("min_sample_size", 1)),
+            eta,
+            sampler.seed,
+        )
+
+        # --- Ступени отсева; промпт 0 — исходный ---
+        outcomes: List[Dict[str, bool]] = [{} for _ in prompts]
+        survivors = list(range(len(prompts)))
+        accuracies: Dict[int, float] = {}
+        spent = 0
+        for rung, rung_items in enumerate(slices):
+            new_items = [item for item in rung_items if str(item[0]) not in outcomes[0]]
+            cost = len(survivors) * len(new_items)
+            if budget is not None and spent + cost > int(budget):
+                print(
+                    f"\n⏹️ Бюджет исчерпан: ступень {rung} требует {cost} оценок, "
+                    f"осталось {int(budget) - spent}"
+                )
+                break
+
+            print(
+                f"\n➤ Ступень {rung}: {len(survivors)} промптов × {len(rung_items)} изображений "
+                f"(новых {len(new_items)})"
+            )
+            results = race(
+                model,
+                [render_prompt(prompts[k], document_classes) for k in survivors],
+                new_items,
+                document_classes,
+            )
+            spent += cost
+
+            keys = [str(path) for path, _ in rung_items]
+            for k, result in zip(survivors, results, strict=True):
+                outcomes[k].update(result.outcomes)
+                correct = sum(outcomes[k][key] for key in keys)
+                accuracies[k] = correct / len(keys) if keys else 0.0
+                leaderboard.update(
+                    prompts[k],
+                    model_name,
+                    correct,
+                    len(keys),
+                    rung,
+                    dataset_fingerprint=board_key["dataset_fingerprint"],
+                    sample_fingerprint=board_key["sample_fingerprint"],
+                )
+            leaderboard.save()
+            print(
+                f"  Исходный промпт: {accuracies[0]:.4f}, "
+                f"лучший кандидат: {max((accuracies[k] for k in survivors[1:]), default=0.0):.4f}"
+            )
+
+            if rung == len(slices) - 1:
+                break
+            # Отбираем лучшую долю кандидатов; при равенстве — более ранний
+            ranked = sorted(survivors[1:], key=lambda k: -accuracies[k])
+            survivors = [0] + ranked[: math.ceil(len(ranked) / eta)]
+
+        print(f"\nОценено пар (промпт, изображение): {spent}")
+        print(f"Таблица лидеров: {leaderboard.path}")
+        print(leaderboard.top(5, model_name, **board_key).to_string(index=False))
+
+        if not accuracies:
+            return 0.0, 0.0, prompt_template
+        best = max(survivors, key=lambda k: accuracies[k])
+        return accuracies[0], accuracies[best], prompts[best]
+    finally:
+        controller.close()
+
+
+# -------------------------------------------------------------
+# Основной процесс
+# -------------------------------------------------------------
+
+def main() -> None:
+    config_path = Path("config_prompt_optimization.json")
+    if not config_path.exists():
+        msg = (
+            "Файл конфигурации 'config_prompt_optimization.json' не найден. "
+            "Создайте его по образцу 'config_classification.json'."
+        )
+        raise FileNotFoundError(msg)
+
+    with config_path.open("r", encoding="utf-8") as f:
+        config: Dict[str, Any] = json.load(f)
+
+    task_cfg = config["task"]
+    model_cfg = config["model"]
+    optim_cfg = config.get("optimization", {})
+
+    dataset_path = Path(task_cfg["dataset_path"])
+    prompt_path = Path(task_cfg["prompt_path"])
+
+    # --- Инициализация модели ---
+    model = create_model(model_cfg)
+    normalizer = ImageNormalizer.from_config(task_cfg.get("image_normalization"))
+    # Ответы на нормализованных изображениях не смешиваем с ответами на исходных
+    cache_model_cfg = normalized_model_config(model_cfg, normalizer)
+    cache = PredictionCache.from_config(task_cfg.get("prediction_cache"), cache_model_cfg)
+    manifest = manifest_from_config(dataset_path, task_cfg.get("manifest"))
+    sampler = StratifiedSampler.from_config(task_cfg)
+    scores = ScoreStore.from_config(task_cfg.get("score_store"), cache_model_cfg)
+    generation = create_generation_controller(task_cfg.get("batch_limits"), model_cfg)
+
+    current_prompt_template = load_prompt(prompt_path)
+    if optim_cfg.get("halving"):
+        optimize = optimize_halving
+    elif optim_cfg.get("population"):
+        optimize = optimize_population
+    else:
+        optimize = optimize_sequential
+    baseline_acc, best_acc, best_prompt = optimize(
+        model,
+        config,
+        current_prompt_template,
+        cache,
+        manifest,
+        sampler,
+        scores,
+        generation,
+        normalizer,
+    )
+    generation.close()
+    if normalizer is not None:
+        print(normalizer.stats())
+
+    if cache is not None:
+        print(cache.stats())
+        cache.close()
+    if scores is not None:
+        print(scores.stats())
+        scores.close()
+
     # --- Финальное решение ---
     if best_acc > baseline_acc:
         print(
@@ -254,4 +802,4 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
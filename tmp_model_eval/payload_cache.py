@@ -0,0 +1,225 @@
+"""Кеш изображений, закодированных в base64 для запросов к серверу.
+
+Одни и те же сканы отправляются повторно (варианты промптов, перезапуски),
+а чтение и base64-кодирование файлов в несколько мегабайт заметно нагружает
+клиент. ``PayloadCache`` хранит готовые base64-строки в памяти (LRU с
+ограничением по размеру) с ключом (путь, mtime, размер файла, параметры
+уменьшения), поэтому изменённый файл автоматически кодируется заново.
+
+Опционально изображение перед кодированием уменьшается до бюджета
+``max_pixels`` с сохранением пропорций: сервер всё равно сжимает большие
+сканы под разрешение модели, а запрос становится в разы меньше. Уменьшенные
+JPEG дополнительно сохраняются на диск (``cache_dir``), чтобы не
+пересжимать их при следующих запусках. Исходные файлы на диск не
+копируются — прочитать оригинал не дороже, чем копию из кеша.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Union
+
+from PIL import Image
+
+from image_normalization import normalize_image
+
+DEFAULT_MAX_MEMORY_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_JPEG_QUALITY = 90
+
+# После вытеснения заполняем кеш не до предела, чтобы не вытеснять на каждой записи
+_EVICTION_TARGET = 0.9
+
+
+def downscale_jpeg(data: bytes, max_pixels: int, quality: int = DEFAULT_JPEG_QUALITY) -> bytes:
+    """Уменьшает изображение до ``max_pixels`` пикселей с сохранением пропорций.
+
+    Args:
+        data (bytes): Содержимое файла изображения.
+        max_pixels (int): Максимальное число пикселей (ширина × высота).
+        quality (int): Качество JPEG при повторном кодировании.
+
+    Returns:
+        bytes: JPEG уменьшенного изображения или исходные байты, если
+        изображение уже укладывается в бюджет.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width * image.height <= max_pixels:
+            return data
+        resized = normalize_image(image, max_pixels, grayscale=image.mode == "L")
+
+    buffer = io.BytesIO()
+    resized.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class PayloadCache:
+    """Кеш base64-представлений изображений.
+
+    Методы потокобезопасны: кеш используется из потоков предзагрузки.
+
+    Args:
+        cache_dir (Optional[Union[str, Path]]): Каталог дискового кеша
+            уменьшенных изображений. None — только кеш в памяти.
+        max_memory_bytes (int): Ограничение на суммарный размер base64-строк
+            в памяти.
+        max_disk_bytes (int): Ограничение на размер дискового кеша.
+        max_pixels (Optional[int]): Бюджет пикселей; None — изображения
+            отправляются без изменений.
+        jpeg_quality (int): Качество JPEG для уменьшенных изображений.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Union[str, Path]] = None,
+        max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES,
+        max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+        max_pixels: Optional[int] = None,
+        jpeg_quality: int = DEFAULT_JPEG_QUALITY,
+    ) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_pixels = max_pixels
+        self.jpeg_quality = jpeg_quality
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.source_bytes = 0
+        self.encoded_bytes = 0
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(p.stat().st_size for p in self.cache_dir.glob("*.jpg"))
+
+    def make_key(self, image_path: Union[str, Path]) -> str:
+        """Формирует ключ по пути, mtime и размеру файла и параметрам уменьшения."""
+        stat = os.stat(image_path)
+        parts = (
+            str(Path(image_path).resolve()),
+            str(stat.st_mtime_ns),
+            str(stat.st_size),
+            str(self.max_pixels),
+            str(self.jpeg_quality),
+        )
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, image_path: Union[str, Path]) -> str:
+        """Возвращает base64-представление изображения, при необходимости кодируя его.
+
+        Args:
+            image_path (Union[str, Path]): Путь к изображению.
+
+        Returns:
+            str: Содержимое изображения (возможно, уменьшенного) в base64.
+        """
+        key = self.make_key(image_path)
+        with self._lock:
+            encoded = self._memory.get(key)
+            if encoded is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return encoded
+
+        data = self._read_disk(key)
+        if data is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            with open(image_path, "rb") as f:
+                source = f.read()
+            data = source
+            if self.max_pixels:
+                data = downscale_jpeg(source, self.max_pixels, self.jpeg_quality)
+                if data is not source:
+                    self._write_disk(key, data)
+            with self._lock:
+                self.misses += 1
+                self.source_bytes += len(source)
+                self.encoded_bytes += len(data)
+
+        encoded = base64.b64encode(data).decode("utf-8")
+        self._remember(key, encoded)
+        return encoded
+
+    def _remember(self, key: str, encoded: str) -> None:
+        """Кладёт строку в кеш в памяти и вытесняет самые старые записи."""
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = encoded
+            self._memory_bytes += len(encoded)
+            if self._memory_bytes > self.max_memory_bytes:
+                target = int(self.max_memory_bytes * _EVICTION_TARGET)
+                while self._memory and self._memory_bytes > target:
+                    _, evicted = self._memory.popitem(last=False)
+                    self._memory_bytes -= len(evicted)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if self.cache_dir is None:
+            return None
+        path = self.cache_dir / f"{key}.jpg"
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        # mtime служит меткой последнего использования для вытеснения
+        os.utime(path)
+        return data
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        if self.cache_dir is None:
+            return
+        path = self.cache_dir / f"{key}.jpg"
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        with self._lock:
+            # Перезапись ключа (например, другим потоком) заменяет старый файл
+            try:
+                previous = path.stat().st_size
+            except FileNotFoundError:
+                previous = 0
+            os.replace(tmp_path, path)
+            self._disk_bytes += len(data) - previous
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """Удаляет самые давно использованные файлы до целевого размера."""
+        target = int(self.max_disk_bytes * _EVICTION_TARGET)
+        entries = []
+        for path in self.cache_dir.glob("*.jpg"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        self._disk_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if self._disk_bytes <= target:
+                break
+            path.unlink(missing_ok=True)
+            self._disk_bytes -= size
+
+    def stats(self) -> str:
+        """Возвращает строку со статистикой кеша и экономии трафика."""
+        total = self.memory_hits + self.disk_hits + self.misses
+        hit_rate = (self.memory_hits + self.disk_hits) / total if total else 0.0
+        line = (
+            f"Кеш изображений: из памяти {self.memory_hits}, с диска {self.disk_hits}, "
+            f"закодировано {self.misses} ({hit_rate:.1%} попаданий)"
+        )
+        if self.max_pixels and self.source_bytes:
+            line += (
+                f"; уменьшение до {self.max_pixels} пикс.: "
+                f"{self.source_bytes / 1024 / 1024:.1f} МБ -> "
+                f"{self.encoded_bytes / 1024 / 1024:.1f} МБ"
+            )
+        return line
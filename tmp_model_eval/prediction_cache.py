@@ -0,0 +1,226 @@
+"""Дисковый кеш ответов модели.
+
+Ответ модели однозначно определяется моделью (имя + конфигурация),
+промптом и содержимым изображения, поэтому повторные прогоны (перезапуск
+после падения, повторная оценка базового промпта в ``optimize_prompt``)
+могут брать ответы из кеша, не вызывая модель.
+
+Кеш хранится в одном файле SQLite. Ключ — sha256 от хеша конфигурации
+модели, хеша промпта и хеша содержимого изображения. В кеше лежит сырой
+ответ модели, поэтому изменения в разборе ответа применяются и к
+закешированным записям. При превышении ``max_bytes`` вытесняются давно
+не использовавшиеся записи (LRU).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Union
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# Параметры размещения модели не влияют на её ответы и не входят в ключ кеша
+_RUNTIME_MODEL_KEYS = {"device_map", "cache_dir"}
+
+# После вытеснения заполняем кеш не до предела, чтобы не вытеснять на каждой записи
+_EVICTION_TARGET = 0.9
+
+
+class CachedPrediction(NamedTuple):
+    """Ответ модели, найденный в кеше (используется вместо изображения)."""
+
+    response: str
+
+
+def model_fingerprint(model_config: Dict[str, Any]) -> str:
+    """Вычисляет хеш конфигурации модели.
+
+    Args:
+        model_config (Dict[str, Any]): Секция ``model`` конфига.
+
+    Returns:
+        str: sha256 канонического JSON-представления конфигурации
+        (без ``device_map`` и ``cache_dir``).
+    """
+    relevant = {k: v for k, v in model_config.items() if k not in _RUNTIME_MODEL_KEYS}
+    canonical = json.dumps(relevant, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def text_hash(text: str) -> str:
+    """Возвращает sha256 строки (например, отрендеренного промпта)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=65536)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    """Вычисляет sha256 содержимого файла.
+
+    Результат запоминается по (путь, mtime, размер), поэтому повторные
+    запросы для неизменившегося файла не перечитывают его.
+
+    Args:
+        path (Union[str, Path]): Путь к файлу.
+
+    Returns:
+        str: Шестнадцатеричный sha256 содержимого.
+    """
+    stat = os.stat(path)
+    return _file_digest(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+class PredictionCache:
+    """Кеш ответов модели в файле SQLite с LRU-вытеснением по размеру.
+
+    Методы потокобезопасны: кеш можно опрашивать из потоков предзагрузки.
+
+    Args:
+        path (Union[str, Path]): Путь к файлу кеша (создаётся при отсутствии).
+        model_key (str): Хеш модели и её конфигурации (см. ``model_fingerprint``).
+        max_bytes (int): Ограничение на суммарный размер записей.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        model_key: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.model_key = model_key
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS predictions_last_access ON predictions(last_access)"
+        )
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM predictions").fetchone()
+        self._total_bytes = int(row[0])
+
+    @classmethod
+    def from_config(
+        cls, config: Optional[Dict[str, Any]], model_config: Dict[str, Any]
+    ) -> Optional["PredictionCache"]:
+        """Создаёт кеш по секции ``prediction_cache`` конфига.
+
+        Args:
+            config (Optional[Dict[str, Any]]): Секция с полями ``path`` и
+                ``max_bytes`` или None.
+            model_config (Dict[str, Any]): Секция ``model`` конфига.
+
+        Returns:
+            Optional[PredictionCache]: Кеш или None, если секция не задана.
+        """
+        if not config or not config.get("path"):
+            return None
+        return cls(
+            config["path"],
+            model_fingerprint(model_config),
+            int(config.get("max_bytes", DEFAULT_MAX_BYTES)),
+        )
+
+    def make_key(self, prompt: str, image_path: Union[str, Path]) -> str:
+        """Формирует ключ записи для пары (промпт, изображение)."""
+        parts = (self.model_key, text_hash(prompt), file_digest(image_path))
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, prompt: str, image_path: Union[str, Path]) -> Optional[str]:
+        """Возвращает закешированный ответ модели или None.
+
+        Args:
+            prompt (str): Отрендеренный промпт.
+            image_path (Union[str, Path]): Путь к изображению.
+
+        Returns:
+            Optional[str]: Сырой ответ модели, если он есть в кеше.
+        """
+        key = self.make_key(prompt, image_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE predictions SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, prompt: str, image_path: Union[str, Path], response: str) -> None:
+        """Сохраняет ответ модели и при необходимости вытесняет старые записи.
+
+        Args:
+            prompt (str): Отрендеренный промпт.
+            image_path (Union[str, Path]): Путь к изображению.
+            response (str): Сырой ответ модели.
+        """
+        key = self.make_key(prompt, image_path)
+        size = len(key) + len(response.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, response, size, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Удаляет самые давно использованные записи до целевого размера."""
+        target = int(self.max_bytes * _EVICTION_TARGET)
+        cursor = self._conn.execute(
+            "SELECT key, size FROM predictions ORDER BY last_access ASC"
+        )
+        to_delete = []
+        for key, size in cursor:
+            if self._total_bytes <= target:
+                break
+            to_delete.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM predictions WHERE key = ?", to_delete)
+
+    def stats(self) -> str:
+        """Возвращает строку со статистикой попаданий в кеш."""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return (
+            f"Кеш предсказаний: попаданий {self.hits}, промахов {self.misses} "
+            f"({hit_rate:.1%}), размер {self._total_bytes / 1024 / 1024:.1f} МБ"
+        )
+
+    def close(self) -> None:
+        """Закрывает соединение с файлом кеша."""
+        with self._lock:
+            self._conn.close()
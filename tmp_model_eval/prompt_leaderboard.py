@@ -0,0 +1,185 @@
+"""Таблица лидеров промптов, сохраняемая между запусками оптимизации.
+
+Для каждого сочетания промпта, модели, датасета и выборки хранится самая
+полная оценка: на скольких изображениях промпт проверен, сколько ответов верны, accuracy и её
+доверительный интервал Уилсона. Интервал важен для поиска по многим
+кандидатам: промпт, оценённый на 8 изображениях со 100 % точности, не
+обязательно лучше промпта с 92 % на 200 изображениях.
+
+Тексты промптов лежат рядом с таблицей в ``prompt_<hash>.txt``, поэтому
+лучший вариант любого прошлого запуска можно достать по хешу.
+"""
+
+import math
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import pandas as pd
+
+from prediction_cache import text_hash
+
+COLUMNS = [
+    "prompt_hash",
+    "model_name",
+    "dataset_fingerprint",
+    "sample_fingerprint",
+    "evaluated",
+    "correct",
+    "accuracy",
+    "ci_low",
+    "ci_high",
+    "rung",
+    "updated",
+]
+
+# Поля, по которым строки таблицы считаются оценкой одного и того же
+KEY_COLUMNS = ["prompt_hash", "model_name", "dataset_fingerprint", "sample_fingerprint"]
+
+# z-оценка для 95 % доверительного интервала
+DEFAULT_Z = 1.96
+
+
+def wilson_interval(correct: int, total: int, z: float = DEFAULT_Z) -> Tuple[float, float]:
+    """Доверительный интервал Уилсона для доли верных ответов.
+
+    Args:
+        correct (int): Число верных ответов.
+        total (int): Число оценённых изображений.
+        z (float): z-оценка уровня доверия.
+
+    Returns:
+        Tuple[float, float]: Нижняя и верхняя граница (``(0, 1)`` при ``total`` = 0).
+    """
+    if total <= 0:
+        return 0.0, 1.0
+    p = correct / total
+    denominator = 1 + z**2 / total
+    center = (p + z**2 / (2 * total)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / total + z**2 / (4 * total**2)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def prompt_hash(prompt: str) -> str:
+    """Короткий хеш шаблона промпта — его идентификатор в таблице."""
+    return text_hash(prompt)[:12]
+
+
+class Leaderboard:
+    """Таблица лидеров в CSV-файле.
+
+    Args:
+        path (Union[str, Path]): Файл таблицы; создаётся при первом сохранении.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        if self.path.exists():
+            frame = pd.read_csv(self.path, dtype={column: str for column in KEY_COLUMNS})
+            # В таблицах прежнего формата нет отпечатков датасета и выборки
+            frame = frame.reindex(columns=COLUMNS)
+            frame[KEY_COLUMNS] = frame[KEY_COLUMNS].fillna("")
+            self.frame = frame
+        else:
+            self.frame = pd.DataFrame(columns=COLUMNS)
+
+    def prompt_path(self, prompt: str) -> Path:
+        """Файл с текстом промпта рядом с таблицей."""
+        return self.path.parent / f"prompt_{prompt_hash(prompt)}.txt"
+
+    def update(
+        self,
+        prompt: str,
+        model_name: str,
+        correct: int,
+        evaluated: int,
+        rung: Optional[int] = None,
+        dataset_fingerprint: str = "",
+        sample_fingerprint: str = "",
+    ) -> str:
+        """Записывает оценку промпта для модели.
+
+        Прежняя оценка того же промпта на той же модели, датасете и выборке
+        заменяется, если новая сделана не на меньшем числе изображений:
+        короткий прогон не затирает результат полного.
+
+        Args:
+            prompt (str): Шаблон промпта.
+            model_name (str): Имя модели.
+            correct (int): Число верных ответов.
+            evaluated (int): Число оценённых изображений.
+            rung (Optional[int]): Ступень отбора, до которой дошёл промпт.
+            dataset_fingerprint (str): Отпечаток датасета
+                (``DatasetManifest.fingerprint``).
+            sample_fingerprint (str): Отпечаток параметров выборки
+                (``score_store.sample_fingerprint``).
+
+        Returns:
+            str: Хеш промпта.
+        """
+        key = prompt_hash(prompt)
+        same = (
+            (self.frame["prompt_hash"] == key)
+            & (self.frame["model_name"] == model_name)
+            & (self.frame["dataset_fingerprint"] == dataset_fingerprint)
+            & (self.frame["sample_fingerprint"] == sample_fingerprint)
+        )
+        if (self.frame.loc[same, "evaluated"] > evaluated).any():
+            return key
+
+        prompt_file = self.prompt_path(prompt)
+        if not prompt_file.exists():
+            prompt_file.parent.mkdir(parents=True, exist_ok=True)
+            prompt_file.write_text(prompt, encoding="utf-8")
+
+        ci_low, ci_high = wilson_interval(correct, evaluated)
+        row = {
+            "prompt_hash": key,
+            "model_name": model_name,
+            "dataset_fingerprint": dataset_fingerprint,
+            "sample_fingerprint": sample_fingerprint,
+            "evaluated": evaluated,
+            "correct": correct,
+            "accuracy": round(correct / evaluated, 4) if evaluated else 0.0,
+            "ci_low": round(ci_low, 4),
+            "ci_high": round(ci_high, 4),
+            "rung": rung,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+        }
+        rows = self.frame[~same].to_dict("records") + [row]
+        self.frame = pd.DataFrame(rows, columns=COLUMNS)
+        return key
+
+    def save(self) -> Path:
+        """Сохраняет таблицу, отсортированную по нижней границе интервала."""
+        self.frame = self.frame.sort_values(
+            ["ci_low", "accuracy"], ascending=False, ignore_index=True
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self.frame.to_csv(tmp_path, index=False)
+        tmp_path.replace(self.path)
+        return self.path
+
+    def top(
+        self,
+        n: int = 10,
+        model_name: Optional[str] = None,
+        dataset_fingerprint: Optional[str] = None,
+        sample_fingerprint: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Лучшие ``n`` промптов (по нижней границе интервала).
+
+        Заданные ``model_name`` и отпечатки ограничивают таблицу строками
+        с теми же значениями.
+        """
+        frame = self.frame
+        filters = {
+            "model_name": model_name,
+            "dataset_fingerprint": dataset_fingerprint,
+            "sample_fingerprint": sample_fingerprint,
+        }
+        for column, value in filters.items():
+            if value is not None:
+                frame = frame[frame[column] == value]
+        return frame.sort_values(["ci_low", "accuracy"], ascending=False).head(n)
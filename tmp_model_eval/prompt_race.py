@@ -0,0 +1,273 @@
+"""Одновременная оценка нескольких промптов на одном потоке изображений.
+
+Вместо последовательных полных прогонов ``evaluate_prompt`` для каждого
+кандидата все промпты оцениваются вперемешку: каждое изображение читается
+один раз, а пары (изображение, промпт) для всех ещё участвующих промптов
+уходят в модель одним батчевым вызовом ``predict_on_batch``. Запросы с одним
+изображением и разными промптами идут подряд, поэтому бэкенды с кешем
+префиксов (vLLM и т. п.) переиспользуют кодирование изображения.
+
+Если передано хранилище оценок (``score_store``), предсказания, уже
+сделанные в прошлых запусках, берутся из него, и модель для них не
+вызывается.
+
+Кандидат выбывает досрочно, как только последовательный тест уверенно
+показывает, что он хуже действующего промпта на тех же изображениях.
+Тест — SPRT по несовпадающим парам: на изображениях, где ровно один из двух
+промптов ответил верно, при равном качестве кандидат выигрывает с
+вероятностью 1/2, а у заметно худшего — с вероятностью ``worse_rate``.
+Кандидат снимается, когда отношение правдоподобий превышает ``1 / alpha``;
+по неравенству Вилля вероятность снять кандидата, который не хуже
+действующего, не больше ``alpha`` при любом числе проверок.
+"""
+
+import math
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from tqdm import tqdm
+
+from batch_controller import BatchController
+from batch_inference import iter_batches, predict_batch_timed
+from check_classifiication import load_image_safe, parse_prediction
+from classification_metrics import ConfusionAccumulator
+from dataset_manifest import DatasetManifest
+from image_normalization import ImageNormalizer
+from image_prefetch import PrefetchSettings, Prefetcher, accepts_images, prefetch_settings
+from prediction_cache import PredictionCache
+from score_store import ScoreStore
+from stage_timer import span, timed_iter
+
+DEFAULT_ALPHA = 0.05
+DEFAULT_WORSE_RATE = 0.3
+
+
+class _Loaded(NamedTuple):
+    """Всё, что известно об изображении до вызова модели."""
+
+    # Ключ изображения в хранилище оценок (None — хранилище не задано)
+    item_key: Optional[str]
+    # Предсказания из хранилища оценок по номерам промптов
+    known: Dict[int, str]
+    # Сырые ответы из кеша по номерам промптов
+    cached: Dict[int, str]
+    # Изображение (None — не понадобилось или не загрузилось)
+    image: Optional[Any]
+
+
+class SequentialSignTest:
+    """Односторонний SPRT «кандидат хуже действующего промпта».
+
+    Args:
+        alpha (float): Допустимая вероятность снять кандидата, который не
+            хуже действующего.
+        worse_rate (float): Доля выигранных кандидатом несовпадающих пар,
+            при которой он считается заметно худшим (меньше 0.5).
+    """
+
+    def __init__(
+        self, alpha: float = DEFAULT_ALPHA, worse_rate: float = DEFAULT_WORSE_RATE
+    ) -> None:
+        if not 0 < worse_rate < 0.5:
+            raise ValueError(f"worse_rate должен быть в интервале (0, 0.5), получено {worse_rate}")
+        self.threshold = math.log(1 / alpha)
+        self._win_step = math.log(worse_rate / 0.5)
+        self._loss_step = math.log((1 - worse_rate) / 0.5)
+        self.llr = 0.0
+        self.wins = 0
+        self.losses = 0
+
+    def update(self, candidate_correct: bool, incumbent_correct: bool) -> bool:
+        """Учитывает пару ответов на одном изображении.
+
+        Returns:
+            bool: True, если кандидат уже уверенно хуже.
+        """
+        if candidate_correct != incumbent_correct:
+            if candidate_correct:
+                self.wins += 1
+                self.llr += self._win_step
+            else:
+                self.losses += 1
+                self.llr += self._loss_step
+        return self.worse
+
+    @property
+    def worse(self) -> bool:
+        return self.llr >= self.threshold
+
+
+class RaceResult(NamedTuple):
+    """Итог оценки промпта в забеге."""
+
+    prompt: str
+    accuracy: float
+    # Число изображений, на которых промпт был оценён
+    evaluated: int
+    # Снят ли промпт досрочно
+    dropped: bool
+    # Верен ли ответ на каждом оценённом изображении (ключ — путь)
+    outcomes: Dict[str, bool]
+
+
+def _load_for_race(
+    path: Path,
+    label: str,
+    prompts: Sequence[str],
+    cache: Optional[PredictionCache],
+    scores: Optional[ScoreStore],
+    manifest: Optional[DatasetManifest],
+    normalizer: Optional[ImageNormalizer] = None,
+    decode: bool = False,
+) -> _Loaded:
+    """Ищет ответы для всех промптов в хранилище и кеше.
+
+    Вход модели (см. ``load_image_safe``) готовится, только если хотя бы
+    для одного промпта ответа нет.
+    """
+    item_key = None
+    known: Dict[int, str] = {}
+    cached: Dict[int, str] = {}
+    try:
+        with span("cache_lookup"):
+            if scores is not None:
+                item_key = ScoreStore.item_key(path, label, manifest)
+                for k, prompt in enumerate(prompts):
+                    prediction = scores.get_prediction(prompt, item_key)
+                    if prediction is not None:
+                        known[k] = prediction
+            if cache is not None:
+                for k, prompt in enumerate(prompts):
+                    if k in known:
+                        continue
+                    response = cache.get(prompt, path)
+                    if response is not None:
+                        cached[k] = response
+    except OSError as e:
+        print(f"Ошибка при чтении файла {path.name}: {e}")
+        return _Loaded(item_key, known, cached, None)
+    if len(known) + len(cached) == len(prompts):
+        return _Loaded(item_key, known, cached, None)
+    return _Loaded(item_key, known, cached, load_image_safe(path, normalizer, decode))
+
+
+def race_prompts(
+    model: Any,
+    prompts: Sequence[str],
+    items: Sequence[Tuple[Path, str]],
+    document_classes: Dict[str, str],
+    incumbent: Optional[Dict[str, bool]] = None,
+    batch_size: int = 1,
+    cache: Optional[PredictionCache] = None,
+    prefetch: Optional[PrefetchSettings] = None,
+    alpha: float = DEFAULT_ALPHA,
+    worse_rate: float = DEFAULT_WORSE_RATE,
+    scores: Optional[ScoreStore] = None,
+    manifest: Optional[DatasetManifest] = None,
+    controller: Optional[BatchController] = None,
+    normalizer: Optional[ImageNormalizer] = None,
+) -> List[RaceResult]:
+    """Оценивает несколько промптов на одних и тех же изображениях.
+
+    Args:
+        model (Any): Инициализированный объект модели.
+        prompts (Sequence[str]): Отрендеренные промпты.
+        items (Sequence[Tuple[Path, str]]): Изображения и их истинные классы.
+        document_classes (Dict[str, str]): Словарь классов документов.
+        incumbent (Optional[Dict[str, bool]]): ``outcomes`` действующего
+            промпта на тех же изображениях. Если не задан, досрочного
+            выбывания нет.
+        batch_size (int): Сколько изображений обрабатывать за шаг; в один
+            вызов модели уходит ``batch_size`` × число участвующих промптов пар.
+        cache (Optional[PredictionCache]): Кеш ответов модели.
+        prefetch (Optional[PrefetchSettings]): Аргументы ``Prefetcher``
+            (см. ``image_prefetch.prefetch_settings``).
+        alpha (float): Уровень значимости теста выбывания.
+        worse_rate (float): Эффект, на который настроен тест (см. ``SequentialSignTest``).
+        scores (Optional[ScoreStore]): Хранилище оценок: известные предсказания
+            берутся из него, новые (кроме 'None') в него записываются.
+        manifest (Optional[DatasetManifest]): Индекс датасета — источник
+            хешей файлов для ключей хранилища.
+        controller (Optional[BatchController]): Контроллер размера вызова:
+            делит пары шага на части, если все вместе не помещаются в память.
+        normalizer (Optional[ImageNormalizer]): Нормализация изображений.
+
+    Returns:
+        List[RaceResult]: Итоги в порядке ``prompts``. У выбывших промптов
+        точность посчитана по оценённой части изображений.
+    """
+    labels = {str(path): label for path, label in items}
+    accumulators = [ConfusionAccumulator(document_classes.keys()) for _ in prompts]
+    outcomes: List[Dict[str, bool]] = [{} for _ in prompts]
+    tests = [SequentialSignTest(alpha, worse_rate) for _ in prompts]
+    dropped = [False] * len(prompts)
+
+    decode = accepts_images(model)
+    prefetcher: Prefetcher[Path] = Prefetcher(
+        lambda path: _load_for_race(
+            path, labels[str(path)], prompts, cache, scores, manifest, normalizer, decode
+        ),
+        **(prefetch or prefetch_settings(None)),
+    )
+    paths = [path for path, _ in items]
+    progress = tqdm(total=len(paths), desc=f"Забег {len(prompts)} промптов")
+    for batch in timed_iter(iter_batches(prefetcher.iterate(paths), batch_size), "wait_input"):
+        active = [k for k in range(len(prompts)) if not dropped[k]]
+        if not active:
+            break
+
+        responses: Dict[Tuple[int, int], Optional[str]] = {}
+        pairs: List[Tuple[int, int]] = []
+        for i, (_, loaded) in enumerate(batch):
+            for k in active:
+                if k in loaded.known:
+                    continue
+                if k in loaded.cached:
+                    responses[i, k] = loaded.cached[k]
+                elif loaded.image is not None:
+                    pairs.append((i, k))
+
+        # Пары одного изображения идут подряд: все промпты для него в одном вызове
+        with span("model"):
+            results, _ = predict_batch_timed(
+                model,
+                [batch[i][1].image for i, _ in pairs],
+                [prompts[k] for _, k in pairs],
+                controller,
+            )
+        for (i, k), result in zip(pairs, results, strict=True):
+            responses[i, k] = result
+            if cache is not None and isinstance(result, str):
+                cache.put(prompts[k], batch[i][0], result)
+
+        with span("parse_response"):
+            for i, (path, loaded) in enumerate(batch):
+                item = str(path)
+                for k in active:
+                    known = loaded.known.get(k)
+                    if known is not None:
+                        prediction = known
+                    else:
+                        prediction = parse_prediction(responses.get((i, k)), document_classes)
+                    correct = prediction == labels[item]
+                    # 'None' может означать временную ошибку — такой ответ не запоминаем
+                    if scores is not None and known is None and prediction != "None":
+                        scores.put_prediction(prompts[k], loaded.item_key, prediction, correct)
+                    accumulators[k].update(labels[item], prediction)
+                    outcomes[k][item] = correct
+                    if incumbent is not None and item in incumbent and not dropped[k]:
+                        dropped[k] = tests[k].update(correct, incumbent[item])
+        progress.update(len(batch))
+        progress.set_postfix(active=sum(not d for d in dropped))
+    progress.close()
+
+    return [
+        RaceResult(
+            prompt=prompt,
+            accuracy=accumulators[k].accuracy(),
+            evaluated=accumulators[k].total,
+            dropped=dropped[k],
+            outcomes=outcomes[k],
+        )
+        for k, prompt in enumerate(prompts)
+    ]
@@ -67,6 +67,8 @@ def build_report(config_path: Path, output_path: Path) -> None:
         f"* **Subsets:** {', '.join(task_cfg.get('subsets', []))}")
     if task_cfg.get("sample_size"):
         md_lines.append(f"* **Sample size:** {task_cfg['sample_size']}")
+    if task_cfg.get("sampling"):
+        md_lines.append(f"* **Выборка:** `{task_cfg['sampling']}`")
 
     # --- Параметры модели ---
     _append_md_section(md_lines, "Параметры модели")
@@ -133,6 +135,32 @@ def build_report(config_path: Path, output_path: Path) -> None:
             row = _metrics_row_to_md(metrics)
             md_lines.append(f"| {subset} {row[1:]}")  # удаляем первый символ '|' у row
 
+    # --- Стоимость инференса ---
+    inference_stats_file = Path(f"{run_id}_inference_stats.csv")
+    if inference_stats_file.exists():
+        stats_df = pd.read_csv(inference_stats_file, index_col="subset")
+        columns = {
+            "predictions": "Предсказаний",
+            "cached": "Из кеша",
+            "requests_per_s": "Запросов/с",
+            "images_per_s": "Изображений/с",
+            "mean_images_per_request": "Изображений в запросе",
+            "latency_p50_s": "p50, с",
+            "latency_p95_s": "p95, с",
+            "latency_p99_s": "p99, с",
+            "completion_tokens_per_s": "Токенов ответа/с",
+            "retries": "Повторов",
+        }
+        # Столбцы, которые бэкенд не заполнил (например, токены), не показываем
+        shown = [c for c in columns if c in stats_df and stats_df[c].notna().any()]
+        stats_df = stats_df[shown]
+        _append_md_section(md_lines, "Стоимость инференса")
+        md_lines.append(
+            "Скорости посчитаны по времени работы модели (без чтения данных и разбора ответов)."
+        )
+        md_lines.append("")
+        md_lines.append(_df_to_md_table(stats_df.rename(columns=columns)))
+
     # --- Метрики по документам (overall) ---
     overall_class_report = Path(f"{run_id}_overall_class_report.csv")
     if overall_class_report.exists():
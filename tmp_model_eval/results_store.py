@@ -0,0 +1,111 @@
+"""Компактное хранение построчных результатов оценки.
+
+Детальные результаты (строка на поле документа) сохраняются в Parquet:
+повторяющиеся строковые столбцы (``field``, ``subset``, ``prompt``)
+кодируются словарём, а полный текст промпта хранится один раз в
+метаданных запуска — в столбце ``prompt`` лежит только его короткий
+идентификатор.
+
+``pyarrow`` входит в зависимости проекта. Если окружение собрано без него,
+результаты сохраняются в CSV, а метаданные — в соседнем JSON-файле.
+"""
+
+import hashlib
+import json
+import warnings
+from pathlib import Path
+from typing import Any, Dict, Iterable, Tuple, Union
+
+import pandas as pd
+
+# Столбцы с небольшим числом различных значений
+CATEGORICAL_COLUMNS = ("field", "subset", "prompt")
+
+_METADATA_KEY = b"run_metadata"
+
+
+def prompt_id(prompt: str) -> str:
+    """Короткий идентификатор промпта (первые 12 символов sha256)."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def _metadata_path(path: Path) -> Path:
+    return path.with_name(path.stem + "_metadata.json")
+
+
+def _to_categorical(df: pd.DataFrame, columns: Iterable[str]) -> pd.DataFrame:
+    df = df.copy()
+    for column in columns:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def save_results(
+    df: pd.DataFrame, path: Union[str, Path], metadata: Dict[str, Any]
+) -> Path:
+    """Сохраняет таблицу результатов вместе с метаданными запуска.
+
+    Args:
+        df (pd.DataFrame): Построчные результаты.
+        path (Union[str, Path]): Путь без расширения или с расширением
+            ``.parquet``; расширение подбирается по доступному формату.
+        metadata (Dict[str, Any]): Метаданные запуска (например, тексты
+            промптов по идентификатору, модель, сабсеты).
+
+    Returns:
+        Path: Путь к сохранённому файлу.
+    """
+    base = Path(path).with_suffix("")
+    df = _to_categorical(df, CATEGORICAL_COLUMNS)
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        warnings.warn(
+            "Пакет 'pyarrow' не установлен, результаты сохраняются в CSV. "
+            "Установите 'pyarrow' для компактного хранения: pip install pyarrow",
+            stacklevel=2,
+        )
+        out_path = base.with_suffix(".csv")
+        df.to_csv(out_path, index=False)
+        _metadata_path(out_path).write_text(
+            json.dumps(metadata, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+        return out_path
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[_METADATA_KEY] = json.dumps(metadata, ensure_ascii=False).encode("utf-8")
+    table = table.replace_schema_metadata(schema_metadata)
+
+    out_path = base.with_suffix(".parquet")
+    pq.write_table(table, out_path, compression="zstd")
+    return out_path
+
+
+def load_results(path: Union[str, Path]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """Загружает таблицу результатов и метаданные запуска.
+
+    Args:
+        path (Union[str, Path]): Путь к файлу ``.parquet`` или ``.csv``.
+
+    Returns:
+        Tuple[pd.DataFrame, Dict[str, Any]]: Результаты и метаданные.
+    """
+    path = Path(path)
+    if path.suffix == ".csv":
+        metadata_file = _metadata_path(path)
+        metadata = (
+            json.loads(metadata_file.read_text(encoding="utf-8"))
+            if metadata_file.exists()
+            else {}
+        )
+        return pd.read_csv(path), metadata
+
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    raw = (table.schema.metadata or {}).get(_METADATA_KEY)
+    metadata = json.loads(raw.decode("utf-8")) if raw else {}
+    return table.to_pandas(), metadata
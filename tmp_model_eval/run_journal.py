@@ -0,0 +1,172 @@
+"""Журнал запуска оценки в формате JSONL.
+
+Каждое предсказание дописывается в журнал сразу после получения, поэтому
+падение процесса посреди сабсета не теряет уже выполненную работу. При
+повторном запуске с тем же ``run_id`` журнал читается заново, готовые
+элементы пропускаются, а метрики считаются по объединению старых и новых
+записей — так же, как при непрерывном запуске.
+
+Формат строки — JSON-объект с полем ``type``:
+
+* ``meta`` — параметры запуска (пишется в начале каждого сеанса);
+* ``prediction`` — результат для одного элемента.
+
+Журнал не держится в памяти целиком: записи читаются потоком — при открытии
+(чтобы найти параметры последнего сеанса) и для каждого сабсета отдельно.
+Продолжить можно только запуск с теми же промптом и моделью (см.
+``RunJournal.check_resume``).
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Union
+
+# Поля ``meta``, которые должны совпадать у прерванного и продолжающего запуска
+RESUME_KEYS = ("prompt_sha256", "model_sha256")
+
+_TAIL_CHUNK = 64 * 1024
+
+
+class JournalMismatchError(ValueError):
+    """Журнал записан с другими промптом или моделью, чем текущий запуск."""
+
+
+def journal_path(run_id: str) -> Path:
+    """Возвращает путь к журналу запуска с указанным идентификатором."""
+    return Path(f"{run_id}_journal.jsonl")
+
+
+def _truncate_partial_line(path: Path) -> None:
+    """Отрезает недописанную при падении последнюю строку файла."""
+    with path.open("rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - _TAIL_CHUNK)
+            f.seek(start)
+            chunk = f.read(position - start)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            f.truncate(position)
+
+
+class RunJournal:
+    """Журнал, открытый на дозапись.
+
+    Args:
+        path (Union[str, Path]): Путь к файлу журнала.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        if self.path.exists():
+            # Недописанная строка испортила бы первую новую запись
+            _truncate_partial_line(self.path)
+        self._last_meta: Optional[Dict[str, Any]] = None
+        for record in self.iter_records(self.path):
+            if record.get("type") == "meta":
+                self._last_meta = record
+        # Построчная буферизация: каждая запись сразу уходит в ОС
+        self._file = self.path.open("a", encoding="utf-8", buffering=1)
+
+    @staticmethod
+    def iter_records(path: Union[str, Path]) -> Iterator[Dict[str, Any]]:
+        """Читает записи журнала потоком.
+
+        Строки, которые не разбираются как JSON (например, оборванные при
+        падении процесса), пропускаются.
+
+        Args:
+            path (Union[str, Path]): Путь к файлу журнала.
+
+        Yields:
+            Dict[str, Any]: Записи в порядке добавления (ничего, если журнала нет).
+        """
+        path = Path(path)
+        if not path.exists():
+            return
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def last_meta(self) -> Optional[Dict[str, Any]]:
+        """Возвращает параметры последнего сеанса или None."""
+        return self._last_meta
+
+    def check_resume(self, meta: Dict[str, Any], force: bool = False) -> None:
+        """Проверяет, что журнал можно продолжить запуском с параметрами ``meta``.
+
+        Сравниваются поля ``RESUME_KEYS``, записанные в обоих сеансах.
+
+        Args:
+            meta (Dict[str, Any]): Параметры текущего сеанса.
+            force (bool): Продолжить, несмотря на расхождения.
+
+        Raises:
+            JournalMismatchError: Если поля различаются и ``force`` не задан.
+        """
+        previous = self._last_meta
+        if previous is None:
+            return
+        changed = [
+            key
+            for key in RESUME_KEYS
+            if key in previous and key in meta and previous[key] != meta[key]
+        ]
+        if changed and not force:
+            raise JournalMismatchError(
+                f"Журнал {self.path} записан с другими параметрами ({', '.join(changed)}); "
+                "старые предсказания смешаются с новыми. Запустите заново или "
+                "передайте --force"
+            )
+
+    def completed(self, subset: str) -> Dict[str, Dict[str, Any]]:
+        """Возвращает завершённые элементы сабсета.
+
+        Args:
+            subset (str): Имя сабсета.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Записи ``prediction`` по ключу ``item``.
+        """
+        self._file.flush()
+        return {
+            record["item"]: record
+            for record in self.iter_records(self.path)
+            if record.get("type") == "prediction" and record.get("subset") == subset
+        }
+
+    def write_meta(self, **meta: Any) -> None:
+        """Дописывает запись с параметрами текущего сеанса."""
+        record = {"type": "meta", **meta}
+        self._write(record)
+        self._last_meta = record
+
+    def append(self, subset: str, item: str, **fields: Any) -> None:
+        """Дописывает результат для одного элемента.
+
+        Args:
+            subset (str): Имя сабсета.
+            item (str): Идентификатор элемента (например, путь к изображению
+                относительно корня датасета).
+            **fields: Данные результата (истинная метка, предсказание и т.д.).
+        """
+        self._write({"type": "prediction", "subset": subset, "item": item, **fields})
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        """Закрывает файл журнала."""
+        self._file.close()
@@ -0,0 +1,194 @@
+"""Детерминированная стратифицированная выборка для ``sample_size``.
+
+Выборка делается в каждом сабсете отдельно по каждой страте — классу
+документов. Внутри страты элементы ранжируются по хешу ``(seed, класс, имя)``
+и берутся первые ``n``, поэтому выборка:
+
+* не зависит от порядка, в котором файловая система отдаёт каталог;
+* одинакова во всех сабсетах класса: ``clean`` и ``blur`` сравниваются на
+  одних и тех же документах, если имена файлов в них совпадают;
+* воспроизводится между запусками и машинами при том же ``seed``;
+* вложена: выборка из 10 элементов содержит выборку из 5;
+* устойчива к пополнению датасета: новый файл вытесняет из выборки не
+  больше одного старого.
+
+Размер выборки задаётся ``task.sample_size``, остальные параметры — секцией
+``task.sampling``::
+
+    "sampling": {"seed": 0, "mode": "proportional", "quotas": {"passport": 5}}
+"""
+
+import hashlib
+import heapq
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Режимы распределения sample_size по стратам
+FIXED = "fixed"
+PROPORTIONAL = "proportional"
+MODES = (FIXED, PROPORTIONAL)
+
+
+def _name(item: Any) -> str:
+    return item.name if isinstance(item, Path) else str(item)
+
+
+class StratifiedSampler:
+    """Сэмплер с фиксированным зерном и квотами по стратам.
+
+    Args:
+        size (Optional[int]): ``sample_size``: в режиме ``fixed`` — число
+            элементов из каждой страты, в режиме ``proportional`` — общее
+            число элементов на сабсет. None — без выборки.
+        seed (int): Зерно выборки.
+        mode (str): ``fixed`` или ``proportional`` — при пропорциональном
+            распределении каждая непустая страта получает хотя бы один
+            элемент (если ``size`` это позволяет), остальное делится
+            пропорционально размерам страт.
+        quotas (Optional[Dict[str, int]]): Фиксированные квоты для отдельных
+            классов; перекрывают ``size``.
+    """
+
+    def __init__(
+        self,
+        size: Optional[int] = None,
+        seed: int = 0,
+        mode: str = FIXED,
+        quotas: Optional[Dict[str, int]] = None,
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим выборки: {mode} (ожидается один из {MODES})")
+        self.size = size
+        self.seed = seed
+        self.mode = mode
+        self.quotas = dict(quotas or {})
+
+    @classmethod
+    def from_config(cls, task_config: Dict[str, Any]) -> "StratifiedSampler":
+        """Создаёт сэмплер по ``task.sample_size`` и секции ``task.sampling``."""
+        sampling = task_config.get("sampling") or {}
+        return cls(
+            size=task_config.get("sample_size"),
+            seed=int(sampling.get("seed", 0)),
+            mode=sampling.get("mode", FIXED),
+            quotas=sampling.get("quotas"),
+        )
+
+    @property
+    def active(self) -> bool:
+        """Отбирает ли сэмплер хоть что-то (иначе берутся все элементы)."""
+        return self.size is not None or bool(self.quotas)
+
+    def spec(self) -> Dict[str, Any]:
+        """Параметры выборки — для отчётов и ключей кеша результатов."""
+        return {
+            "size": self.size,
+            "seed": self.seed,
+            "mode": self.mode,
+            "quotas": dict(sorted(self.quotas.items())),
+        }
+
+    def allocate(self, counts: Dict[str, int]) -> Dict[str, Optional[int]]:
+        """Распределяет ``size`` по стратам.
+
+        Args:
+            counts (Dict[str, int]): Число элементов в каждой страте.
+
+        Returns:
+            Dict[str, Optional[int]]: Сколько элементов взять из каждой страты
+            (None — все).
+        """
+        allocation: Dict[str, Optional[int]] = {
+            stratum: self.quotas.get(stratum, self.size) for stratum in counts
+        }
+        if self.mode != PROPORTIONAL or self.size is None:
+            return allocation
+
+        shared = {
+            stratum: count
+            for stratum, count in counts.items()
+            if stratum not in self.quotas and count > 0
+        }
+        total = min(self.size, sum(shared.values()))
+        if total < len(shared):
+            # Элементов меньше, чем страт: по одному в страты с наименьшим хешем
+            base = dict.fromkeys(self._rank(list(shared), "", _name, total), 1)
+        else:
+            # По одному элементу каждой страте, остаток — методом наибольших остатков
+            base = dict.fromkeys(shared, 1)
+            rest = total - len(shared)
+            capacity = {stratum: count - 1 for stratum, count in shared.items()}
+            capacity_total = sum(capacity.values())
+            if rest > 0:
+                exact = {
+                    stratum: rest * capacity[stratum] / capacity_total for stratum in shared
+                }
+                for stratum in shared:
+                    base[stratum] += int(exact[stratum])
+                by_remainder = sorted(
+                    shared, key=lambda stratum: (int(exact[stratum]) - exact[stratum], stratum)
+                )
+                for stratum in by_remainder[: total - sum(base.values())]:
+                    base[stratum] += 1
+        for stratum in counts:
+            if stratum not in self.quotas:
+                allocation[stratum] = base.get(stratum, 0)
+        return allocation
+
+    def choose(
+        self,
+        items: Sequence[T],
+        n: Optional[int],
+        stratum: str,
+        key: Callable[[T], str] = _name,
+    ) -> List[T]:
+        """Выбирает ``n`` элементов страты.
+
+        Args:
+            items (Sequence[T]): Элементы страты в любом порядке.
+            n (Optional[int]): Сколько выбрать; None — все в исходном порядке.
+            stratum (str): Имя страты — класса (участвует в хеше).
+            key (Callable[[T], str]): Имя элемента для хеширования (по
+                умолчанию имя файла), должно быть уникальным в страте.
+
+        Returns:
+            List[T]: Выбранные элементы, упорядоченные по имени.
+        """
+        if n is None:
+            return list(items)
+        chosen = self._rank(items, stratum, key, max(n, 0)) if n < len(items) else items
+        return sorted(chosen, key=key)
+
+    def sample(
+        self,
+        strata: Mapping[str, Sequence[T]],
+        key: Callable[[T], str] = _name,
+    ) -> Dict[str, List[T]]:
+        """Выбирает элементы из нескольких страт одного сабсета.
+
+        Args:
+            strata (Mapping[str, Sequence[T]]): Элементы по классам; по именам
+                классов ищутся квоты.
+            key (Callable[[T], str]): Имя элемента для хеширования.
+
+        Returns:
+            Dict[str, List[T]]: Выбранные элементы по стратам.
+        """
+        allocation = self.allocate({stratum: len(items) for stratum, items in strata.items()})
+        return {
+            stratum: self.choose(items, allocation[stratum], stratum, key)
+            for stratum, items in strata.items()
+        }
+
+    def _rank(
+        self, items: Sequence[T], stratum: str, key: Callable[[T], str], n: int
+    ) -> List[T]:
+        """``n`` элементов с наименьшим хешем ``(seed, класс, имя)``."""
+        prefix = f"{self.seed}\0{stratum}\0".encode("utf-8")
+
+        def rank(item: T) -> bytes:
+            return hashlib.blake2b(prefix + key(item).encode("utf-8"), digest_size=8).digest()
+
+        return heapq.nsmallest(n, items, key=rank)
@@ -0,0 +1,72 @@
+"""Упорядочивание запросов по JSON-схеме и статистика задержек по схемам.
+
+Сервер инференса компилирует грамматику ``guided_json`` для каждой новой
+схемы и держит ограниченный кеш скомпилированных грамматик. Если запросы
+с разными схемами идут вперемешку, грамматики вытесняются и компилируются
+заново. ``order_by_schema`` переставляет запросы так, чтобы запросы с
+одной схемой шли подряд: параллельность при этом не меняется — на границе
+групп в работе одновременно оказываются запросы двух соседних схем.
+"""
+
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, List, Sequence, TypeVar
+
+import numpy as np
+import pandas as pd
+
+T = TypeVar("T")
+
+
+def order_by_schema(items: Sequence[T], schema_key: Callable[[T], Hashable]) -> List[T]:
+    """Группирует элементы по схеме, сохраняя исходный порядок внутри групп.
+
+    Группы идут в порядке первого появления схемы, поэтому результат
+    детерминирован.
+
+    Args:
+        items (Sequence[T]): Запросы в исходном порядке.
+        schema_key (Callable[[T], Hashable]): Ключ схемы запроса.
+
+    Returns:
+        List[T]: Те же запросы, сгруппированные по схеме.
+    """
+    groups: Dict[Hashable, List[T]] = {}
+    for item in items:
+        groups.setdefault(schema_key(item), []).append(item)
+    return [item for group in groups.values() for item in group]
+
+
+class LatencyStats:
+    """Задержки успешных запросов в разрезе схем."""
+
+    def __init__(self) -> None:
+        self._latencies: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, schema_id: str, seconds: float) -> None:
+        """Учитывает задержку одного запроса.
+
+        Args:
+            schema_id (str): Идентификатор схемы.
+            seconds (float): Длительность запроса в секундах.
+        """
+        self._latencies[schema_id].append(seconds)
+
+    def frame(self) -> pd.DataFrame:
+        """Сводка по схемам: число запросов, среднее, p50, p95 и максимум (секунды)."""
+        rows = []
+        for schema_id, values in self._latencies.items():
+            latencies = np.asarray(values)
+            rows.append(
+                {
+                    "schema_id": schema_id,
+                    "requests": len(latencies),
+                    "mean": latencies.mean(),
+                    "p50": np.percentile(latencies, 50),
+                    "p95": np.percentile(latencies, 95),
+                    "max": latencies.max(),
+                }
+            )
+        columns = ["schema_id", "requests", "mean", "p50", "p95", "max"]
+        return pd.DataFrame(rows, columns=columns).sort_values(
+            "requests", ascending=False, ignore_index=True
+        )
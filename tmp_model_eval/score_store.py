@@ -0,0 +1,195 @@
+"""Хранилище оценок промптов между запусками ``optimize_prompt``.
+
+Хранит два вида записей:
+
+* итоговую accuracy промпта, по ключу (хеш отрендеренного промпта, хеш
+  конфигурации модели, отпечаток датасета, параметры выборки). Если с
+  прошлого запуска не изменились ни промпт, ни модель, ни датасет, ни
+  выборка, оценка берётся целиком, без обхода изображений;
+* предсказание промпта на каждом изображении и его верность, по ключу
+  (промпт, модель, изображение). Изображение определяется содержимым файла
+  и истинным классом, поэтому записи переиспользуются при частичном
+  пересечении выборок: при увеличении ``sample_size`` или смене зерна
+  модель вызывается только для новых изображений.
+
+В отличие от ``PredictionCache``, хранится уже разобранный ответ, а не
+сырой, и записи не вытесняются: они малы, и их ценность со временем не
+падает. При изменении разбора ответов хранилище нужно очистить.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Union
+
+from dataset_manifest import DatasetManifest
+from prediction_cache import file_digest, model_fingerprint, text_hash
+
+
+class StoredScore(NamedTuple):
+    """Сохранённая итоговая оценка промпта."""
+
+    accuracy: float
+    evaluated: int
+
+
+def sample_fingerprint(spec: Dict[str, Any]) -> str:
+    """Хеш параметров выборки (сабсеты, классы, ``StratifiedSampler.spec``)."""
+    return text_hash(json.dumps(spec, sort_keys=True, ensure_ascii=False))
+
+
+class ScoreStore:
+    """Оценки промптов в файле SQLite.
+
+    Методы потокобезопасны: хранилище можно опрашивать из потоков предзагрузки.
+
+    Args:
+        path (Union[str, Path]): Путь к файлу (создаётся при отсутствии).
+        model_key (str): Хеш модели и её конфигурации (см. ``model_fingerprint``).
+    """
+
+    def __init__(self, path: Union[str, Path], model_key: str) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.model_key = model_key
+        self.hits = 0
+        self.misses = 0
+        self.score_hits = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            "key TEXT PRIMARY KEY, accuracy REAL NOT NULL, "
+            "evaluated INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outcomes ("
+            "key TEXT PRIMARY KEY, prediction TEXT NOT NULL, "
+            "correct INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_config(
+        cls, config: Optional[Dict[str, Any]], model_config: Dict[str, Any]
+    ) -> Optional["ScoreStore"]:
+        """Создаёт хранилище по секции ``score_store`` конфига.
+
+        Args:
+            config (Optional[Dict[str, Any]]): Секция с полем ``path`` или None.
+            model_config (Dict[str, Any]): Секция ``model`` конфига.
+
+        Returns:
+            Optional[ScoreStore]: Хранилище или None, если секция не задана.
+        """
+        if not config or not config.get("path"):
+            return None
+        return cls(config["path"], model_fingerprint(model_config))
+
+    def _key(self, *parts: str) -> str:
+        return hashlib.sha256("\x00".join((self.model_key, *parts)).encode("utf-8")).hexdigest()
+
+    # --- Итоговые оценки ---
+
+    def score_key(
+        self, prompt: str, manifest: Optional[DatasetManifest], spec: Dict[str, Any]
+    ) -> Optional[str]:
+        """Ключ итоговой оценки или None, если датасет нечем идентифицировать.
+
+        Args:
+            prompt (str): Отрендеренный промпт.
+            manifest (Optional[DatasetManifest]): Индекс датасета — источник
+                его отпечатка (учитывает и файлы, перезаписанные на месте, см.
+                ``DatasetManifest.refresh``). Без индекса итоговые оценки не
+                запоминаются (оценки отдельных изображений запоминаются всё равно).
+            spec (Dict[str, Any]): Параметры выборки.
+        """
+        if manifest is None:
+            return None
+        return self._key(
+            "score", text_hash(prompt), manifest.fingerprint(), sample_fingerprint(spec)
+        )
+
+    def get_score(self, key: Optional[str]) -> Optional[StoredScore]:
+        """Возвращает сохранённую итоговую оценку или None."""
+        if key is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT accuracy, evaluated FROM scores WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        self.score_hits += 1
+        return StoredScore(float(row[0]), int(row[1]))
+
+    def put_score(self, key: Optional[str], accuracy: float, evaluated: int) -> None:
+        """Сохраняет итоговую оценку (ничего не делает, если ключа нет)."""
+        if key is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scores (key, accuracy, evaluated, updated) "
+                "VALUES (?, ?, ?, ?)",
+                (key, accuracy, evaluated, time.time()),
+            )
+            self._conn.commit()
+
+    # --- Оценки отдельных изображений ---
+
+    @staticmethod
+    def item_key(
+        image_path: Union[str, Path], label: str, manifest: Optional[DatasetManifest] = None
+    ) -> str:
+        """Идентификатор изображения: содержимое файла и истинный класс.
+
+        Хеш содержимого берётся из индекса датасета, если он там посчитан
+        (``hash_content``), иначе файл читается (с запоминанием, см.
+        ``file_digest``).
+        """
+        entry = manifest.entry(image_path) if manifest is not None else None
+        digest = entry.sha256 if entry is not None and entry.sha256 else file_digest(image_path)
+        return f"{label}\x00{digest}"
+
+    def get_prediction(self, prompt: str, item_key: str) -> Optional[str]:
+        """Возвращает сохранённое предсказание промпта на изображении или None."""
+        key = self._key("item", text_hash(prompt), item_key)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT prediction FROM outcomes WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put_prediction(self, prompt: str, item_key: str, prediction: str, correct: bool) -> None:
+        """Сохраняет предсказание промпта на изображении и его верность."""
+        key = self._key("item", text_hash(prompt), item_key)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO outcomes (key, prediction, correct, updated) "
+                "VALUES (?, ?, ?, ?)",
+                (key, prediction, int(correct), time.time()),
+            )
+            self._conn.commit()
+
+    def stats(self) -> str:
+        """Возвращает строку со статистикой попаданий."""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return (
+            f"Хранилище оценок: итоговых оценок взято {self.score_hits}, "
+            f"оценок изображений взято {self.hits}, посчитано {self.misses} ({hit_rate:.1%})"
+        )
+
+    def close(self) -> None:
+        """Закрывает соединение с файлом хранилища."""
+        with self._lock:
+            self._conn.close()
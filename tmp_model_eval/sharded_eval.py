@@ -0,0 +1,252 @@
+"""Шардированный инференс: несколько процессов, у каждого своя копия модели.
+
+Координатор (основной процесс) режет список элементов на блоки
+фиксированного размера и раздаёт их через общую очередь процессам-
+обработчикам. Каждый обработчик один раз загружает модель на своё
+устройство (``device_map``) и обрабатывает блоки по мере освобождения —
+быстрые устройства получают больше работы. Результаты возвращаются через
+очередь и отдаются потребителю строго в исходном порядке элементов, поэтому
+журналы, метрики и CSV не зависят от числа обработчиков: разбиение на блоки
+(а значит, и состав батчей) определяется только порядком элементов.
+
+Обработчик задаётся фабрикой ``worker_factory(model_config, *worker_args)``,
+которая вызывается в дочернем процессе и возвращает вызываемый объект
+``handler(items) -> results`` (по одному результату на элемент). Если у
+объекта есть метод ``close``, он вызывается при завершении процесса.
+Фабрика и аргументы передаются в дочерний процесс через pickle, поэтому
+фабрика должна быть определена на уровне модуля.
+
+Секция ``task.sharding`` конфига::
+
+    "sharding": {"device_maps": ["cuda:0", "cuda:1"], "chunk_size": 16}
+"""
+
+import multiprocessing as mp
+import queue
+import traceback
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_CHUNK_SIZE = 16
+
+# Сколько блоков держать в работе на один обработчик
+_CHUNKS_PER_WORKER = 2
+
+# Период проверки, живы ли обработчики, пока ждём результат, секунды
+_POLL_INTERVAL = 1.0
+
+
+def sharding_settings(task_config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Извлекает параметры шардирования из секции ``task`` конфига.
+
+    Args:
+        task_config (Dict[str, Any]): Секция ``task``.
+
+    Returns:
+        Optional[Dict[str, Any]]: ``device_maps`` и ``chunk_size`` или None,
+        если шардирование не настроено (обработка идёт в текущем процессе).
+    """
+    config = task_config.get("sharding") or {}
+    device_maps = list(config.get("device_maps") or [])
+    if not device_maps:
+        return None
+    return {
+        "device_maps": device_maps,
+        "chunk_size": int(config.get("chunk_size", DEFAULT_CHUNK_SIZE)),
+    }
+
+
+def _worker_main(
+    worker_index: int,
+    worker_factory: Callable[..., Callable[[List[Any]], List[Any]]],
+    model_config: Dict[str, Any],
+    worker_args: Tuple[Any, ...],
+    tasks: "mp.Queue",
+    results: "mp.Queue",
+) -> None:
+    """Цикл процесса-обработчика: загрузка модели и обработка блоков."""
+    try:
+        handler = worker_factory(model_config, *worker_args)
+    except BaseException:
+        results.put(("error", worker_index, None, traceback.format_exc()))
+        return
+    results.put(("ready", worker_index, None, None))
+
+    try:
+        while True:
+            message = tasks.get()
+            if message is None:
+                break
+            chunk_key, items = message
+            try:
+                output = list(handler(items))
+                if len(output) != len(items):
+                    raise RuntimeError(
+                        f"Обработчик вернул {len(output)} результатов для {len(items)} элементов"
+                    )
+            except BaseException:
+                results.put(("error", worker_index, chunk_key, traceback.format_exc()))
+                return
+            results.put(("result", worker_index, chunk_key, output))
+    finally:
+        close = getattr(handler, "close", None)
+        if callable(close):
+            close()
+
+
+class ShardedRunner:
+    """Пул процессов-обработчиков с упорядоченной выдачей результатов.
+
+    Используется как контекстный менеджер: модели загружаются при входе и
+    переиспользуются во всех вызовах ``map`` (например, для всех сабсетов).
+
+    Args:
+        worker_factory (Callable[..., Callable[[List[Any]], List[Any]]]):
+            Фабрика обработчика, вызывается в дочернем процессе.
+        model_config (Dict[str, Any]): Секция ``model`` конфига; в каждом
+            процессе ``device_map`` заменяется на свой.
+        device_maps (Sequence[str]): Устройства обработчиков, по одному на процесс.
+        worker_args (Tuple[Any, ...]): Дополнительные аргументы фабрики.
+        chunk_size (int): Число элементов в блоке.
+    """
+
+    def __init__(
+        self,
+        worker_factory: Callable[..., Callable[[List[Any]], List[Any]]],
+        model_config: Dict[str, Any],
+        device_maps: Sequence[str],
+        worker_args: Tuple[Any, ...] = (),
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> None:
+        if not device_maps:
+            raise ValueError("Не задано ни одного устройства для обработчиков")
+        self.worker_factory = worker_factory
+        self.model_config = model_config
+        self.device_maps = list(device_maps)
+        self.worker_args = worker_args
+        self.chunk_size = max(1, chunk_size)
+        # spawn: CUDA нельзя инициализировать в процессе, созданном через fork
+        self._context = mp.get_context("spawn")
+        self._tasks: Optional["mp.Queue"] = None
+        self._results: Optional["mp.Queue"] = None
+        self._processes: List[BaseProcess] = []
+        self._generation = 0
+
+    def __enter__(self) -> "ShardedRunner":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close(force=exc_info[0] is not None)
+
+    def start(self) -> None:
+        """Запускает процессы и ждёт, пока все они загрузят модель."""
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        for index, device_map in enumerate(self.device_maps):
+            model_config = dict(self.model_config, device_map=device_map)
+            process = self._context.Process(
+                target=_worker_main,
+                args=(
+                    index,
+                    self.worker_factory,
+                    model_config,
+                    self.worker_args,
+                    self._tasks,
+                    self._results,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+
+        ready = 0
+        try:
+            while ready < len(self._processes):
+                kind, worker_index, _, payload = self._next_message()
+                if kind == "ready":
+                    ready += 1
+                elif kind == "error":
+                    raise RuntimeError(
+                        f"Обработчик {worker_index} ({self.device_maps[worker_index]}) "
+                        f"не запустился:\n{payload}"
+                    )
+        except BaseException:
+            self.close(force=True)
+            raise
+
+    def _next_message(self) -> Tuple[str, int, Any, Any]:
+        """Ждёт сообщение от обработчиков, проверяя, что они живы."""
+        while True:
+            try:
+                return self._results.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                for index, process in enumerate(self._processes):
+                    if process.exitcode is not None and process.exitcode != 0:
+                        raise RuntimeError(
+                            f"Обработчик {index} ({self.device_maps[index]}) "
+                            f"аварийно завершился с кодом {process.exitcode}"
+                        ) from None
+
+    def map(self, items: Iterable[Any]) -> Iterator[Tuple[Any, Any]]:
+        """Обрабатывает элементы в процессах-обработчиках.
+
+        Args:
+            items (Iterable[Any]): Элементы (должны сериализоваться pickle).
+
+        Yields:
+            Tuple[Any, Any]: Элемент и результат его обработки — в исходном
+            порядке элементов.
+
+        Raises:
+            RuntimeError: Если обработчик упал или вернул ошибку.
+        """
+        self._generation += 1
+        generation = self._generation
+        items = list(items)
+        chunks = [
+            items[start : start + self.chunk_size]
+            for start in range(0, len(items), self.chunk_size)
+        ]
+        max_in_flight = _CHUNKS_PER_WORKER * len(self._processes)
+        next_to_send = 0
+        next_to_yield = 0
+        done: Dict[int, List[Any]] = {}
+
+        while next_to_yield < len(chunks):
+            while next_to_send < len(chunks) and next_to_send - next_to_yield < max_in_flight:
+                self._tasks.put(((generation, next_to_send), chunks[next_to_send]))
+                next_to_send += 1
+
+            while next_to_yield not in done:
+                kind, worker_index, chunk_key, payload = self._next_message()
+                if kind == "error":
+                    raise RuntimeError(
+                        f"Ошибка в обработчике {worker_index} "
+                        f"({self.device_maps[worker_index]}):\n{payload}"
+                    )
+                # Результаты прерванного предыдущего вызова map пропускаем
+                if kind == "result" and chunk_key[0] == generation:
+                    done[chunk_key[1]] = payload
+
+            output = done.pop(next_to_yield)
+            yield from zip(chunks[next_to_yield], output, strict=True)
+            next_to_yield += 1
+
+    def close(self, force: bool = False) -> None:
+        """Останавливает обработчики.
+
+        Args:
+            force (bool): Завершить процессы немедленно, не дожидаясь
+                обработки оставшихся блоков.
+        """
+        if self._tasks is not None and not force:
+            for _ in self._processes:
+                self._tasks.put(None)
+        for process in self._processes:
+            if not force:
+                process.join()
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._processes = []
@@ -0,0 +1,252 @@
+"""Замеры времени по стадиям запуска оценки.
+
+Участки кода оборачиваются в ``span("стадия")``; в конце запуска
+``StageTimer.summary()`` даёт по каждой стадии число вызовов, суммарное
+время и перцентили p50/p95/p99, а ``export_trace`` сохраняет все участки
+в формате Chrome Trace Event (открывается в ``chrome://tracing`` и
+Perfetto). Так видно, уходит ли время на поиск файлов, чтение изображений,
+модель, разбор ответов или запись результатов.
+
+По умолчанию замеры выключены: ``span`` возвращает один и тот же пустой
+контекстный менеджер, и накладные расходы сводятся к вызову функции.
+Включаются замеры ``configure`` или секцией ``task.profiling`` конфига::
+
+    "profiling": {"trace_path": "trace.json"}
+
+Замеры потокобезопасны: стадии, выполняемые в потоках предзагрузки,
+попадают в трассу отдельными дорожками. Участки, которые пересекаются в
+одном потоке (конкурентные корутины asyncio), нужно помечать
+``overlapping=True`` — они выгружаются как асинхронные события.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+
+import numpy as np
+import pandas as pd
+
+T = TypeVar("T")
+
+_NULL_SPAN = nullcontext()
+
+# (стадия, начало в нс, длительность в нс, id потока, пересекающийся ли участок)
+_Event = Tuple[str, int, int, int, bool]
+
+
+class _Span:
+    """Контекстный менеджер одного замера."""
+
+    __slots__ = ("timer", "name", "overlapping", "started")
+
+    def __init__(self, timer: "StageTimer", name: str, overlapping: bool) -> None:
+        self.timer = timer
+        self.name = name
+        self.overlapping = overlapping
+
+    def __enter__(self) -> "_Span":
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.timer.record(
+            self.name,
+            self.started,
+            time.perf_counter_ns() - self.started,
+            self.overlapping,
+        )
+
+
+class StageTimer:
+    """Накопитель замеров по стадиям.
+
+    Args:
+        enabled (bool): Вести ли замеры.
+        keep_events (bool): Хранить ли отдельные участки для выгрузки трассы
+            (без этого хранятся только длительности для статистики).
+    """
+
+    def __init__(self, enabled: bool = False, keep_events: bool = False) -> None:
+        self.enabled = enabled
+        self.keep_events = keep_events
+        self._durations: Dict[str, List[int]] = {}
+        self._events: List[_Event] = []
+        self._thread_names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+
+    def span(self, name: str, overlapping: bool = False) -> Any:
+        """Возвращает контекстный менеджер, замеряющий стадию ``name``.
+
+        Args:
+            name (str): Название стадии.
+            overlapping (bool): Участок может пересекаться с другими в том же
+                потоке (например, запросы из конкурентных корутин).
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, overlapping)
+
+    def record(
+        self, name: str, started_ns: int, duration_ns: int, overlapping: bool = False
+    ) -> None:
+        """Добавляет замер, сделанный вне ``span``."""
+        if not self.enabled:
+            return
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._durations.setdefault(name, []).append(duration_ns)
+            if self.keep_events:
+                self._events.append((name, started_ns, duration_ns, thread_id, overlapping))
+                if thread_id not in self._thread_names:
+                    self._thread_names[thread_id] = threading.current_thread().name
+
+    def timed_iter(self, iterable: Iterable[T], name: str) -> Iterator[T]:
+        """Отдаёт элементы ``iterable``, замеряя ожидание каждого из них.
+
+        Полезно для потребителя ``Prefetcher``: время ``next()`` — это время,
+        которое цикл простаивает в ожидании входных данных.
+        """
+        if not self.enabled:
+            return iter(iterable)
+        return self._timed_iter(iter(iterable), name)
+
+    def _timed_iter(self, iterator: Iterator[T], name: str) -> Iterator[T]:
+        while True:
+            started = time.perf_counter_ns()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(name, started, time.perf_counter_ns() - started)
+            yield item
+
+    def summary(self) -> pd.DataFrame:
+        """Сводка по стадиям (времена в миллисекундах, ``total_s`` — в секундах).
+
+        Returns:
+            pd.DataFrame: Колонки ``stage``, ``count``, ``total_s``, ``mean_ms``,
+            ``p50_ms``, ``p95_ms``, ``p99_ms``, ``max_ms``; стадии отсортированы
+            по убыванию суммарного времени.
+        """
+        with self._lock:
+            durations = {name: list(values) for name, values in self._durations.items()}
+        rows = []
+        for name, values in durations.items():
+            ms = np.asarray(values, dtype=np.float64) / 1e6
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            rows.append(
+                {
+                    "stage": name,
+                    "count": len(ms),
+                    "total_s": round(ms.sum() / 1000, 4),
+                    "mean_ms": round(ms.mean(), 3),
+                    "p50_ms": round(p50, 3),
+                    "p95_ms": round(p95, 3),
+                    "p99_ms": round(p99, 3),
+                    "max_ms": round(ms.max(), 3),
+                }
+            )
+        columns = [
+            "stage", "count", "total_s", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"
+        ]
+        df = pd.DataFrame(rows, columns=columns)
+        return df.sort_values("total_s", ascending=False, ignore_index=True)
+
+    def format_summary(self) -> str:
+        """Сводка по стадиям в виде текстовой таблицы."""
+        df = self.summary()
+        if df.empty:
+            return "Замеров нет"
+        return df.to_string(index=False)
+
+    def export_trace(self, path: Union[str, Path]) -> Path:
+        """Сохраняет участки в формате Chrome Trace Event (JSON).
+
+        Обычные участки выгружаются как завершённые события (``"ph": "X"``)
+        на дорожке своего потока, пересекающиеся — как пары асинхронных
+        событий (``"b"``/``"e"``).
+
+        Args:
+            path (Union[str, Path]): Файл трассы.
+
+        Returns:
+            Path: Путь к сохранённому файлу.
+        """
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+        pid = os.getpid()
+        trace: List[Dict[str, Any]] = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in thread_names.items()
+        ]
+        for index, (name, started, duration, tid, overlapping) in enumerate(events):
+            ts = (started - self._origin) / 1000
+            if overlapping:
+                common = {"name": name, "cat": "stage", "id": index, "pid": pid, "tid": tid}
+                trace.append({**common, "ph": "b", "ts": ts})
+                trace.append({**common, "ph": "e", "ts": ts + duration / 1000})
+            else:
+                trace.append(
+                    {
+                        "name": name,
+                        "cat": "stage",
+                        "ph": "X",
+                        "ts": ts,
+                        "dur": duration / 1000,
+                        "pid": pid,
+                        "tid": tid,
+                    }
+                )
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+        return path
+
+
+_timer = StageTimer()
+
+
+def configure(enabled: bool = True, keep_events: bool = False) -> StageTimer:
+    """Заменяет глобальный накопитель замеров новым и возвращает его."""
+    global _timer
+    _timer = StageTimer(enabled=enabled, keep_events=keep_events)
+    return _timer
+
+
+def configure_from(config: Optional[Dict[str, Any]]) -> StageTimer:
+    """Настраивает замеры по секции ``profiling`` конфига.
+
+    Args:
+        config (Optional[Dict[str, Any]]): Секция ``profiling``. Если она не
+            задана (None) или ``enabled`` ложно, замеры выключены; пустая
+            секция включает сводку, ``trace_path`` — ещё и хранение участков
+            для ``export_trace``.
+
+    Returns:
+        StageTimer: Глобальный накопитель замеров.
+    """
+    if config is None or not config.get("enabled", True):
+        return configure(enabled=False)
+    return configure(enabled=True, keep_events=bool(config.get("trace_path")))
+
+
+def get_timer() -> StageTimer:
+    """Текущий глобальный накопитель замеров."""
+    return _timer
+
+
+def span(name: str, overlapping: bool = False) -> Any:
+    """Замер стадии глобальным накопителем (см. ``StageTimer.span``)."""
+    return _timer.span(name, overlapping)
+
+
+def timed_iter(iterable: Iterable[T], name: str) -> Iterator[T]:
+    """Замер ожидания элементов глобальным накопителем (см. ``StageTimer.timed_iter``)."""
+    return _timer.timed_iter(iterable, name)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Скрипты оценки импортируют соседние модули по имени (запускаются из tmp_model_eval)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,92 @@
+import asyncio
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import pytest
+
+pytest.importorskip("openai")
+
+from openai import AsyncOpenAI  # noqa: E402
+
+from adaptive_client import AdaptiveLimiter, RequestPool, create_client  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+from stub_server import StubState, make_handler  # noqa: E402
+
+CAPACITY = 4
+WORKERS = 16
+
+
+class RecordingLimiter(AdaptiveLimiter):
+    """Лимитер, запоминающий лимит после каждого изменения."""
+
+    def __init__(self, initial_limit: int, max_limit: int) -> None:
+        super().__init__(initial_limit=initial_limit, max_limit=max_limit)
+        self.history: List[float] = []
+
+    async def on_success(self, latency: float) -> None:
+        await super().on_success(latency)
+        self.history.append(self.limit)
+
+    def on_overload(self, started_at: float) -> None:
+        super().on_overload(started_at)
+        self.history.append(self.limit)
+
+
+@pytest.fixture(params=[429, 503])
+def server(request: pytest.FixtureRequest) -> Iterator[Tuple[StubState, str]]:
+    state = StubState(20, 0, 4, max_concurrency=CAPACITY, overload_status=request.param)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield state, f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+async def _drive(pool: RequestPool, client: AsyncOpenAI, requests_per_worker: int) -> List[str]:
+    async def request() -> str:
+        response = await client.chat.completions.create(
+            model="stub", messages=[{"role": "user", "content": "x"}]
+        )
+        return response.choices[0].message.content or ""
+
+    async def worker() -> List[str]:
+        return [await pool.run(request) for _ in range(requests_per_worker)]
+
+    results = await asyncio.gather(*(worker() for _ in range(WORKERS)))
+    return [content for chunk in results for content in chunk]
+
+
+def test_limiter_backs_off_on_overload_and_recovers(server: Tuple[StubState, str]) -> None:
+    state, base_url = server
+    limiter = RecordingLimiter(initial_limit=8, max_limit=WORKERS)
+    pool = RequestPool(limiter, timeout=10, max_retries=20, backoff_base=0.01, backoff_max=0.1)
+
+    async def scenario() -> None:
+        client = create_client(base_url, WORKERS)
+        try:
+            # Сервер принимает вчетверо меньше запросов, чем хотят обработчики
+            results = await _drive(pool, client, 5)
+            assert len(results) == WORKERS * 5
+            assert pool.failures == 0
+            assert state.rejected > 0 and pool.retries == state.rejected
+            assert min(limiter.history) <= CAPACITY
+            # Перегрузка держит лимит около ёмкости сервера, а не на исходных 8
+            assert pool.retries < WORKERS * 5
+
+            # Ёмкость выросла: лимит восстанавливается без новых отказов
+            state.max_concurrency = 0
+            rejected = state.rejected
+            results = await _drive(pool, client, 10)
+            assert len(results) == WORKERS * 10
+            assert state.rejected == rejected
+            assert limiter.limit == WORKERS
+        finally:
+            await client.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,99 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from batch_controller import SCOPE_BATCH, BatchController, OutOfMemoryError
+from model_backends import SyntheticModel
+
+BUCKET = "any"
+
+
+def make_model(oom_above: int) -> SyntheticModel:
+    return SyntheticModel({"backend": "synthetic", "oom_above": oom_above})
+
+
+def test_run_chunks_halves_limit_then_grows() -> None:
+    model = make_model(oom_above=3)
+    controller = BatchController("model", SCOPE_BATCH, grow_after=2)
+    images = [f"image_{i}.png" for i in range(8)]
+
+    def call(chunk: List[str]) -> List[str]:
+        return model.predict_on_batch(chunk, ["prompt"] * len(chunk))
+
+    results = controller.run_chunks(images, call, BUCKET)
+
+    # Ответы не зависят от того, как изображения разбиты на вызовы
+    assert results == make_model(oom_above=8).predict_on_batch(images, ["prompt"] * 8)
+    # 8 и 4 не поместились: предел 2, после двух успешных вызовов — 3
+    assert controller.ooms == 2
+    assert controller.limit(BUCKET) == 3
+
+    # Упавший в этом запуске размер 4 больше не пробуется
+    controller.run_chunks(images * 4, call, BUCKET)
+    assert controller.limit(BUCKET) == 3
+    assert controller.ooms == 2
+
+
+def test_run_prefix_drops_trailing_items() -> None:
+    model = make_model(oom_above=2)
+    controller = BatchController("model", SCOPE_BATCH, min_limit=0)
+    images = [f"image_{i}.png" for i in range(5)]
+
+    def call(chunk: List[str]) -> int:
+        model.predict_on_images(chunk, "prompt")
+        return len(chunk)
+
+    assert controller.run_prefix(images, call, BUCKET) == 2
+    assert controller.limit(BUCKET) == 2
+
+
+def test_run_whole_retries_once_and_lowers_limit() -> None:
+    model = make_model(oom_above=3)
+    controller = BatchController("model", SCOPE_BATCH)
+
+    def call(pages: List[str]) -> str:
+        return model.predict_on_images(pages, "prompt")
+
+    with pytest.raises(OutOfMemoryError):
+        controller.run_whole([f"page_{i}.png" for i in range(4)], call, BUCKET)
+    assert controller.ooms == 1
+    assert controller.limit(BUCKET) == 2
+
+    controller.run_whole([f"page_{i}.png" for i in range(3)], call, BUCKET)
+
+
+def test_save_persists_learned_limits(tmp_path: Path) -> None:
+    path = tmp_path / "batch_limits.json"
+    model = make_model(oom_above=3)
+    controller = BatchController("model", SCOPE_BATCH, grow_after=2, path=path)
+
+    def call(chunk: List[str]) -> List[str]:
+        return model.predict_on_batch(chunk, ["prompt"] * len(chunk))
+
+    controller.run_chunks([f"image_{i}.png" for i in range(8)], call, BUCKET)
+    controller.save()
+
+    restored = BatchController("model", SCOPE_BATCH, path=path)
+    assert restored.limit(BUCKET) == 3
+    # Пределы другой модели и вида запросов не подхватываются
+    assert BatchController("other", SCOPE_BATCH, path=path).limit(BUCKET) is None
+
+
+def test_save_merges_limits_of_concurrent_processes(tmp_path: Path) -> None:
+    path = tmp_path / "batch_limits.json"
+    first = BatchController("model", SCOPE_BATCH, path=path)
+    second = BatchController("model", SCOPE_BATCH, path=path)
+
+    first.on_oom("small", 8)
+    first.on_oom("shared", 8)
+    second.on_oom("large", 4)
+    second.on_oom("shared", 4)
+    first.save()
+    second.save()
+
+    restored = BatchController("model", SCOPE_BATCH, path=path)
+    assert restored.limit("small") == 4
+    assert restored.limit("large") == 2
+    # Корзину изменили оба процесса — сохраняется меньший предел
+    assert restored.limit("shared") == 2
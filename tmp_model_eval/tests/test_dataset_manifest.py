@@ -0,0 +1,82 @@
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+
+from dataset_manifest import DatasetManifest, manifest_from_config
+from score_store import ScoreStore
+
+
+def _write(path: Path, data: bytes, mtime_ns: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_manifest_is_opt_in(tmp_path: Path) -> None:
+    _write(tmp_path / "data" / "a.png", b"a", 10**18)
+
+    assert manifest_from_config(tmp_path / "data", None) is None
+    assert manifest_from_config(tmp_path / "data", False) is None
+    assert manifest_from_config(tmp_path / "data", {"enabled": False}) is None
+    manifest = manifest_from_config(tmp_path / "data", {"path": tmp_path / "index.json"})
+    assert manifest is not None and manifest.entry(tmp_path / "data" / "a.png") is not None
+
+
+def _old_tree(image: Path, root: Path) -> None:
+    """Давно изменённые каталоги не попадают в окно точности mtime и не перечитываются."""
+    for directory in [image.parent, *image.parent.relative_to(root).parents]:
+        os.utime(root / directory, ns=(10**18, 10**18))
+
+
+def _rewrite_in_place(image: Path, data: bytes, mtime_ns: int) -> None:
+    # Перезапись на месте не меняет mtime каталога
+    _write(image, data, mtime_ns)
+    os.utime(image.parent, ns=(10**18, 10**18))
+
+
+@pytest.mark.parametrize("hash_content", [True, False])
+def test_rebuild_sees_file_rewritten_in_place(tmp_path: Path, hash_content: bool) -> None:
+    image = tmp_path / "data" / "invoice" / "images" / "test" / "1.png"
+    _write(image, b"old", 10**18)
+    _write(image.with_name("2.png"), b"other", 10**18)
+    _old_tree(image, tmp_path)
+    index = tmp_path / "index.json"
+    before = DatasetManifest.build(tmp_path / "data", path=index, hash_content=hash_content)
+
+    _rewrite_in_place(image, b"new content", 2 * 10**18)
+    after = DatasetManifest.build(tmp_path / "data", path=index, hash_content=hash_content)
+
+    assert after.fingerprint() != before.fingerprint()
+    files = dict(after.iter_files())
+    assert files["invoice/images/test/1.png"].size == len(b"new content")
+    assert files["invoice/images/test/2.png"] == dict(before.iter_files())[
+        "invoice/images/test/2.png"
+    ]
+    if hash_content:
+        assert files["invoice/images/test/1.png"].sha256 == hashlib.sha256(
+            b"new content"
+        ).hexdigest()
+    # Изменённый индекс сохранён: следующий запуск его не пересчитывает
+    assert DatasetManifest.load(index, tmp_path / "data").fingerprint() == after.fingerprint()
+
+
+def test_entry_drops_hash_of_file_rewritten_after_build(tmp_path: Path) -> None:
+    image = tmp_path / "data" / "invoice" / "images" / "test" / "1.png"
+    _write(image, b"old", 10**18)
+    _old_tree(image, tmp_path)
+    manifest = DatasetManifest.build(
+        tmp_path / "data", path=tmp_path / "index.json", hash_content=True
+    )
+
+    _rewrite_in_place(image, b"new content", 2 * 10**18)
+
+    entry = manifest.entry(image)
+    assert entry is not None
+    assert entry.sha256 == ""
+    assert entry.size == len(b"new content")
+    assert ScoreStore.item_key(image, "invoice", manifest) == ScoreStore.item_key(image, "invoice")
+
+    image.unlink()
+    assert manifest.entry(image) is None
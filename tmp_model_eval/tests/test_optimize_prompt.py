@@ -0,0 +1,78 @@
+import os
+from pathlib import Path
+from typing import Any, Dict
+
+import pandas as pd
+import pytest
+from PIL import Image
+
+pytest.importorskip("bench_utils")
+
+CLASSES = {"invoice": "Счёт", "passport": "Паспорт"}
+
+
+@pytest.fixture()
+def config(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Dict[str, Any]:
+    # optimize_prompt создаёт каталог prompts/ в текущем каталоге
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / "data"
+    for index, class_name in enumerate(CLASSES):
+        for number in range(4):
+            path = root / class_name / "images" / "test" / f"{number}.png"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            Image.new("RGB", (8, 8), (index * 100, number * 50, 0)).save(path)
+            os.utime(path, ns=(10**18, 10**18))
+    # Давно изменённые каталоги не перечитываются при обновлении индекса
+    for directory in [root, *(p for p in root.rglob("*") if p.is_dir())]:
+        os.utime(directory, ns=(10**18, 10**18))
+    return {
+        "task": {
+            "dataset_path": str(root),
+            "subsets": ["test"],
+            "manifest": {"path": str(tmp_path / "index.json"), "hash_content": True},
+        },
+        "model": {"backend": "synthetic", "model_name": "synthetic", "responses": ["0", "1"]},
+        "document_classes": CLASSES,
+        "optimization": {
+            "num_attempts": 0,
+            "halving": {"min_sample_size": 2, "leaderboard_path": str(tmp_path / "board.csv")},
+        },
+    }
+
+
+def _run_halving(config: Dict[str, Any]) -> pd.DataFrame:
+    from dataset_manifest import manifest_from_config
+    from model_backends import create_model
+    from optimize_prompt import optimize_halving
+    from sampling import StratifiedSampler
+
+    task = config["task"]
+    manifest = manifest_from_config(Path(task["dataset_path"]), task["manifest"])
+    optimize_halving(
+        create_model(config["model"]),
+        config,
+        "Classes: {classes}",
+        None,
+        manifest,
+        StratifiedSampler.from_config(task),
+    )
+    return pd.read_csv(config["optimization"]["halving"]["leaderboard_path"])
+
+
+def test_halving_leaderboard_is_keyed_by_current_dataset(config: Dict[str, Any]) -> None:
+    first = _run_halving(config)
+    assert len(first) == 1 and first["evaluated"].iloc[0] == 8
+
+    # Повторный запуск на тех же данных обновляет ту же строку
+    assert len(_run_halving(config)) == 1
+
+    # Перезапись файла на месте не меняет mtime каталога, но меняет отпечаток датасета
+    image = Path(config["task"]["dataset_path"]) / "invoice" / "images" / "test" / "1.png"
+    Image.new("RGB", (8, 8), (255, 255, 255)).save(image)
+    os.utime(image, ns=(2 * 10**18, 2 * 10**18))
+    os.utime(image.parent, ns=(10**18, 10**18))
+    edited = _run_halving(config)
+
+    assert len(edited) == 2
+    assert edited["dataset_fingerprint"].nunique() == 2
+    assert edited["sample_fingerprint"].nunique() == 1
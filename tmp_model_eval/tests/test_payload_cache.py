@@ -0,0 +1,41 @@
+from pathlib import Path
+
+from PIL import Image
+
+from payload_cache import PayloadCache
+
+
+def _disk_size(cache_dir: Path) -> int:
+    return sum(path.stat().st_size for path in cache_dir.glob("*.jpg"))
+
+
+def test_rewriting_key_keeps_disk_size(tmp_path: Path) -> None:
+    cache = PayloadCache(tmp_path / "cache", max_pixels=64 * 64)
+    image = tmp_path / "scan.png"
+    Image.new("RGB", (256, 256), (200, 10, 10)).save(image)
+
+    cache.get(image)
+    key = cache.make_key(image)
+    for size in (10, 30, 20):
+        cache._write_disk(key, b"x" * size)
+
+    assert cache._disk_bytes == _disk_size(tmp_path / "cache") == 20
+
+
+def test_disk_cache_is_reused_and_evicted(tmp_path: Path) -> None:
+    images = []
+    for index in range(4):
+        image = tmp_path / f"scan_{index}.png"
+        Image.new("RGB", (256, 256), (index * 50, 0, 0)).save(image)
+        images.append(image)
+    first = PayloadCache(tmp_path / "cache", max_pixels=64 * 64)
+    encoded = [first.get(image) for image in images]
+
+    second = PayloadCache(tmp_path / "cache", max_pixels=64 * 64)
+    assert [second.get(image) for image in images] == encoded
+    assert second.disk_hits == len(images) and second.misses == 0
+
+    size = _disk_size(tmp_path / "cache")
+    small = PayloadCache(tmp_path / "cache", max_disk_bytes=size - 1, max_pixels=32 * 32)
+    small.get(images[0])
+    assert small._disk_bytes == _disk_size(tmp_path / "cache") < size
@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from results_store import load_results, prompt_id, save_results
+
+PROMPT = "Извлеки номер документа"
+METADATA = {"prompts": {prompt_id(PROMPT): PROMPT}, "model": "test-model"}
+
+
+def _results() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "file": ["a.png", "a.png", "b.png"],
+            "field": ["number", "date", "number"],
+            "subset": ["test", "test", "test"],
+            "prompt": [prompt_id(PROMPT)] * 3,
+            "cer": [0.0, 0.25, 0.5],
+        }
+    )
+
+
+def test_parquet_round_trip(tmp_path: Path) -> None:
+    pytest.importorskip("pyarrow")
+
+    out_path = save_results(_results(), tmp_path / "results", METADATA)
+    df, metadata = load_results(out_path)
+
+    assert out_path.suffix == ".parquet"
+    assert metadata == METADATA
+    for column in ("field", "subset", "prompt"):
+        assert isinstance(df[column].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(
+        df.astype({"field": str, "subset": str, "prompt": str}), _results()
+    )
+
+
+def test_falls_back_to_csv_without_pyarrow(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # None в sys.modules заставляет import выбросить ImportError
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+
+    with pytest.warns(UserWarning, match="pyarrow"):
+        out_path = save_results(_results(), tmp_path / "results.parquet", METADATA)
+    df, metadata = load_results(out_path)
+
+    assert out_path.suffix == ".csv"
+    assert metadata == METADATA
+    pd.testing.assert_frame_equal(df, _results())
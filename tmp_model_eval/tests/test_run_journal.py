@@ -0,0 +1,82 @@
+from pathlib import Path
+
+import pytest
+
+from run_journal import JournalMismatchError, RunJournal
+
+META = {"model_name": "m", "model_sha256": "model", "prompt_sha256": "prompt"}
+
+
+def _interrupted_journal(path: Path) -> None:
+    journal = RunJournal(path)
+    journal.write_meta(**META)
+    journal.append("clean", "a.png", y_true="0", y_pred="0")
+    journal.append("blur", "b.png", y_true="1", y_pred="0")
+    journal.close()
+    # Процесс упал посреди записи
+    with path.open("a", encoding="utf-8") as f:
+        f.write('{"type": "prediction", "subset": "clean", "it')
+
+
+def test_resume_truncates_partial_line(tmp_path: Path) -> None:
+    path = tmp_path / "run_journal.jsonl"
+    _interrupted_journal(path)
+
+    journal = RunJournal(path)
+    journal.check_resume(META)
+    journal.append("clean", "c.png", y_true="2", y_pred="2")
+    journal.close()
+
+    assert path.read_text(encoding="utf-8").endswith('"y_pred": "2"}\n')
+    assert sorted(RunJournal(path).completed("clean")) == ["a.png", "c.png"]
+    assert len(list(RunJournal.iter_records(path))) == 4
+
+
+@pytest.mark.parametrize("key", ["model_sha256", "prompt_sha256"])
+def test_resume_refuses_changed_run_unless_forced(tmp_path: Path, key: str) -> None:
+    path = tmp_path / "run_journal.jsonl"
+    _interrupted_journal(path)
+    journal = RunJournal(path)
+
+    with pytest.raises(JournalMismatchError, match=key):
+        journal.check_resume({**META, key: "other"})
+    journal.check_resume({**META, key: "other"}, force=True)
+    # Поля, которых нет в старом журнале, не сравниваются
+    journal.check_resume({**META, "dataset_path": "other"})
+    journal.close()
+
+
+def test_resume_refuses_changed_image_normalization(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    pytest.importorskip("bench_utils")
+    from PIL import Image
+
+    from check_classifiication import run_evaluation
+
+    # Скрипт пишет журнал, метрики и нормализованные изображения в текущий каталог
+    monkeypatch.chdir(tmp_path)
+    for class_name in ("invoice", "passport"):
+        for index in range(2):
+            path = tmp_path / "data" / class_name / "images" / "test" / f"{index}.png"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            Image.new("RGB", (64, 64), (index * 100, 0, 0)).save(path)
+    (tmp_path / "prompt.txt").write_text("Classes: {classes}", encoding="utf-8")
+    config = {
+        "task": {
+            "dataset_path": str(tmp_path / "data"),
+            "subsets": ["test"],
+            "prompt_path": str(tmp_path / "prompt.txt"),
+            "image_normalization": {"max_pixels": 32 * 32},
+        },
+        "model": {"backend": "synthetic", "model_name": "synthetic", "responses": ["0", "1"]},
+        "document_classes": {"invoice": "Счёт", "passport": "Паспорт"},
+    }
+    run_evaluation(config)
+    (journal,) = tmp_path.glob("*_journal.jsonl")
+    run_id = journal.name[: -len("_journal.jsonl")]
+
+    config["task"]["image_normalization"] = {"max_pixels": 16 * 16}
+    with pytest.raises(JournalMismatchError, match="model_sha256"):
+        run_evaluation(config, run_id)
+    run_evaluation(config, run_id, force=True)
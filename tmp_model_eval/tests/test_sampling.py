@@ -0,0 +1,44 @@
+from pathlib import Path
+
+import pytest
+
+from sampling import StratifiedSampler
+
+NAMES = [f"doc_{i:03d}.png" for i in range(40)]
+
+
+def test_sample_is_nested() -> None:
+    strata = {"invoice": [Path("invoice") / name for name in NAMES]}
+    small = StratifiedSampler(size=5, seed=7).sample(strata)["invoice"]
+    large = StratifiedSampler(size=10, seed=7).sample(strata)["invoice"]
+
+    assert len(small) == 5 and len(large) == 10
+    assert set(small) <= set(large)
+
+
+def test_sample_ignores_item_order() -> None:
+    sampler = StratifiedSampler(size=8, seed=3)
+    forward = sampler.sample({"receipt": NAMES})
+    backward = sampler.sample({"receipt": list(reversed(NAMES))})
+
+    assert forward == backward
+
+
+@pytest.mark.parametrize("new_name", ["doc_999.png", "aaa.png", "new_scan.jpg"])
+def test_new_item_displaces_at_most_one(new_name: str) -> None:
+    sampler = StratifiedSampler(size=10, seed=0)
+    before = set(sampler.sample({"passport": NAMES})["passport"])
+    after = set(sampler.sample({"passport": NAMES + [new_name]})["passport"])
+
+    assert len(after) == 10
+    assert len(before - after) <= 1
+    assert after - before <= {new_name}
+
+
+def test_same_names_give_same_sample_across_subsets() -> None:
+    sampler = StratifiedSampler(size=6, seed=1)
+    clean = sampler.sample({"invoice": [Path("clean") / name for name in NAMES]})
+    blur = sampler.sample({"invoice": [Path("blur") / name for name in NAMES]})
+
+    assert [path.name for path in clean["invoice"]] == [path.name for path in blur["invoice"]]
+
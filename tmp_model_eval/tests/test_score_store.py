@@ -0,0 +1,80 @@
+import os
+from pathlib import Path
+from typing import Dict
+
+import pytest
+from PIL import Image
+
+from dataset_manifest import DatasetManifest
+from score_store import ScoreStore
+
+CLASSES = {"invoice": "Счёт", "passport": "Паспорт"}
+SPEC = {"subsets": ["test"], "classes": list(CLASSES), "sampling": {}}
+
+
+def _dataset(root: Path) -> Dict[str, Path]:
+    images = {}
+    for index, class_name in enumerate(CLASSES):
+        for number in range(3):
+            path = root / class_name / "images" / "test" / f"{number}.png"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            Image.new("RGB", (8, 8), (index * 100, number * 50, 0)).save(path)
+            os.utime(path, ns=(10**18, 10**18))
+            images[f"{class_name}/{number}"] = path
+    # Давно изменённые каталоги не перечитываются при обновлении индекса
+    for directory in [root, *(p for p in root.rglob("*") if p.is_dir())]:
+        os.utime(directory, ns=(10**18, 10**18))
+    return images
+
+
+def _rewrite_in_place(path: Path) -> None:
+    Image.new("RGB", (8, 8), (255, 255, 255)).save(path)
+    os.utime(path, ns=(2 * 10**18, 2 * 10**18))
+    os.utime(path.parent, ns=(10**18, 10**18))
+
+
+def test_score_key_changes_after_in_place_edit(tmp_path: Path) -> None:
+    images = _dataset(tmp_path / "data")
+    index = tmp_path / "index.json"
+    store = ScoreStore(tmp_path / "scores.sqlite", "model")
+    key = store.score_key("prompt", DatasetManifest.build(tmp_path / "data", path=index), SPEC)
+    store.put_score(key, 0.5, 6)
+
+    _rewrite_in_place(images["invoice/1"])
+    manifest = DatasetManifest.build(tmp_path / "data", path=index)
+
+    assert store.get_score(store.score_key("prompt", manifest, SPEC)) is None
+    store.close()
+
+
+def test_evaluate_prompt_reevaluates_edited_sample(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    pytest.importorskip("bench_utils")
+    # optimize_prompt создаёт каталог prompts/ в текущем каталоге
+    monkeypatch.chdir(tmp_path)
+    from model_backends import create_model
+    from optimize_prompt import evaluate_prompt
+
+    images = _dataset(tmp_path / "data")
+    index = tmp_path / "index.json"
+    model = create_model({"backend": "synthetic", "model_name": "s", "responses": ["0", "1"]})
+    store = ScoreStore(tmp_path / "scores.sqlite", "model")
+
+    def evaluate() -> float:
+        manifest = DatasetManifest.build(tmp_path / "data", path=index, hash_content=True)
+        return evaluate_prompt(
+            model, tmp_path / "data", CLASSES, ["test"], None, "Classes: {classes}",
+            manifest=manifest, scores=store,
+        )
+
+    evaluate()
+    evaluate()
+    assert store.score_hits == 1 and store.misses == 6
+
+    _rewrite_in_place(images["invoice/1"])
+    evaluate()
+    # Итоговая оценка не взята из хранилища, заново оценено только изменённое изображение
+    assert store.score_hits == 1
+    assert store.misses == 7
+    store.close()
@@ -0,0 +1,83 @@
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from PIL import Image
+
+from model_backends import create_model
+from sharded_eval import ShardedRunner
+
+MODEL_CONFIG = {
+    "backend": "synthetic",
+    "model_name": "synthetic",
+    "responses": ["0", "1", "2", "garbage"],
+}
+
+
+class SyntheticWorker:
+    """Обработчик шарда поверх синтетической модели (батчами по два элемента)."""
+
+    def __init__(self, model_config: Dict[str, Any], prompt: str) -> None:
+        self.model = create_model(model_config)
+        self.prompt = prompt
+
+    def __call__(self, items: List[str]) -> List[str]:
+        results: List[str] = []
+        for start in range(0, len(items), 2):
+            batch = items[start : start + 2]
+            results.extend(self.model.predict_on_batch(batch, [self.prompt] * len(batch)))
+        return results
+
+
+class FailingWorker(SyntheticWorker):
+    def __call__(self, items: List[str]) -> List[str]:
+        raise ValueError("сбой обработчика")
+
+
+def test_two_shards_match_single_process() -> None:
+    items = [f"image_{i}.png" for i in range(23)]
+    expected = SyntheticWorker(MODEL_CONFIG, "prompt")(items)
+
+    with ShardedRunner(
+        SyntheticWorker, MODEL_CONFIG, ["cpu", "cpu"], worker_args=("prompt",), chunk_size=3
+    ) as runner:
+        first = list(runner.map(items))
+        # Повторный вызов переиспользует те же процессы
+        second = list(runner.map(items[:5]))
+
+    assert first == list(zip(items, expected, strict=True))
+    assert second == list(zip(items[:5], expected[:5], strict=True))
+
+
+def test_worker_error_stops_processes() -> None:
+    runner = ShardedRunner(FailingWorker, MODEL_CONFIG, ["cpu", "cpu"], worker_args=("prompt",))
+    with pytest.raises(RuntimeError, match="сбой обработчика"):
+        with runner:
+            processes = list(runner._processes)
+            list(runner.map(["image.png"]))
+    assert not any(process.is_alive() for process in processes)
+
+
+def test_classification_shards_match_single_process(tmp_path: Path) -> None:
+    pytest.importorskip("bench_utils")
+    from check_classifiication import ClassificationWorker
+
+    document_classes = {"invoice": "Счёт", "passport": "Паспорт", "receipt": "Чек"}
+    paths = []
+    for index in range(12):
+        class_name = list(document_classes)[index % 3]
+        path = tmp_path / class_name / "images" / "test" / f"{index}.png"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", (8 + index, 8), (index, 0, 0)).save(path)
+        paths.append(path)
+    task_config = {"batch_size": 2}
+    worker_args = (task_config, "prompt", document_classes)
+
+    single = ClassificationWorker(MODEL_CONFIG, *worker_args)(paths)
+    with ShardedRunner(
+        ClassificationWorker, MODEL_CONFIG, ["cpu", "cpu"], worker_args, chunk_size=5
+    ) as runner:
+        sharded = [prediction for _, prediction in runner.map(paths)]
+
+    # Задержки вызовов различаются, предсказанные классы — нет
+    assert [label for label, _ in sharded] == [label for label, _ in single]
@@ -0,0 +1,49 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import pytest
+
+from text_metrics import batch_cer, batch_wer
+
+FIXTURE = Path(__file__).parent / "fixtures" / "text_metrics_pairs.json"
+
+
+@pytest.fixture(scope="module")
+def pairs() -> List[Dict[str, Any]]:
+    return json.loads(FIXTURE.read_text(encoding="utf-8"))
+
+
+def test_batch_cer_matches_per_pair_baseline(pairs: List[Dict[str, Any]]) -> None:
+    Levenshtein = pytest.importorskip("Levenshtein")
+    gt = [row["gt"] for row in pairs]
+    pred = [row["pred"] for row in pairs]
+    # Прежний расчёт: символьное расстояние по каждой паре отдельно
+    baseline = [Levenshtein.distance(a, b) / max(1, len(a)) for a, b in zip(gt, pred, strict=True)]
+
+    result = batch_cer(gt, pred)
+
+    np.testing.assert_allclose(result, baseline)
+    np.testing.assert_allclose(result, [row["cer"] for row in pairs])
+
+
+def test_batch_wer_is_token_level(pairs: List[Dict[str, Any]]) -> None:
+    result = batch_wer([row["gt"] for row in pairs], [row["pred"] for row in pairs])
+
+    np.testing.assert_allclose(result, [row["wer"] for row in pairs])
+
+
+def test_batch_wer_counts_whole_words() -> None:
+    # Одна заменённая буква — одна ошибка на слово, а не на символ
+    assert batch_wer(["Иванов Иван Иванович"], ["Иваноф Иван Иванович"]).tolist() == [1 / 3]
+
+
+def test_batch_metrics_reject_unequal_lengths() -> None:
+    with pytest.raises(ValueError):
+        batch_cer(["a", "b"], ["a"])
+
+
+def test_batch_metrics_empty_input() -> None:
+    assert batch_cer([], []).shape == (0,)
+    assert batch_wer([], []).shape == (0,)
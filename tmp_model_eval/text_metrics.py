@@ -0,0 +1,113 @@
+"""Пакетный расчёт CER и WER для пар (эталон, предсказание).
+
+Расстояния Левенштейна считаются в rapidfuzz: ``process.cpdist`` обходит
+все пары в нативном коде (и в нескольких потоках), без Python-цикла по
+ячейкам таблицы. WER считается по словам: каждое слово батча кодируется
+одним символом, после чего расстояние между закодированными строками равно
+числу вставок, удалений и замен слов.
+"""
+
+from typing import Dict, List, Sequence
+
+import numpy as np
+from rapidfuzz.distance import Levenshtein
+
+try:
+    from rapidfuzz.process import cpdist
+except ImportError:  # rapidfuzz < 3.6
+    cpdist = None
+
+# Суррогатные кодовые точки нельзя использовать как символы строки
+_SURROGATES_START = 0xD800
+_SURROGATES_END = 0xDFFF
+
+
+def _pairwise_distances(left: Sequence, right: Sequence) -> np.ndarray:
+    """Расстояния Левенштейна между ``left[i]`` и ``right[i]``."""
+    if len(left) != len(right):
+        raise ValueError(f"Разная длина последовательностей: {len(left)} и {len(right)}")
+    if not left:
+        return np.zeros(0, dtype=np.int64)
+    if cpdist is not None:
+        return np.asarray(
+            cpdist(left, right, scorer=Levenshtein.distance, workers=-1), dtype=np.int64
+        )
+    return np.fromiter(
+        (Levenshtein.distance(a, b) for a, b in zip(left, right, strict=True)),
+        dtype=np.int64,
+        count=len(left),
+    )
+
+
+def _codepoint(token_id: int) -> str:
+    """Символ для слова с номером ``token_id``; ValueError, если символы кончились."""
+    codepoint = token_id + 1
+    if codepoint >= _SURROGATES_START:
+        codepoint += _SURROGATES_END - _SURROGATES_START + 1
+    return chr(codepoint)
+
+
+def _encode_tokens(texts: Sequence[List[str]], vocab: Dict[str, str]) -> List[str]:
+    """Кодирует списки слов строками, где каждому слову соответствует символ."""
+    encoded = []
+    for tokens in texts:
+        chars = []
+        for token in tokens:
+            char = vocab.get(token)
+            if char is None:
+                char = _codepoint(len(vocab))
+                vocab[token] = char
+            chars.append(char)
+        encoded.append("".join(chars))
+    return encoded
+
+
+def batch_cer(gt: Sequence[str], pred: Sequence[str]) -> np.ndarray:
+    """Вычисляет CER для каждой пары строк.
+
+    Args:
+        gt (Sequence[str]): Эталонные строки.
+        pred (Sequence[str]): Предсказанные строки.
+
+    Returns:
+        np.ndarray: Символьное расстояние Левенштейна, делённое на
+        ``max(1, len(gt))``.
+    """
+    distances = _pairwise_distances(list(gt), list(pred))
+    lengths = np.fromiter((len(s) for s in gt), dtype=np.int64, count=len(gt))
+    return distances / np.maximum(lengths, 1)
+
+
+def batch_wer(gt: Sequence[str], pred: Sequence[str]) -> np.ndarray:
+    """Вычисляет WER (по словам) для каждой пары строк.
+
+    Слова — результат ``str.split()``.
+
+    Args:
+        gt (Sequence[str]): Эталонные строки.
+        pred (Sequence[str]): Предсказанные строки.
+
+    Returns:
+        np.ndarray: Число вставок, удалений и замен слов, делённое на
+        ``max(1, число слов в gt)``.
+    """
+    gt_tokens = [s.split() for s in gt]
+    pred_tokens = [s.split() for s in pred]
+    lengths = np.fromiter((len(t) for t in gt_tokens), dtype=np.int64, count=len(gt_tokens))
+
+    vocab: Dict[str, str] = {}
+    try:
+        gt_encoded = _encode_tokens(gt_tokens, vocab)
+        pred_encoded = _encode_tokens(pred_tokens, vocab)
+        distances = _pairwise_distances(gt_encoded, pred_encoded)
+    except ValueError:
+        # Слов больше, чем кодовых точек Unicode: сравниваем списки слов напрямую
+        distances = np.fromiter(
+            (
+                Levenshtein.distance(a, b)
+                for a, b in zip(gt_tokens, pred_tokens, strict=True)
+            ),
+            dtype=np.int64,
+            count=len(gt_tokens),
+        )
+    return distances / np.maximum(lengths, 1)